@@ -0,0 +1,315 @@
+import os
+
+# Run without a window or audio device
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from flight_game import (Game, InputState, ProjectileManager, SQUADRONS,
+                         SCREEN_WIDTH, SCREEN_HEIGHT, init_display)
+
+# Headless benchmarks for flight_game. Each scenario drives a seeded Game
+# through a fixed script of inputs and measures the time of every step.
+# Results can be saved as a baseline and later runs fail when they regress
+# past it.
+
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_TICKS = 2000
+WARMUP_TICKS = 120
+ALLOCATION_TICKS = 600
+
+class Scenario:
+    name = None
+    description = None
+
+    def __init__(self, seed, options):
+        self.options = options
+        self.game = Game(high_score=0, seed=seed, swarm=self.swarm_size(options), announce=False)
+        # Particles only use their own generator, seed it too so the run is repeatable
+        self.game.airplane.particles.rng = np.random.default_rng(seed)
+        self.setup()
+
+    def swarm_size(self, options):
+        return 0
+
+    def setup(self):
+        pass
+
+    def controls(self, tick):
+        return InputState(up=True)
+
+    def prepare(self, tick):
+        # Untimed work before each step. Keeps the player alive and holds the
+        # current wave so every run measures the same kind of work.
+        game = self.game
+        game.airplane.health = 100
+        game.airplane.fuel = 100
+        game.wave_start_time = game.clock.get_ticks()
+
+    def step(self, tick):
+        self.game.update(self.controls(tick))
+
+class CruiseScenario(Scenario):
+    name = "cruise"
+    description = "wave 1, flying a slow weave"
+
+    def controls(self, tick):
+        # Turn left, fly straight, turn right, fly straight
+        phase = tick // 90 % 4
+        return InputState(left=phase == 0, right=phase == 2, up=tick % 240 < 120)
+
+class DogfightScenario(Scenario):
+    name = "dogfight"
+    description = "wave 5 with extra enemy planes, turning and shooting"
+
+    def setup(self):
+        game = self.game
+        game.current_wave = 5
+        game.initialize_wave(5)
+        missing = self.options.enemies - len(game.squadron)
+        if missing > 0:
+            game.squadron.spawn(SQUADRONS["classic"], missing)
+
+    def controls(self, tick):
+        return InputState(left=tick // 120 % 2 == 0, up=True, shoot=True)
+
+class SwarmScenario(DogfightScenario):
+    name = "swarm"
+    description = "wave 5 against a swarm squadron flying in formation"
+
+    def swarm_size(self, options):
+        return options.swarm
+
+    def setup(self):
+        self.game.current_wave = 5
+        self.game.initialize_wave(5)
+
+class StressScenario(Scenario):
+    name = "stress"
+    description = "hundreds of obstacles and bullets on screen"
+
+    def setup(self):
+        self.game.current_wave = 3
+        self.game.initialize_wave(3)
+
+    def prepare(self, tick):
+        super().prepare(tick)
+        game = self.game
+        # Top the obstacles and bullets back up after collisions and culling
+        while len(game.obstacles) < self.options.obstacles:
+            game.obstacles.append(game.obstacle_pool.acquire())
+        projectiles = game.projectiles
+        missing = self.options.bullets - projectiles.count(ProjectileManager.PLAYER)
+        for _ in range(max(0, missing)):
+            projectiles.spawn(random.randint(0, SCREEN_WIDTH), random.randint(0, SCREEN_HEIGHT),
+                              random.uniform(0, 360), 10, ProjectileManager.PLAYER, owner=game.airplane)
+
+    def controls(self, tick):
+        return InputState(right=True, up=True, shoot=True)
+
+class RenderScenario(Scenario):
+    name = "render"
+    description = "drawing a wave 5 frame, simulation not timed"
+
+    def setup(self):
+        game = self.game
+        self.screen = init_display()
+        game.current_wave = 5
+        game.initialize_wave(5)
+        missing = self.options.enemies - len(game.squadron)
+        if missing > 0:
+            game.squadron.spawn(SQUADRONS["classic"], missing)
+
+    def prepare(self, tick):
+        # Advance the simulation every other frame so interpolation is exercised
+        super().prepare(tick)
+        if tick % 2 == 0:
+            self.game.update(InputState(left=True, up=True, shoot=True))
+
+    def step(self, tick):
+        self.game.draw(self.screen, (tick % 2) * 0.5)
+
+SCENARIOS = {scenario.name: scenario for scenario in
+             (CruiseScenario, DogfightScenario, SwarmScenario, StressScenario, RenderScenario)}
+
+def run_steps(scenario, ticks, first_tick=0):
+    # Time each step on its own, returns the times in milliseconds
+    times = np.zeros(ticks)
+    perf_counter = time.perf_counter
+    for i in range(ticks):
+        tick = first_tick + i
+        scenario.prepare(tick)
+        begin = perf_counter()
+        scenario.step(tick)
+        times[i] = perf_counter() - begin
+    return times * 1000
+
+def measure_allocations(scenario_class, seed, options):
+    # Separate pass since tracing slows every allocation down
+    scenario = scenario_class(seed, options)
+    run_steps(scenario, WARMUP_TICKS)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    run_steps(scenario, ALLOCATION_TICKS, WARMUP_TICKS)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    retained = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    return {"peak_kib": peak / 1024, "retained_kib": retained / 1024, "retained_blocks": blocks}
+
+def run_scenario(scenario_class, options):
+    scenario = scenario_class(options.seed, options)
+    run_steps(scenario, WARMUP_TICKS)
+    times = run_steps(scenario, options.ticks, WARMUP_TICKS)
+    p50, p95, p99 = np.percentile(times, (50, 95, 99))
+    result = {
+        "ticks_per_sec": len(times) / (times.sum() / 1000),
+        "mean_ms": times.mean(),
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "max_ms": times.max(),
+        "options": scenario_options(scenario_class, options),
+    }
+    if options.allocations:
+        result.update(measure_allocations(scenario_class, options.seed, options))
+    return result
+
+def scenario_options(scenario_class, options):
+    # The options a result depends on, a baseline only applies to the same ones
+    used = {"seed": options.seed, "ticks": options.ticks}
+    if scenario_class in (DogfightScenario, RenderScenario):
+        used["enemies"] = options.enemies
+    if scenario_class is SwarmScenario:
+        used["swarm"] = options.swarm
+    if scenario_class is StressScenario:
+        used["obstacles"] = options.obstacles
+        used["bullets"] = options.bullets
+    return used
+
+def compare(name, result, baseline, tolerance):
+    # Returns the list of regressions against the baseline, or None when
+    # the baseline doesn't apply
+    if baseline.get("options") != result["options"]:
+        print(f"  {name}: baseline was recorded with different options, not compared")
+        return None
+    regressions = []
+    if result["ticks_per_sec"] < baseline["ticks_per_sec"] * (1 - tolerance):
+        regressions.append(f"ticks/sec {result['ticks_per_sec']:.0f} < baseline {baseline['ticks_per_sec']:.0f}")
+    if result["p95_ms"] > baseline["p95_ms"] * (1 + tolerance):
+        regressions.append(f"p95 {result['p95_ms']:.3f} ms > baseline {baseline['p95_ms']:.3f} ms")
+    if "peak_kib" in result and "peak_kib" in baseline:
+        if result["peak_kib"] > baseline["peak_kib"] * (1 + tolerance) + 64:
+            regressions.append(f"peak memory {result['peak_kib']:.0f} KiB > baseline {baseline['peak_kib']:.0f} KiB")
+    return regressions
+
+def print_result(name, result):
+    print(f"{name:<10}{result['ticks_per_sec']:>10.0f}{result['p50_ms']:>9.3f}{result['p95_ms']:>9.3f}"
+          f"{result['p99_ms']:>9.3f}{result['max_ms']:>9.3f}", end="")
+    if "peak_kib" in result:
+        print(f"{result['peak_kib']:>10.0f}{result['retained_kib']:>10.1f}{result['retained_blocks']:>8}", end="")
+    print()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless flight_game benchmarks")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS,
+                        help="measured steps per scenario (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed for the scenarios (default: %(default)s)")
+    parser.add_argument("--enemies", type=int, default=12,
+                        help="enemy planes in the dogfight and render scenarios (default: %(default)s)")
+    parser.add_argument("--swarm", type=int, default=150,
+                        help="enemy planes in the swarm scenario (default: %(default)s)")
+    parser.add_argument("--obstacles", type=int, default=300,
+                        help="obstacles in the stress scenario (default: %(default)s)")
+    parser.add_argument("--bullets", type=int, default=300,
+                        help="bullets in flight in the stress scenario (default: %(default)s)")
+    parser.add_argument("--no-allocations", dest="allocations", action="store_false",
+                        help="skip the tracemalloc allocation pass")
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help="baseline file to compare against (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed regression as a fraction of the baseline (default: %(default)s)")
+    options = parser.parse_args(argv)
+    for name in options.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name!r}, choose from {', '.join(SCENARIOS)}")
+    return options
+
+def main(argv=None):
+    options = parse_args(argv)
+    names = options.scenarios or list(SCENARIOS)
+
+    print(f"{'scenario':<10}{'ticks/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}", end="")
+    if options.allocations:
+        print(f"{'peak KiB':>10}{'kept KiB':>10}{'blocks':>8}", end="")
+    print()
+    results = {}
+    for name in names:
+        result = run_scenario(SCENARIOS[name], options)
+        results[name] = result
+        print_result(name, result)
+
+    if options.save_baseline:
+        baselines = {}
+        try:
+            with open(options.baseline) as file:
+                baselines = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (OSError, json.JSONDecodeError) as error:
+            print(f"Can't update the baseline at {options.baseline}: {error}")
+            return 1
+        baselines.update(results)
+        with open(options.baseline, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {options.baseline}")
+        return 0
+
+    try:
+        with open(options.baseline) as file:
+            baselines = json.load(file)
+    except FileNotFoundError:
+        print(f"No baseline at {options.baseline}, run with --save-baseline to record one")
+        return 0
+    except (OSError, json.JSONDecodeError) as error:
+        print(f"Can't read the baseline at {options.baseline}: {error}")
+        return 1
+    if not isinstance(baselines, dict):
+        print(f"Can't read the baseline at {options.baseline}: expected a JSON object")
+        return 1
+
+    failed = False
+    compared = 0
+    for name, result in results.items():
+        if name not in baselines:
+            continue
+        regressions = compare(name, result, baselines[name], options.tolerance)
+        if regressions is None:
+            continue
+        compared += 1
+        for regression in regressions:
+            print(f"  REGRESSION {name}: {regression}")
+        failed = failed or bool(regressions)
+    if failed:
+        return 1
+    if compared:
+        print(f"No regressions against the baseline ({compared} scenarios compared)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
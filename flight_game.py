@@ -1,22 +1,43 @@
+import time
+
+# Taken before the heavy imports so --startup-profile can report them
+IMPORT_START_TIME = time.perf_counter()
+
 import pygame
+import numpy as np
 import math
 import random
+import os
 import sys
+import argparse
+import threading
+import queue
+import gc
+import copy
+import sqlite3
+import struct
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from pygame import gfxdraw
 
-# Initialize pygame
-pygame.init()
-
 # Screen dimensions
 SCREEN_WIDTH = 1024
 SCREEN_HEIGHT = 768
 
+# Simulation timing. Per-tick movement values were tuned for 60 ticks per
+# second and are scaled by SimulationClock.dt at other tick rates.
+BASE_TICK_RATE = 60
+TICK_RATE = 60
+MAX_TICKS_PER_FRAME = 5  # Drop simulation time beyond this to avoid a spiral of death
+
 # Colors
 SKY_BLUE = (135, 206, 235)
 GROUND_GREEN = (34, 139, 34)
 MOUNTAIN_BROWN = (139, 69, 19)
 CLOUD_WHITE = (255, 255, 255)
 PLANE_COLOR = (200, 0, 0)
+PLAYER_COLORS = [PLANE_COLOR, (0, 140, 0)]  # One per player in multiplayer games
 ENEMY_COLOR = (50, 50, 200)
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -25,204 +46,1158 @@ BLUE = (0, 0, 255)
 RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 
-# Create the screen
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Wave-Based Flight Combat Game")
-
-# Clock for controlling frame rate
-clock = pygame.time.Clock()
-
-# Load sound effects
-try:
-    pygame.mixer.init()
-    engine_sound = pygame.mixer.Sound("engine.wav")
-    engine_sound.set_volume(0.3)
-    engine_sound.play(-1)  # Loop indefinitely
-    collect_sound = pygame.mixer.Sound("collect.wav")
-    hit_sound = pygame.mixer.Sound("hit.wav")
-    shoot_sound = pygame.mixer.Sound("shoot.wav")
-except:
-    print("Sound files not found. Game will run without sound.")
-
-class Particle:
-    def __init__(self, x, y, color=(255, 255, 255)):
-        self.x = x
-        self.y = y
-        self.size = random.randint(1, 3)
-        self.color = color
-        self.lifetime = random.randint(10, 30)
-        self.velocity_x = random.uniform(-1, 1)
-        self.velocity_y = random.uniform(-1, 1)
+class InputState:
+    # Controls read by the simulation for one tick. The game loop fills it
+    # from the keyboard; bots and tests can build one directly. The
+    # simulation never modifies it, so from_keys() and from_mask() hand out
+    # one shared instance per key combination instead of a new one per tick.
+    __slots__ = ("left", "right", "up", "down", "shoot")
+    by_mask = {}
+    
+    def __init__(self, left=False, right=False, up=False, down=False, shoot=False):
+        self.left = left
+        self.right = right
+        self.up = up
+        self.down = down
+        self.shoot = shoot
+        
+    @classmethod
+    def from_keys(cls, keys):
+        # Build from the sequence returned by pygame.key.get_pressed()
+        return cls.from_mask(bool(keys[pygame.K_LEFT]) | bool(keys[pygame.K_RIGHT]) << 1 |
+                             bool(keys[pygame.K_UP]) << 2 | bool(keys[pygame.K_DOWN]) << 3 |
+                             bool(keys[pygame.K_SPACE]) << 4)
+                   
+    def to_mask(self):
+        # One bit per control, the format used by input recordings
+        return (self.left | self.right << 1 | self.up << 2 | self.down << 3 | self.shoot << 4)
+        
+    @classmethod
+    def from_mask(cls, mask):
+        controls = cls.by_mask.get(mask)
+        if controls is None:
+            controls = cls(left=bool(mask & 1), right=bool(mask & 2), up=bool(mask & 4),
+                           down=bool(mask & 8), shoot=bool(mask & 16))
+            cls.by_mask[mask] = controls
+        return controls
+
+# Assets are looked up next to the game, not in the working directory
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Assets loaded in the background at startup, by name. type picks the
+# loader, the other keys are its parameters.
+ASSET_MANIFEST = {
+    "engine": {"type": "sound", "path": "engine.wav", "volume": 0.3},
+    "collect": {"type": "sound", "path": "collect.wav"},
+    "hit": {"type": "sound", "path": "hit.wav"},
+    "shoot": {"type": "sound", "path": "shoot.wav"},
+    # The font sizes used by the HUD, overlays and power-up icons
+    "font 16": {"type": "font", "name": None, "size": 16},
+    "font 20": {"type": "font", "name": None, "size": 20},
+    "font 24": {"type": "font", "name": None, "size": 24},
+    "font 36": {"type": "font", "name": None, "size": 36},
+    "font 72": {"type": "font", "name": None, "size": 72},
+}
+
+class AssetManager:
+    # Loads sounds and fonts and keeps them, keyed by their type and
+    # parameters, so the same asset is only ever loaded once. Assets are asked
+    # for by manifest name or by a spec dict like the manifest's. get() never
+    # blocks: it returns None while an asset is pending or when it failed to
+    # load. load() loads it on the spot if the background loader hasn't yet,
+    # and tries again if an earlier load failed.
+    def __init__(self, manifest=None, directory=ASSET_DIR):
+        self.manifest = manifest if manifest is not None else {}
+        self.directory = directory
+        self.keys = {name: self.key(spec) for name, spec in self.manifest.items()}
+        self.assets = {}  # Key -> asset, None when it couldn't be loaded
+        self.names = {key: name for name, key in self.keys.items()}
+        self.bytes = {}  # Key -> estimated memory use
+        self.load_ms = {}  # Key -> time spent loading
+        # One lock per asset, so loading a font never waits on the mixer
+        # or a sound being decoded on another thread
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.loaded = threading.Event()  # Set once the manifest is loaded
+        
+    @staticmethod
+    def key(spec):
+        return tuple(sorted(spec.items()))
+        
+    def spec_key(self, asset):
+        if isinstance(asset, str):
+            return self.manifest[asset], self.keys[asset]
+        return asset, self.key(asset)
+        
+    def get(self, asset):
+        key = self.keys.get(asset) if isinstance(asset, str) else self.key(asset)
+        return self.assets.get(key)
+        
+    def lock(self, key):
+        with self.locks_lock:
+            lock = self.locks.get(key)
+            if lock is None:
+                lock = self.locks[key] = threading.Lock()
+            return lock
+            
+    def load(self, asset, record_failure=False):
+        # Returns the asset, or None when it can't be loaded. Only the
+        # background loader records failures, for status() and report();
+        # an asset asked for on demand is tried again next time.
+        spec, key = self.spec_key(asset)
+        loaded = self.assets.get(key)
+        if loaded is not None:
+            return loaded
+        with self.lock(key):
+            loaded = self.assets.get(key)
+            if loaded is not None:
+                return loaded
+            begin = time.perf_counter()
+            params = {name: value for name, value in spec.items() if name != "type"}
+            try:
+                loaded, size = getattr(self, "load_" + spec["type"])(**params)
+            except (pygame.error, OSError):
+                if record_failure:
+                    self.load_ms[key] = (time.perf_counter() - begin) * 1000
+                    self.bytes[key] = 0
+                    self.assets[key] = None
+                return None
+            self.load_ms[key] = (time.perf_counter() - begin) * 1000
+            self.bytes[key] = size
+            self.assets[key] = loaded
+            return loaded
+            
+    def font(self, size, name=None):
+        return self.load({"type": "font", "name": name, "size": size})
+        
+    def load_sound(self, path, volume=1.0):
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        sound = pygame.mixer.Sound(os.path.join(self.directory, path))
+        sound.set_volume(volume)
+        frequency, sample_format, channels = pygame.mixer.get_init()
+        return sound, int(sound.get_length() * frequency) * channels * abs(sample_format) // 8
+        
+    def load_font(self, name, size):
+        font = pygame.font.SysFont(name, size)
+        # Estimated by the size of the font file
+        if name is None:
+            path = os.path.join(os.path.dirname(pygame.__file__), pygame.font.get_default_font())
+        else:
+            path = pygame.font.match_font(name)
+        try:
+            size = os.path.getsize(path) if path else 0
+        except OSError:
+            size = 0
+        return font, size
+        
+    def status(self, asset):
+        _, key = self.spec_key(asset)
+        if key not in self.assets:
+            return "pending"
+        return "ready" if self.assets[key] is not None else "missing"
+        
+    def pending(self):
+        return [name for name, key in self.keys.items() if key not in self.assets]
+        
+    def missing(self, type=None):
+        return [name for name in self.manifest if self.status(name) == "missing"
+                and (type is None or self.manifest[name]["type"] == type)]
+        
+    def memory(self):
+        return sum(self.bytes.values())
+        
+    def load_async(self, on_loaded=None):
+        # Load the manifest on a background thread so the first frame isn't
+        # held up by the mixer or disk
+        def run():
+            for name in self.manifest:
+                self.load(name, record_failure=True)
+            self.loaded.set()
+            if on_loaded is not None:
+                on_loaded()
+        thread = threading.Thread(target=run, name="asset-loader", daemon=True)
+        thread.start()
+        return thread
+        
+    def report(self):
+        missing = sum(loaded is None for loaded in list(self.assets.values()))
+        print(f"Assets ({len(self.assets) - missing} ready, {missing} missing, {len(self.pending())} pending, "
+              f"{self.memory() / 1024:.0f} KiB):")
+        for key, loaded in list(self.assets.items()):
+            spec = dict(key)
+            name = self.names.get(key, f"{spec['type']} {spec.get('path') or spec.get('size')}")
+            status = "ready" if loaded is not None else "missing"
+            print(f"  {name:<16}{spec['type']:<7}{status:<9}{self.load_ms[key]:8.1f} ms{self.bytes[key] / 1024:8.0f} KiB")
+            
+# Every sound and font the game uses goes through this manager
+assets = AssetManager(ASSET_MANIFEST)
+
+class SoundBank:
+    # Named sound effects played by the simulation. Sounds that haven't
+    # loaded yet are skipped. A bank without assets (the default for headless
+    # use) plays nothing and never touches the mixer.
+    def __init__(self, assets=None):
+        self.assets = assets
+        
+    def play(self, name, loops=0):
+        if self.assets is None:
+            return
+        sound = self.assets.get(name)
+        if sound is not None:
+            sound.play(loops)
+
+class StartupProfile:
+    # Wall-clock timings of the startup phases, printed with --startup-profile
+    def __init__(self, enabled=False, start_time=IMPORT_START_TIME):
+        self.enabled = enabled
+        self.start_time = start_time
+        self.phases = []
+        self.reported = False  # Set once the first report has been printed
+        self.lock = threading.Lock()  # Background loaders record phases too
+        
+    @contextmanager
+    def phase(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, begin, time.perf_counter())
+            
+    def record(self, name, begin, end):
+        with self.lock:
+            self.phases.append((name, begin, end))
+            
+    def report(self, title):
+        # Print the phases recorded since the last report
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+            self.phases.clear()
+            self.reported = True
+        if not self.enabled or not phases:
+            return
+        print(f"Startup profile ({title}):")
+        for name, begin, end in phases:
+            print(f"  {name:<28}{(end - begin) * 1000:8.1f} ms   done at {(end - self.start_time) * 1000:8.1f} ms")
+
+class FrameProfiler:
+    # Hot-path timing scopes. Each named scope accumulates its time over a
+    # frame; end_frame() pushes the per-frame totals into fixed-size ring
+    # buffers from which rolling percentiles are computed. While disabled,
+    # start() and stop() return straight away.
+    PERCENTILES = (50, 95, 99)
+    
+    def __init__(self, history=240, enabled=False):
+        self.history = history
+        self.enabled = enabled
+        self.starts = {}
+        self.current = {}
+        self.samples = OrderedDict()  # Scope name -> ring buffer of ms per frame
+        self.frame_samples = np.zeros(history)
+        self.index = 0
+        self.filled = 0
+        self.frame_start = None
+        self.stats = None  # Percentiles, refreshed every few frames
+        self.stats_age = 0
+        self.background = None
+        
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.reset()
+        
+    def reset(self):
+        self.starts.clear()
+        self.current.clear()
+        self.samples.clear()
+        self.frame_samples[:] = 0
+        self.index = 0
+        self.filled = 0
+        self.frame_start = None
+        self.stats = None
+        
+    def start(self, name):
+        if not self.enabled:
+            return
+        self.starts[name] = time.perf_counter()
         
-    def update(self):
-        self.x += self.velocity_x
-        self.y += self.velocity_y
-        self.lifetime -= 1
+    def stop(self, name):
+        if not self.enabled:
+            return
+        begin = self.starts.pop(name, None)
+        if begin is not None:
+            self.current[name] = self.current.get(name, 0.0) + (time.perf_counter() - begin) * 1000
+            
+    def end_frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            index = self.index
+            self.frame_samples[index] = (now - self.frame_start) * 1000
+            for name, buffer in self.samples.items():
+                buffer[index] = self.current.pop(name, 0.0)
+            # Scopes seen for the first time get a fresh buffer
+            for name, elapsed in self.current.items():
+                buffer = np.zeros(self.history)
+                buffer[index] = elapsed
+                self.samples[name] = buffer
+            self.current.clear()
+            self.index = (index + 1) % self.history
+            self.filled = min(self.filled + 1, self.history)
+            self.stats_age += 1
+        self.frame_start = now
+        
+    def percentiles(self):
+        # [(name, (p50, p95, p99))] with the whole frame first
+        if self.filled == 0:
+            return []
+        rows = [("frame", np.percentile(self.frame_samples[:self.filled], self.PERCENTILES))]
+        for name, buffer in self.samples.items():
+            rows.append((name, np.percentile(buffer[:self.filled], self.PERCENTILES)))
+        return rows
+        
+    def recent_frames(self):
+        # Frame times oldest to newest
+        if self.filled < self.history:
+            return self.frame_samples[:self.filled]
+        return np.roll(self.frame_samples, -self.index)
+        
+    def draw(self, surface, budget_ms=1000 / 60, notes=()):
+        # Overlay with a frame-time graph, a percentile table and a line for
+        # each of notes. Returns the rect drawn to, as a list.
+        if self.stats is None or self.stats_age >= 30:
+            self.stats = self.percentiles()
+            self.stats_age = 0
+        line_height = 16
+        width = 330
+        graph_height = 60
+        height = graph_height + 30 + line_height * (len(self.stats) + len(notes))
+        x = 10
+        y = surface.get_height() - height - 10
+        panel = pygame.Rect(x, y, width, height)
+        if self.background is None or self.background.get_size() != panel.size:
+            self.background = pygame.Surface(panel.size, pygame.SRCALPHA)
+            self.background.fill((0, 0, 0, 170))
+        surface.blit(self.background, panel.topleft)
+        
+        # Frame-time graph, scaled so twice the budget fills the height
+        frames = self.recent_frames()
+        graph_bottom = y + 5 + graph_height
+        scale = graph_height / (budget_ms * 2)
+        budget_y = graph_bottom - int(budget_ms * scale)
+        pygame.draw.line(surface, GREEN, (x + 5, budget_y), (x + width - 5, budget_y))
+        if len(frames) > 1:
+            step = (width - 10) / (self.history - 1)
+            points = [(x + 5 + i * step, graph_bottom - min(graph_height, frame_ms * scale))
+                      for i, frame_ms in enumerate(frames.tolist())]
+            pygame.draw.lines(surface, YELLOW, False, points)
+            
+        # Percentile table, one right-aligned column per percentile
+        row_y = graph_bottom + 8
+        columns = (x + 200, x + 260, x + 320)
+        rows = [("scope", [f"p{p}" for p in self.PERCENTILES])]
+        rows += [(name, [f"{value:.2f}" for value in values]) for name, values in self.stats]
+        for name, cells in rows:
+            surface.blit(text_cache.render(name, WHITE, 16), (x + 5, row_y))
+            for right, cell in zip(columns, cells):
+                text = text_cache.render(cell, WHITE, 16)
+                surface.blit(text, (right - text.get_width(), row_y))
+            row_y += line_height
+        for note in notes:
+            surface.blit(text_cache.render(note, WHITE, 16), (x + 5, row_y))
+            row_y += line_height
+        return [panel]
+        
+    def report(self):
+        rows = self.percentiles()
+        if not rows:
+            return
+        print(f"Frame profile (last {self.filled} frames, ms):")
+        print(f"  {'scope':<24}{'p50':>8}{'p95':>8}{'p99':>8}")
+        for name, (p50, p95, p99) in rows:
+            print(f"  {name:<24}{p50:8.2f}{p95:8.2f}{p99:8.2f}")
+
+# Per-frame timing of the game loop stages, toggled with F3
+profiler = FrameProfiler()
+
+# Rendering quality levels, lowest first. particles: share of the engine
+# particles emitted, trail: share of each trail drawn, cloud_layers: parallax
+# layers drawn (nearest kept), snow_caps: snow on tall mountains, antialias:
+# anti-aliased sprites when --antialias allows it
+QUALITY_LEVELS = [
+    {"name": "low", "particles": 0.0, "trail": 0.25, "cloud_layers": 1, "snow_caps": False, "antialias": False},
+    {"name": "medium", "particles": 0.5, "trail": 0.5, "cloud_layers": 2, "snow_caps": False, "antialias": False},
+    {"name": "high", "particles": 1.0, "trail": 1.0, "cloud_layers": 3, "snow_caps": True, "antialias": False},
+    {"name": "ultra", "particles": 1.0, "trail": 1.0, "cloud_layers": 3, "snow_caps": True, "antialias": True},
+]
+
+class QualityGovernor:
+    # Picks the quality level from the time recent frames took to update
+    # and draw. Every half window it looks at the 90th percentile of the
+    # frames in the last window_ms: over downgrade_at of the budget drops a
+    # level straight away, while climbing a level takes upgrade_after_ms in a
+    # row under upgrade_at of the budget. The gap between the two thresholds
+    # and the wait keep it from flipping back and forth; an upgrade that
+    # doesn't hold doubles the wait for the next one. Windows and waits are
+    # measured in time, not frames, so they hold at any frame rate. While
+    # disabled the level stays put.
+    CAPACITY = 1024  # Most frames looked at per window
+    
+    def __init__(self, levels=QUALITY_LEVELS, budget_ms=1000 / 60, window_ms=500, downgrade_at=0.9,
+                 upgrade_at=0.6, upgrade_after_ms=3000, enabled=False):
+        self.levels = levels
+        self.level = len(levels) - 1
+        self.budget_ms = budget_ms
+        self.window_ms = window_ms
+        self.downgrade_at = downgrade_at
+        self.upgrade_at = upgrade_at
+        self.upgrade_after_ms = upgrade_after_ms
+        self.upgrade_wait_ms = upgrade_after_ms
+        self.enabled = enabled
+        self.samples = np.zeros(self.CAPACITY)
+        self.sample_times = np.zeros(self.CAPACITY)
+        self.filled = 0  # Samples since the last level change
+        self.now_ms = 0.0  # Time covered by the recorded frames
+        self.level_since = 0.0  # Time of the last level change
+        self.checked_at = 0.0  # Time of the last look at the window
+        self.calm_ms = 0.0  # Time in a row under the upgrade threshold
+        self.changed_at = 0.0
+        self.last_change = 0  # -1 down, 1 up
+        self.load_ms = 0.0  # Last 90th percentile looked at
+        
+    @property
+    def settings(self):
+        return self.levels[self.level]
+        
+    def names(self):
+        return [level["name"] for level in self.levels]
+        
+    def set_level(self, level):
+        self.level = max(0, min(len(self.levels) - 1, level))
+        self.filled = 0
+        self.level_since = self.now_ms
+        self.calm_ms = 0.0
+        
+    def record(self, frame_ms, elapsed_ms=None):
+        # frame_ms is the work the frame took, elapsed_ms the real time since
+        # the last frame (the same when frames run back to back). Returns True
+        # when the level changed.
+        if not self.enabled:
+            return False
+        self.now_ms += frame_ms if elapsed_ms is None else elapsed_ms
+        index = self.filled % self.CAPACITY
+        self.samples[index] = frame_ms
+        self.sample_times[index] = self.now_ms
+        self.filled += 1
+        if self.now_ms - self.level_since < self.window_ms or self.now_ms - self.checked_at < self.window_ms / 2:
+            return False
+        calm_ms = self.now_ms - self.checked_at
+        self.checked_at = self.now_ms
+        count = min(self.filled, self.CAPACITY)
+        recent = self.sample_times[:count] > self.now_ms - self.window_ms
+        self.load_ms = np.percentile(self.samples[:count][recent], 90)
+        if self.load_ms > self.budget_ms * self.downgrade_at:
+            self.calm_ms = 0.0
+            if self.level == 0:
+                return False
+            if self.last_change > 0 and self.now_ms - self.changed_at < self.upgrade_wait_ms:
+                self.upgrade_wait_ms = min(self.upgrade_wait_ms * 2, self.upgrade_after_ms * 8)
+            return self.change(-1)
+        if self.load_ms < self.budget_ms * self.upgrade_at:
+            self.calm_ms += calm_ms
+            if self.calm_ms >= self.upgrade_wait_ms and self.level < len(self.levels) - 1:
+                return self.change(1)
+        else:
+            self.calm_ms = 0.0
+        return False
         
+    def change(self, direction):
+        self.set_level(self.level + direction)
+        self.last_change = direction
+        self.changed_at = self.now_ms
+        return True
+
+# Rendering quality, adjusted to the frame budget with --quality auto
+quality = QualityGovernor()
+
+class SimulationClock:
+    # Game time advanced in fixed ticks by the simulation rather than read
+    # from the wall clock, so a slow frame can't slow the game down
+    def __init__(self, tick_rate=TICK_RATE):
+        self.tick_rate = tick_rate
+        self.tick_ms = 1000.0 / tick_rate
+        self.dt = BASE_TICK_RATE / tick_rate  # Movement scale relative to a 60 Hz tick
+        self.ticks = 0
+        
+    def advance(self):
+        self.ticks += 1
+        
+    def get_ticks(self):
+        # Milliseconds of simulated time, like pygame.time.get_ticks()
+        return self.ticks * self.tick_ms
+
+def interpolate(previous, current, alpha, wrap):
+    # Blend between the last two simulation states. A jump of more than half
+    # the wrap distance means the value wrapped around, so snap to it instead.
+    delta = current - previous
+    if abs(delta) > wrap / 2:
+        return current
+    return previous + delta * alpha
+
+def interpolate_array(previous, current, alpha, wrap):
+    # interpolate() for numpy arrays of values
+    delta = current - previous
+    return np.where(np.abs(delta) > wrap / 2, current, previous + delta * alpha)
+
+class TextCache:
+    # LRU cache of rendered text surfaces, so unchanged strings are only
+    # rasterized once. Fonts come from the asset manager.
+    def __init__(self, assets, max_entries=256):
+        self.assets = assets
+        self.surfaces = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        
+    def get_font(self, size, name=None):
+        # A font that can't be loaded falls back to the default one
+        font = self.assets.font(size, name)
+        if font is None and name is not None:
+            font = self.assets.font(size)
+        if font is None:
+            raise RuntimeError(f"Font {name or 'default'} at size {size} couldn't be loaded"
+                               f" (is pygame.font initialized?)")
+        return font
+        
+    def render(self, text, color, size, name=None):
+        key = ((name, size), text, color)
+        text_surface = self.surfaces.get(key)
+        if text_surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return text_surface
+            
+        self.misses += 1
+        text_surface = self.get_font(size, name).render(text, True, color)
+        self.surfaces[key] = text_surface
+        
+        # Evict the least recently used surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return text_surface
+        
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+# Text rendering cache shared by the HUD, collectibles and overlay screens
+text_cache = TextCache(assets)
+
+class ParticleSystem:
+    # Particles stored in preallocated NumPy arrays. All live particles are
+    # kept packed at the front of the arrays, advanced in one vectorized step
+    # per update and compacted in place when they die.
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.count = 0
+        self.position = np.zeros((capacity, 2), dtype=np.float32)
+        self.velocity = np.zeros((capacity, 2), dtype=np.float32)
+        self.lifetime = np.zeros(capacity, dtype=np.float32)
+        self.size = np.zeros(capacity, dtype=np.int32)
+        self.color = np.zeros((capacity, 3), dtype=np.int32)
+        self.rng = np.random.default_rng()
+        self.emitted = 0
+        self.dropped = 0
+        self.peak = 0
+        
+    def emit(self, x, y, color, count=1, color_spread=(0, 0, 0), jitter=0.0, speed=1.0,
+             lifetime=(10, 30), size=(1, 3)):
+        # Particles beyond capacity are dropped rather than growing the arrays
+        n = min(count, self.capacity - self.count)
+        self.dropped += count - max(n, 0)
+        if n <= 0:
+            return
+        new = slice(self.count, self.count + n)
+        rng = self.rng
+        self.position[new, 0] = x + rng.uniform(-jitter, jitter, n)
+        self.position[new, 1] = y + rng.uniform(-jitter, jitter, n)
+        self.velocity[new] = rng.uniform(-speed, speed, (n, 2))
+        self.lifetime[new] = rng.integers(lifetime[0], lifetime[1] + 1, n)
+        self.size[new] = rng.integers(size[0], size[1] + 1, n)
+        self.color[new] = np.asarray(color) + rng.integers(0, np.asarray(color_spread) + 1, (n, 3))
+        self.count += n
+        self.emitted += n
+        self.peak = max(self.peak, self.count)
+        
+    def scaled(self, count, scale):
+        # count * scale rounded up or down at random, keeping the average
+        scaled = count * scale
+        whole = int(scaled)
+        if scaled > whole and self.rng.random() < scaled - whole:
+            whole += 1
+        return whole
+        
+    def update(self, dt=1.0):
+        n = self.count
+        if n == 0:
+            return
+        self.position[:n] += self.velocity[:n] * dt
+        self.lifetime[:n] -= dt
+        
+        # Compact surviving particles to the front of the arrays
+        alive = self.lifetime[:n] > 0
+        live = int(np.count_nonzero(alive))
+        if live < n:
+            for array in (self.position, self.velocity, self.lifetime, self.size, self.color):
+                array[:live] = array[:n][alive]
+            self.count = live
+            
     def draw(self, surface):
-        if self.lifetime > 0:
-            pygame.draw.circle(surface, self.color, (int(self.x), int(self.y)), self.size)
-
-class Bullet:
-    def __init__(self, x, y, angle, speed=10, friendly=True):
-        self.x = x
-        self.y = y
-        self.angle = angle
-        self.speed = speed
-        self.size = 3
-        self.friendly = friendly  # True if player bullet, False if enemy bullet
+        # Returns one bounding rect per screen quadrant drawn in. Particles
+        # behind a plane that wraps around an edge sit on both sides, and a
+        # single bounding rect would cover the whole screen.
+        n = self.count
+        if n == 0:
+            return []
+        positions = self.position[:n].astype(np.int32)
+        width, height = surface.get_size()
+        quadrants = ((positions[:, 0] >= width // 2) + 2 * (positions[:, 1] >= height // 2)).tolist()
+        sizes = self.size[:n].tolist()
+        colors = self.color[:n].tolist()
+        bounds = {}
+        for position, size, color, quadrant in zip(positions.tolist(), sizes, colors, quadrants):
+            rect = pygame.draw.circle(surface, color, position, size)
+            if quadrant in bounds:
+                bounds[quadrant].union_ip(rect)
+            else:
+                bounds[quadrant] = rect
+        return list(bounds.values())
+            
+    def clear(self):
+        self.count = 0
         
-    def update(self):
-        angle_rad = math.radians(self.angle)
-        self.x += self.speed * math.cos(angle_rad)
-        self.y -= self.speed * math.sin(angle_rad)
+    def __len__(self):
+        return self.count
         
-    def draw(self, surface):
-        if self.friendly:
-            color = YELLOW
-        else:
-            color = RED
-        pygame.draw.circle(surface, color, (int(self.x), int(self.y)), self.size)
+    def stats(self):
+        # Slots are preallocated, so every emitted particle reuses one
+        return {"allocated": self.capacity, "reused": self.emitted, "peak": self.peak,
+                "live": self.count, "dropped": self.dropped}
+
+class ProjectileManager:
+    # Every bullet in the game, player and enemy, lives in one set of
+    # preallocated arrays. Velocity vectors are computed once when a bullet is
+    # fired, all bullets advance and off-screen ones are culled in one batched
+    # pass, and slots are handed out from a free list.
+    PLAYER = 0
+    ENEMY = 1
+    COLORS = {PLAYER: YELLOW, ENEMY: RED}
+    
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.prev_x = np.zeros(capacity)
+        self.prev_y = np.zeros(capacity)
+        self.vx = np.zeros(capacity)
+        self.vy = np.zeros(capacity)
+        self.size = np.zeros(capacity)
+        self.faction = np.zeros(capacity, dtype=np.int8)
+        self.owner = np.empty(capacity, dtype=object)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))  # Stack of unused slots
+        self.spawned = 0
+        self.dropped = 0
+        self.peak = 0
+        
+    def spawn(self, x, y, angle, speed, faction, owner=None, size=3):
+        # Returns the slot used, or -1 when every slot is taken
+        if not self.free:
+            self.dropped += 1
+            return -1
+        slot = self.free.pop()
+        self.spawned += 1
+        self.peak = max(self.peak, self.capacity - len(self.free))
+        angle_rad = math.radians(angle)
+        self.x[slot] = self.prev_x[slot] = x
+        self.y[slot] = self.prev_y[slot] = y
+        self.vx[slot] = speed * math.cos(angle_rad)
+        self.vy[slot] = -speed * math.sin(angle_rad)
+        self.size[slot] = size
+        self.faction[slot] = faction
+        self.owner[slot] = owner
+        self.active[slot] = True
+        return slot
+        
+    def release(self, slot):
+        if self.active[slot]:
+            self.active[slot] = False
+            self.owner[slot] = None
+            self.free.append(slot)
+            
+    def release_slots(self, slots):
+        for slot in slots.tolist():
+            self.release(slot)
+            
+    def clear(self, faction=None):
+        mask = self.active if faction is None else self.active & (self.faction == faction)
+        self.release_slots(np.flatnonzero(mask))
+        
+    def release_owner(self, owner):
+        self.release_slots(np.flatnonzero(self.active & (self.owner == owner)))
+        
+    def slots(self, faction=None):
+        mask = self.active if faction is None else self.active & (self.faction == faction)
+        return np.flatnonzero(mask)
+        
+    def count(self, faction=None):
+        return len(self.slots(faction))
         
-    def is_off_screen(self):
-        return (self.x < 0 or self.x > SCREEN_WIDTH or 
-                self.y < 0 or self.y > SCREEN_HEIGHT)
+    def stats(self):
+        return {"allocated": self.capacity, "reused": self.spawned, "peak": self.peak,
+                "live": self.capacity - len(self.free), "dropped": self.dropped}
+        
+    def update(self, dt=1.0):
+        live = np.flatnonzero(self.active)
+        if len(live) == 0:
+            return
+        self.prev_x[live] = self.x[live]
+        self.prev_y[live] = self.y[live]
+        self.x[live] += self.vx[live] * dt
+        self.y[live] += self.vy[live] * dt
+        
+        # Cull bullets that left the screen
+        x = self.x[live]
+        y = self.y[live]
+        off_screen = (x < 0) | (x > SCREEN_WIDTH) | (y < 0) | (y > SCREEN_HEIGHT)
+        if off_screen.any():
+            self.release_slots(live[off_screen])
+            
+    def hits(self, x, y, radius, faction):
+        # Slots of the given faction whose bullet overlaps the circle
+        live = self.slots(faction)
+        if len(live) == 0:
+            return live
+        reach = radius + self.size[live]
+        distance_sq = (self.x[live] - x) ** 2 + (self.y[live] - y) ** 2
+        return live[distance_sq < reach * reach]
+        
+    def draw(self, surface, alpha=1.0):
+        # Returns the rects of the bullets drawn
+        live = np.flatnonzero(self.active)
+        if len(live) == 0:
+            return []
+        x = self.prev_x[live] + (self.x[live] - self.prev_x[live]) * alpha
+        y = self.prev_y[live] + (self.y[live] - self.prev_y[live]) * alpha
+        colors = self.COLORS
+        return [pygame.draw.circle(surface, colors[faction], (bx, by), size)
+                for bx, by, size, faction in zip(x.astype(int).tolist(), y.astype(int).tolist(),
+                                                 self.size[live].astype(int).tolist(), self.faction[live].tolist())]
+
+class ObjectPool:
+    # Recycles released objects instead of creating new ones. Pooled classes
+    # set themselves up in spawn(*args), which __init__ calls too, so a
+    # reused object is indistinguishable from a new one. Every object handed
+    # out gets a new serial number, which tells a reused object apart from
+    # its earlier life.
+    def __init__(self, factory):
+        self.factory = factory
+        self.free = []
+        self.serial = 0
+        self.allocated = 0
+        self.reused = 0
+        self.live = 0
+        self.peak = 0
+        
+    def acquire(self, *args):
+        if self.free:
+            obj = self.free.pop()
+            obj.spawn(*args)
+            self.reused += 1
+        else:
+            obj = self.factory(*args)
+            self.allocated += 1
+        self.serial += 1
+        obj.serial = self.serial
+        self.live += 1
+        self.peak = max(self.peak, self.live)
+        return obj
+        
+    def release(self, obj):
+        self.live -= 1
+        self.free.append(obj)
+        
+    def release_all(self, objs):
+        for obj in objs:
+            self.release(obj)
+            
+    def stats(self):
+        return {"allocated": self.allocated, "reused": self.reused, "peak": self.peak,
+                "live": self.live, "free": len(self.free)}
+
+class SpatialHash:
+    # Uniform grid broad phase for collision checks. Objects are bucketed into
+    # every cell their bounding box touches and queries only return objects
+    # from the cells around the query point. Cell coordinates wrap around the
+    # screen edges the same way the planes do, so objects that have drifted
+    # slightly off screen still land in a valid bucket.
+    def __init__(self, cell_size=64, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        self.cell_size = cell_size
+        self.cols = max(1, math.ceil(width / cell_size))
+        self.rows = max(1, math.ceil(height / cell_size))
+        self.cells = {}
+        
+    def clear(self):
+        self.cells.clear()
+        
+    def cell_range(self, left, top, right, bottom):
+        cell_size = self.cell_size
+        x0, x1 = int(left // cell_size), int(right // cell_size)
+        y0, y1 = int(top // cell_size), int(bottom // cell_size)
+        
+        # A box wider than the grid touches every column exactly once
+        if x1 - x0 + 1 >= self.cols:
+            x0, x1 = 0, self.cols - 1
+        if y1 - y0 + 1 >= self.rows:
+            y0, y1 = 0, self.rows - 1
+            
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                yield (cx % self.cols, cy % self.rows)
+                
+    def insert_rect(self, obj, left, top, right, bottom):
+        cells = self.cells
+        for cell in self.cell_range(left, top, right, bottom):
+            bucket = cells.get(cell)
+            if bucket is None:
+                cells[cell] = [obj]
+            else:
+                bucket.append(obj)
+                
+    def insert(self, obj, x, y, radius):
+        self.insert_rect(obj, x - radius, y - radius, x + radius, y + radius)
+        
+    def query_rect(self, left, top, right, bottom):
+        # Returns candidates without duplicates, in a deterministic order
+        found = {}
+        cells = self.cells
+        for cell in self.cell_range(left, top, right, bottom):
+            bucket = cells.get(cell)
+            if bucket:
+                for obj in bucket:
+                    found[obj] = None
+        return list(found)
+        
+    def query(self, x, y, radius):
+        return self.query_rect(x - radius, y - radius, x + radius, y + radius)
+
+GRID_PAIRS_DENSE_LIMIT = 4096  # Pairs below which grid_pairs() doesn't bother with a grid
+
+def grid_pairs(query_x, query_y, x, y, radius, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+    # Vectorized broad phase for large groups: returns index arrays (i, j)
+    # pairing every query point i with each point j in the same or a
+    # neighbouring grid cell. Cells are at least radius wide and wrap around
+    # the screen edges, so every pair closer than radius is included. Points
+    # are sorted by cell, which makes each cell one contiguous run. Small
+    # groups skip the grid and get every pair, which is cheaper for them.
+    if len(query_x) * len(x) <= GRID_PAIRS_DENSE_LIMIT:
+        return (np.repeat(np.arange(len(query_x)), len(x)), np.tile(np.arange(len(x)), len(query_x)))
+    cols = max(1, int(width // radius))
+    rows = max(1, int(height // radius))
+    cell = ((np.floor(x * (cols / width)).astype(np.int64) % cols) * rows +
+            np.floor(y * (rows / height)).astype(np.int64) % rows)
+    order = np.argsort(cell, kind="stable")
+    starts = np.searchsorted(cell[order], np.arange(cols * rows + 1))
+    query_cx = np.floor(query_x * (cols / width)).astype(np.int64)
+    query_cy = np.floor(query_y * (rows / height)).astype(np.int64)
+    # Neighbour offsets that land on the same cell (a grid under 3 cells
+    # across) are only visited once
+    offsets = [(offset_x, offset_y) for offset_x in sorted({offset % cols for offset in (-1, 0, 1)})
+               for offset_y in sorted({offset % rows for offset in (-1, 0, 1)})]
+    offset_x = np.array([offset[0] for offset in offsets])
+    offset_y = np.array([offset[1] for offset in offsets])
+    neighbour = (((query_cx[:, None] + offset_x) % cols) * rows + (query_cy[:, None] + offset_y) % rows).ravel()
+    begin = starts[neighbour]
+    counts = starts[neighbour + 1] - begin
+    total = int(counts.sum())
+    first = np.cumsum(counts) - counts  # Where each neighbour's run starts in the output
+    pairs_i = np.repeat(np.repeat(np.arange(len(query_x)), len(offsets)), counts)
+    pairs_j = order[np.repeat(begin - first, counts) + np.arange(total)]
+    return pairs_i, pairs_j
+
+class SpriteCache:
+    # Entity sprites pre-rendered at quantized rotation angles, so drawing a
+    # rotated shape is a dictionary lookup plus a blit. Sprites are rendered
+    # lazily on first use and the least recently used ones are evicted once
+    # the cache grows past its memory budget.
+    def __init__(self, max_bytes=16 * 1024 * 1024, antialias=False):
+        self.sprites = OrderedDict()
+        self.max_bytes = max_bytes
+        self.antialias = antialias
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        
+    def get(self, key, angle, step, builder, *args, period=360):
+        # Shapes with rotational symmetry pass a smaller period (e.g. 72
+        # degrees for a 5-pointed star) so they need fewer sprites
+        steps = max(1, round(period / step))
+        index = round((angle % period) / period * steps) % steps
+        sprite_key = (key, index, self.antialias)
+        sprite = self.sprites.get(sprite_key)
+        if sprite is not None:
+            self.hits += 1
+            self.sprites.move_to_end(sprite_key)
+            return sprite
+            
+        self.misses += 1
+        sprite = builder(index * period / steps, self.antialias, *args)
+        if pygame.display.get_surface() is not None:
+            sprite = sprite.convert_alpha()
+        self.sprites[sprite_key] = sprite
+        self.bytes += sprite.get_width() * sprite.get_height() * sprite.get_bytesize()
+        
+        # Evict the least recently used sprites
+        while self.bytes > self.max_bytes and len(self.sprites) > 1:
+            _, evicted = self.sprites.popitem(last=False)
+            self.bytes -= evicted.get_width() * evicted.get_height() * evicted.get_bytesize()
+        return sprite
+        
+    def clear(self):
+        self.sprites.clear()
+        self.bytes = 0
+        
+    def set_antialias(self, antialias):
+        # Sprites are keyed by the setting, so old ones simply age out
+        self.antialias = antialias
+        
+    @staticmethod
+    def blit_centered(surface, sprite, x, y):
+        return surface.blit(sprite, (int(x) - sprite.get_width() // 2, int(y) - sprite.get_height() // 2))
+
+def draw_polygon(surface, color, points, antialias=False):
+    if antialias:
+        gfxdraw.aapolygon(surface, points, color)
+        gfxdraw.filled_polygon(surface, points, color)
+    else:
+        pygame.draw.polygon(surface, color, points)
+
+def draw_circle(surface, color, center, radius, antialias=False):
+    if antialias:
+        gfxdraw.aacircle(surface, center[0], center[1], radius, color)
+        gfxdraw.filled_circle(surface, center[0], center[1], radius, color)
+    else:
+        pygame.draw.circle(surface, color, center, radius)
+
+# Rotation sprites shared by every entity
+sprite_cache = SpriteCache()
+
+class Trail:
+    # Exhaust trail kept in a fixed-size ring buffer and drawn with a small set
+    # of pre-rendered alpha-graded stamps, so drawing it allocates no surfaces
+    __slots__ = ("length", "radius", "xs", "ys", "head", "count", "color", "levels", "stamps")
+    stamp_cache = {}
+    
+    def __init__(self, color, length=20, radius=2, levels=16):
+        self.length = length
+        self.radius = radius
+        self.xs = [0.0] * length
+        self.ys = [0.0] * length
+        self.head = 0  # Index of the next slot to write
+        self.count = 0
+        self.color = color
+        self.levels = levels
+        self.stamps = None  # Built on first draw so the simulation never creates surfaces
+        
+    @staticmethod
+    def get_stamps(color, radius, levels):
+        # Stamps are shared between every trail with the same look
+        key = (color, radius, levels)
+        stamps = Trail.stamp_cache.get(key)
+        if stamps is None:
+            stamps = []
+            for level in range(levels):
+                alpha = int(255 * (level / levels))
+                stamp = pygame.Surface((radius * 2 + 1, radius * 2 + 1), pygame.SRCALPHA)
+                pygame.draw.circle(stamp, (color[0], color[1], color[2], alpha), (radius, radius), radius)
+                stamps.append(stamp)
+            Trail.stamp_cache[key] = stamps
+        return stamps
+        
+    def add(self, x, y):
+        self.xs[self.head] = x
+        self.ys[self.head] = y
+        self.head = (self.head + 1) % self.length
+        if self.count < self.length:
+            self.count += 1
+            
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        
+    def __len__(self):
+        return self.count
+        
+    def draw(self, surface, share=1.0):
+        # Draws the newest share of the points. Returns the rect of every
+        # stamp drawn; a trail that wraps around the screen edge would make
+        # a single bounding rect cover the whole screen.
+        count = min(self.count, math.ceil(self.count * share))
+        if count == 0:
+            return []
+        if self.stamps is None:
+            self.stamps = Trail.get_stamps(self.color, self.radius, self.levels)
+            
+        # Oldest point is the most transparent, newest the most opaque
+        levels = len(self.stamps)
+        start = self.head - count
+        rects = []
+        for i in range(count):
+            index = (start + i) % self.length
+            stamp = self.stamps[i * levels // count]
+            rects.append(surface.blit(stamp, (self.xs[index] - self.radius, self.ys[index] - self.radius)))
+        return rects
 
 class Airplane:
-    def __init__(self):
-        self.x = SCREEN_WIDTH // 2
-        self.y = SCREEN_HEIGHT // 2
+    __slots__ = ("clock", "sounds", "projectiles", "x", "y", "prev_x", "prev_y", "prev_angle", "angle",
+                 "speed", "max_speed", "size", "health", "fuel", "invincible", "invincible_timer",
+                 "last_shot_time", "shoot_delay", "score", "trail", "particles", "color", "down")
+    
+    def __init__(self, clock=None, sounds=None, projectiles=None, color=PLANE_COLOR, position=None):
+        self.clock = clock if clock is not None else SimulationClock()
+        self.sounds = sounds if sounds is not None else SoundBank()
+        self.projectiles = projectiles if projectiles is not None else ProjectileManager()
+        self.color = color
+        self.x, self.y = position if position is not None else (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
         self.angle = 0  # Angle in degrees
+        self.prev_x = self.x
+        self.prev_y = self.y
+        self.prev_angle = self.angle
         self.speed = 3
         self.max_speed = 10
         self.size = 25
-        self.trail = []
-        self.particles = []
-        self.bullets = []
+        # Trail covers the same span of time at any tick rate
+        self.trail = Trail((min(255, color[0] + 50), min(255, color[1] + 50), min(255, color[2] + 50)),
+                           length=max(1, round(20 / self.clock.dt)))
+        self.particles = ParticleSystem()
         self.health = 100
         self.fuel = 100
         self.invincible = False
         self.invincible_timer = 0
         self.last_shot_time = 0
         self.shoot_delay = 300  # milliseconds between shots
-        self.score = 0  # This is just for tracking internally, the Game class manages the actual score
+        self.score = 0  # Points this plane scored itself; the Game keeps the shared score
+        self.down = False  # Out of the game: shot down or out of fuel
         
-    def draw(self, surface):
+    def draw(self, surface, alpha=1.0):
+        # Returns the list of rects touched
         # Draw trail
-        for i, pos in enumerate(self.trail):
-            alpha = int(255 * (i / len(self.trail)))
-            color = (min(255, PLANE_COLOR[0] + 50), min(255, PLANE_COLOR[1] + 50), min(255, PLANE_COLOR[2] + 50), alpha)
-            s = pygame.Surface((5, 5), pygame.SRCALPHA)
-            pygame.draw.circle(s, color, (2, 2), 2)
-            surface.blit(s, (pos[0] - 2, pos[1] - 2))
+        rects = self.trail.draw(surface, quality.settings["trail"])
         
         # Draw particles
-        for particle in self.particles:
-            particle.update()
-            particle.draw(surface)
+        rects.extend(self.particles.draw(surface))
         
-        # Remove dead particles
-        self.particles = [p for p in self.particles if p.lifetime > 0]
+        # Interpolate between the last two simulation ticks
+        x = interpolate(self.prev_x, self.x, alpha, SCREEN_WIDTH)
+        y = interpolate(self.prev_y, self.y, alpha, SCREEN_HEIGHT)
+        angle = self.prev_angle + (self.angle - self.prev_angle) * alpha
         
-        # Draw bullets
-        for bullet in self.bullets:
-            bullet.draw(surface)
+        # Draw the plane body
+        if self.invincible and self.clock.get_ticks() % 200 < 100:
+            # Flash if invincible
+            plane_color = (255, 255, 255)
+        else:
+            plane_color = self.color
+            
+        sprite = sprite_cache.get(("plane", self.size, plane_color), angle, 3,
+                                  Airplane.build_sprite, self.size, plane_color)
+        rects.append(SpriteCache.blit_centered(surface, sprite, x, y))
+        return rects
+    
+    @staticmethod
+    def build_sprite(angle, antialias, size, color):
+        # Render the plane pointing at angle, centered in its own surface
+        radius = size + 2
+        sprite = pygame.Surface((radius * 2 + 1, radius * 2 + 1), pygame.SRCALPHA)
+        x = y = radius
         
         # Calculate points for a triangle representing the plane
-        angle_rad = math.radians(self.angle)
+        angle_rad = math.radians(angle)
         
         # Nose of the plane
-        nose_x = self.x + self.size * math.cos(angle_rad)
-        nose_y = self.y - self.size * math.sin(angle_rad)
+        nose_x = x + size * math.cos(angle_rad)
+        nose_y = y - size * math.sin(angle_rad)
         
         # Right wing
         right_angle = angle_rad + 2.5  # Angle for right wing
-        right_x = self.x + (self.size * 0.8) * math.cos(right_angle)
-        right_y = self.y - (self.size * 0.8) * math.sin(right_angle)
+        right_x = x + (size * 0.8) * math.cos(right_angle)
+        right_y = y - (size * 0.8) * math.sin(right_angle)
         
         # Left wing
         left_angle = angle_rad - 2.5  # Angle for left wing
-        left_x = self.x + (self.size * 0.8) * math.cos(left_angle)
-        left_y = self.y - (self.size * 0.8) * math.sin(left_angle)
+        left_x = x + (size * 0.8) * math.cos(left_angle)
+        left_y = y - (size * 0.8) * math.sin(left_angle)
         
         # Tail points
-        tail_x = self.x - (self.size * 0.5) * math.cos(angle_rad)
-        tail_y = self.y + (self.size * 0.5) * math.sin(angle_rad)
+        tail_x = x - (size * 0.5) * math.cos(angle_rad)
+        tail_y = y + (size * 0.5) * math.sin(angle_rad)
         
         # Right tail
         right_tail_angle = angle_rad + 1.5
-        right_tail_x = tail_x + (self.size * 0.4) * math.cos(right_tail_angle)
-        right_tail_y = tail_y - (self.size * 0.4) * math.sin(right_tail_angle)
+        right_tail_x = tail_x + (size * 0.4) * math.cos(right_tail_angle)
+        right_tail_y = tail_y - (size * 0.4) * math.sin(right_tail_angle)
         
         # Left tail
         left_tail_angle = angle_rad - 1.5
-        left_tail_x = tail_x + (self.size * 0.4) * math.cos(left_tail_angle)
-        left_tail_y = tail_y - (self.size * 0.4) * math.sin(left_tail_angle)
+        left_tail_x = tail_x + (size * 0.4) * math.cos(left_tail_angle)
+        left_tail_y = tail_y - (size * 0.4) * math.sin(left_tail_angle)
         
-        # Draw the plane body
-        if self.invincible and pygame.time.get_ticks() % 200 < 100:
-            # Flash if invincible
-            plane_color = (255, 255, 255)
-        else:
-            plane_color = PLANE_COLOR
-            
         # Main body
-        pygame.draw.polygon(surface, plane_color, [
+        draw_polygon(sprite, color, [
             (nose_x, nose_y), 
             (right_x, right_y), 
             (tail_x, tail_y),
             (left_x, left_y)
-        ])
+        ], antialias)
         
         # Tail
-        pygame.draw.polygon(surface, plane_color, [
+        draw_polygon(sprite, color, [
             (tail_x, tail_y),
             (right_tail_x, right_tail_y),
             (left_tail_x, left_tail_y)
-        ])
+        ], antialias)
         
         # Draw a small cockpit
-        cockpit_x = self.x + (self.size * 0.3) * math.cos(angle_rad)
-        cockpit_y = self.y - (self.size * 0.3) * math.sin(angle_rad)
-        pygame.draw.circle(surface, BLACK, (int(cockpit_x), int(cockpit_y)), 4)
-        
-        # Add engine particles when moving fast
-        if self.speed > 5 and random.random() < 0.3:
-            for _ in range(2):
-                particle_x = tail_x + random.uniform(-2, 2)
-                particle_y = tail_y + random.uniform(-2, 2)
-                particle_color = (200 + random.randint(0, 55), 
-                                 100 + random.randint(0, 155), 
-                                 0)
-                self.particles.append(Particle(particle_x, particle_y, particle_color))
+        cockpit_x = x + (size * 0.3) * math.cos(angle_rad)
+        cockpit_y = y - (size * 0.3) * math.sin(angle_rad)
+        draw_circle(sprite, BLACK, (int(cockpit_x), int(cockpit_y)), 4, antialias)
+        return sprite
     
-    def update(self, keys, obstacles, collectibles, mountains, enemies):
+    def turn(self, controls):
+        dt = self.clock.dt
         # Handle rotation
-        if keys[pygame.K_LEFT]:
-            self.angle += 3
-        if keys[pygame.K_RIGHT]:
-            self.angle -= 3
+        if controls.left:
+            self.angle += 3 * dt
+        if controls.right:
+            self.angle -= 3 * dt
             
         # Handle speed
-        if keys[pygame.K_UP]:
-            self.speed = min(self.max_speed, self.speed + 0.1)
-            self.fuel = max(0, self.fuel - 0.05)  # Consume fuel
-        if keys[pygame.K_DOWN]:
-            self.speed = max(1, self.speed - 0.1)
-            
-        # Handle shooting
-        if keys[pygame.K_SPACE]:
-            self.shoot()
+        if controls.up:
+            self.speed = min(self.max_speed, self.speed + 0.1 * dt)
+            self.fuel = max(0, self.fuel - 0.05 * dt)  # Consume fuel
+        if controls.down:
+            self.speed = max(1, self.speed - 0.1 * dt)
             
+    def move(self):
         # Move the plane based on its angle and speed
+        dt = self.clock.dt
         angle_rad = math.radians(self.angle)
-        self.x += self.speed * math.cos(angle_rad)
-        self.y -= self.speed * math.sin(angle_rad)
+        self.x += self.speed * math.cos(angle_rad) * dt
+        self.y -= self.speed * math.sin(angle_rad) * dt
         
         # Add position to trail
-        self.trail.append((self.x, self.y))
-        if len(self.trail) > 20:  # Limit trail length
-            self.trail.pop(0)
+        self.trail.add(self.x, self.y)
         
         # Wrap around the screen
         if self.x > SCREEN_WIDTH:
@@ -235,66 +1210,90 @@ class Airplane:
         elif self.y < 0:
             self.y = SCREEN_HEIGHT
             
-        # Update bullets
-        for bullet in self.bullets[:]:
-            bullet.update()
-            if bullet.is_off_screen():
-                self.bullets.remove(bullet)
-                
-        # Check for bullet collisions with obstacles (stars)
-        hit_obstacles = []
-        for bullet in self.bullets[:]:
-            for obstacle in obstacles[:]:
-                # Calculate distance between bullet and obstacle
-                distance = math.sqrt((bullet.x - obstacle.x) ** 2 + (bullet.y - obstacle.y) ** 2)
-                if distance < (bullet.size + obstacle.size):
-                    # Remove bullet and mark obstacle for removal
-                    if bullet in self.bullets:
-                        self.bullets.remove(bullet)
-                    if obstacle not in hit_obstacles:
-                        hit_obstacles.append(obstacle)
-                    break
-                
-        # Check for collisions with obstacles
+    def burn_fuel(self):
+        dt = self.clock.dt
+        # Slowly decrease fuel
+        self.fuel = max(0, self.fuel - 0.01 * dt)
+        
+        # If out of fuel, slow down
+        if self.fuel <= 0:
+            self.speed = max(1, self.speed - 0.05 * dt)
+            
+    def fly(self, controls):
+        # First half of a tick: steer, shoot and move. turn(), move() and
+        # burn_fuel() only touch the plane itself, so a network client can
+        # use them to predict its own plane.
+        dt = self.clock.dt
+        self.prev_x = self.x
+        self.prev_y = self.y
+        self.prev_angle = self.angle
+        self.turn(controls)
+            
+        # Handle shooting
+        if controls.shoot:
+            self.shoot()
+            
+        self.move()
+            
+        # Update particles
+        self.particles.update(dt)
+        
+        # Add engine particles when moving fast. Only the particles' own
+        # generator depends on the quality, so replays don't.
+        if self.speed > 5 and random.random() < 0.3 * dt:
+            count = self.particles.scaled(2, quality.settings["particles"])
+            if count:
+                angle_rad = math.radians(self.angle)
+                tail_x = self.x - (self.size * 0.5) * math.cos(angle_rad)
+                tail_y = self.y + (self.size * 0.5) * math.sin(angle_rad)
+                self.particles.emit(tail_x, tail_y, (200, 100, 0), count=count,
+                                    color_spread=(55, 155, 0), jitter=2)
+        self.burn_fuel()
+        
+    def collide(self, obstacle_grid, collectibles, terrain, versus=False):
+        # Second half of a tick, once every bullet has moved: take damage and
+        # return the collectibles touched. In versus games other players'
+        # bullets hit too; the shooter, if the bullet has one, gets the points.
+        projectiles = self.projectiles
         if not self.invincible:
-            for obstacle in obstacles:
+            for obstacle in obstacle_grid.query(self.x, self.y, self.size):
                 if self.check_collision(obstacle):
                     self.health -= 10
                     self.invincible = True
-                    self.invincible_timer = pygame.time.get_ticks()
-                    try:
-                        hit_sound.play()
-                    except:
-                        pass
+                    self.invincible_timer = self.clock.get_ticks()
+                    self.sounds.play("hit")
                     break
                     
             # Check for collisions with mountains
-            for mountain in mountains:
-                if self.check_mountain_collision(mountain):
-                    self.health -= 15
-                    self.invincible = True
-                    self.invincible_timer = pygame.time.get_ticks()
-                    try:
-                        hit_sound.play()
-                    except:
-                        pass
-                    break
+            if terrain.collides(self.x, self.y):
+                self.health -= 15
+                self.invincible = True
+                self.invincible_timer = self.clock.get_ticks()
+                self.sounds.play("hit")
                     
             # Check for collisions with enemy bullets
-            for enemy in enemies:
-                for bullet in enemy.bullets[:]:
-                    if self.check_bullet_collision(bullet):
-                        self.health -= 5
-                        enemy.bullets.remove(bullet)
-                        self.invincible = True
-                        self.invincible_timer = pygame.time.get_ticks()
-                        try:
-                            hit_sound.play()
-                        except:
-                            pass
+            for slot in projectiles.hits(self.x, self.y, self.size, ProjectileManager.ENEMY).tolist():
+                self.health -= 5
+                projectiles.release(slot)
+                self.invincible = True
+                self.invincible_timer = self.clock.get_ticks()
+                self.sounds.play("hit")
+                
+            if versus:
+                for slot in projectiles.hits(self.x, self.y, self.size, ProjectileManager.PLAYER).tolist():
+                    shooter = projectiles.owner[slot]
+                    if shooter is self:
+                        continue
+                    self.health -= 10
+                    if shooter is not None:  # Bullets spawned without an owner score for no one
+                        shooter.score += 100
+                    projectiles.release(slot)
+                    self.invincible = True
+                    self.invincible_timer = self.clock.get_ticks()
+                    self.sounds.play("hit")
         else:
             # Check if invincibility should end
-            if pygame.time.get_ticks() - self.invincible_timer > 2000:  # 2 seconds
+            if self.clock.get_ticks() - self.invincible_timer > 2000:  # 2 seconds
                 self.invincible = False
                 
         # Check for collectibles and return the ones collected
@@ -302,211 +1301,379 @@ class Airplane:
         for collectible in collectibles:
             if self.check_collision(collectible):
                 collected_items.append(collectible)
-                
-        # Slowly decrease fuel
-        self.fuel = max(0, self.fuel - 0.01)
+        return collected_items
         
-        # If out of fuel, slow down
-        if self.fuel <= 0:
-            self.speed = max(1, self.speed - 0.05)
-            
-        # Check for hits on enemies
-        for enemy in enemies[:]:
-            for bullet in self.bullets[:]:
-                if enemy.check_bullet_collision(bullet):
-                    enemy.health -= 20
-                    self.bullets.remove(bullet)
-                    if enemy.health <= 0:
-                        enemies.remove(enemy)
-                        break
-    
-        # Return list of hit obstacles and collected items
-        return hit_obstacles, collected_items
-    
     def shoot(self):
-        current_time = pygame.time.get_ticks()
+        current_time = self.clock.get_ticks()
         if current_time - self.last_shot_time > self.shoot_delay:
             angle_rad = math.radians(self.angle)
             bullet_x = self.x + (self.size + 5) * math.cos(angle_rad)
             bullet_y = self.y - (self.size + 5) * math.sin(angle_rad)
-            self.bullets.append(Bullet(bullet_x, bullet_y, self.angle))
+            self.projectiles.spawn(bullet_x, bullet_y, self.angle, 10, ProjectileManager.PLAYER, owner=self)
             self.last_shot_time = current_time
-            try:
-                shoot_sound.play()
-            except:
-                pass
+            self.sounds.play("shoot")
     
     def check_collision(self, obj):
         # Simple distance-based collision detection
         distance = math.sqrt((self.x - obj.x) ** 2 + (self.y - obj.y) ** 2)
         return distance < (self.size + obj.size)
-        
-    def check_bullet_collision(self, bullet):
-        # Check if a bullet hits the plane
-        distance = math.sqrt((self.x - bullet.x) ** 2 + (self.y - bullet.y) ** 2)
-        return distance < (self.size + bullet.size)
-        
-    def check_mountain_collision(self, mountain):
-        # Check if plane is over mountain and below its peak
-        mountain_left = mountain.x - mountain.base_width // 2
-        mountain_right = mountain.x + mountain.base_width // 2
-        
-        if mountain_left <= self.x <= mountain_right:
-            # Calculate mountain height at this x position
-            # Mountain is a triangle, so height decreases linearly from center
-            distance_from_center = abs(self.x - mountain.x)
-            ratio = distance_from_center / (mountain.base_width / 2)
-            height_at_x = mountain.height * (1 - ratio)
-            
-            # Check if plane is below the mountain height at this position
-            mountain_y_at_x = SCREEN_HEIGHT - height_at_x
-            return self.y > mountain_y_at_x
-        return False
 
-class EnemyPlane:
-    def __init__(self):
-        # Start from a random edge of the screen
-        side = random.randint(0, 3)
-        if side == 0:  # Top
-            self.x = random.randint(0, SCREEN_WIDTH)
-            self.y = 0
-            self.angle = random.randint(225, 315)
-        elif side == 1:  # Right
-            self.x = SCREEN_WIDTH
-            self.y = random.randint(0, SCREEN_HEIGHT)
-            self.angle = random.randint(135, 225)
-        elif side == 2:  # Bottom
-            self.x = random.randint(0, SCREEN_WIDTH)
-            self.y = SCREEN_HEIGHT
-            self.angle = random.randint(45, 135)
-        else:  # Left
-            self.x = 0
-            self.y = random.randint(0, SCREEN_HEIGHT)
-            self.angle = random.randint(-45, 45)
+# Enemy squadron types:
+# count: planes spawned, flight_size: planes flying together in a V,
+# spacing: distance between formation slots, separation: radius planes keep
+# clear of each other, turn_rate: degrees per tick (0 turns instantly),
+# trail: trail length in ticks at 60 Hz (0 for none), health: hit points,
+# fire_delay: (min, max) milliseconds between shots, entry: (min, max)
+# milliseconds a new flight holds its entry heading before picking a goal
+SQUADRONS = {
+    "classic": {"count": 3, "flight_size": 1, "spacing": 0, "separation": 0, "turn_rate": 0,
+                "trail": 20, "health": 40, "fire_delay": (1000, 3000), "entry": (0, 0)},
+    "swarm": {"count": 120, "flight_size": 5, "spacing": 40, "separation": 32, "turn_rate": 4,
+              "trail": 0, "health": 20, "fire_delay": (4000, 9000), "entry": (2000, 5000)},
+}
+
+# Squadron flown in each wave that has enemies
+WAVE_SQUADRONS = {5: SQUADRONS["classic"]}
+
+class EnemySquadron:
+    # Every enemy plane of a wave, stepped together as arrays. Planes are
+    # grouped into flights that share a heading goal: the leader picks it
+    # every few seconds (chase the player or a random heading) and the
+    # wingmen steer for their V slot behind the leader. All planes also
+    # steer away from close neighbours. Arrays stay in spawn order so the
+    # first live plane of a flight is its leader.
+    SIZE = 20
+    
+    def __init__(self, clock=None, projectiles=None):
+        self.clock = clock if clock is not None else SimulationClock()
+        self.projectiles = projectiles if projectiles is not None else ProjectileManager()
+        # Drawn from the seeded global generator so replays stay deterministic
+        self.rng = np.random.default_rng(random.getrandbits(64))
+        self.config = SQUADRONS["classic"]
+        self.next_id = 0
+        self.next_flight = 0
+        self.clear()
+        
+    def clear(self):
+        self.ids = np.zeros(0, dtype=np.int64)  # Owner ids of their bullets
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.prev_x = np.zeros(0)
+        self.prev_y = np.zeros(0)
+        self.angle = np.zeros(0)
+        self.prev_angle = np.zeros(0)
+        self.speed = np.zeros(0)
+        self.health = np.zeros(0)
+        self.fire_timer = np.zeros(0)  # Milliseconds until the next shot
+        self.flight = np.zeros(0, dtype=np.int64)
+        self.slot_back = np.zeros(0)  # Formation slot behind and beside the leader
+        self.slot_side = np.zeros(0)
+        self.trails = []
+        self.goal = {}  # Flight -> heading goal in degrees
+        self.goal_timer = {}  # Flight -> milliseconds until a new goal
+        
+    def __len__(self):
+        return len(self.ids)
+        
+    def spawn(self, config, count=None):
+        # Add planes from the screen edges, flight by flight
+        self.config = config
+        count = config["count"] if count is None else count
+        flight_size = max(1, config["flight_size"])
+        spacing = config["spacing"]
+        low, high = config["fire_delay"]
+        rng = self.rng
+        trail_length = max(1, round(config["trail"] / self.clock.dt)) if config["trail"] else 0
+        trail_color = tuple(min(255, c + 50) for c in ENEMY_COLOR)
+        
+        new = {name: [] for name in ("x", "y", "angle", "speed", "flight", "slot_back", "slot_side")}
+        for first in range(0, count, flight_size):
+            flight = self.next_flight
+            self.next_flight += 1
             
-        self.speed = random.uniform(2, 4)
-        self.size = 20
-        self.health = 40
-        self.bullets = []
-        self.last_shot_time = 0
-        self.shoot_delay = random.randint(1000, 3000)  # Random delay between shots
-        self.change_direction_timer = 0
-        self.direction_change_delay = random.randint(2000, 5000)
-        
-    def draw(self, surface):
-        # Draw bullets
-        for bullet in self.bullets:
-            bullet.draw(surface)
+            # Start from a random edge of the screen, heading inwards
+            side = int(rng.integers(4))
+            if side == 0:  # Top
+                x, y, angle = rng.uniform(0, SCREEN_WIDTH), 0.0, rng.uniform(225, 315)
+            elif side == 1:  # Right
+                x, y, angle = float(SCREEN_WIDTH), rng.uniform(0, SCREEN_HEIGHT), rng.uniform(135, 225)
+            elif side == 2:  # Bottom
+                x, y, angle = rng.uniform(0, SCREEN_WIDTH), float(SCREEN_HEIGHT), rng.uniform(45, 135)
+            else:  # Left
+                x, y, angle = 0.0, rng.uniform(0, SCREEN_HEIGHT), rng.uniform(-45, 45)
+            angle %= 360
+            speed = rng.uniform(2, 4)
+            self.goal[flight] = angle
+            self.goal_timer[flight] = rng.uniform(*config["entry"])
+            
+            for rank in range(min(flight_size, count - first)):
+                # Wingmen alternate left and right, one row further back each pair
+                row = (rank + 1) // 2
+                back = row * spacing
+                beside = row * spacing * (1 if rank % 2 else -1)
+                forward_x, forward_y = math.cos(math.radians(angle)), -math.sin(math.radians(angle))
+                new["x"].append((x - back * forward_x - beside * forward_y) % SCREEN_WIDTH)
+                new["y"].append((y - back * forward_y + beside * forward_x) % SCREEN_HEIGHT)
+                new["angle"].append(angle)
+                new["speed"].append(speed)
+                new["flight"].append(flight)
+                new["slot_back"].append(back)
+                new["slot_side"].append(beside)
+                if trail_length:
+                    self.trails.append(Trail(trail_color, length=trail_length))
+                    
+        added = len(new["x"])
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + added)])
+        self.next_id += added
+        for name, values in new.items():
+            setattr(self, name, np.concatenate([getattr(self, name), np.array(values, dtype=getattr(self, name).dtype)]))
+        self.prev_x = np.concatenate([self.prev_x, new["x"]])
+        self.prev_y = np.concatenate([self.prev_y, new["y"]])
+        self.prev_angle = np.concatenate([self.prev_angle, new["angle"]])
+        self.health = np.concatenate([self.health, np.full(added, float(config["health"]))])
+        self.fire_timer = np.concatenate([self.fire_timer, rng.uniform(low, high, added)])
+        
+    def keep(self, mask):
+        # Drop the planes where mask is False, keeping the order
+        for name in ("ids", "x", "y", "prev_x", "prev_y", "angle", "prev_angle", "speed", "health",
+                     "fire_timer", "flight", "slot_back", "slot_side"):
+            setattr(self, name, getattr(self, name)[mask])
+        if self.trails:
+            self.trails = [trail for trail, kept in zip(self.trails, mask.tolist()) if kept]
+        live_flights = set(self.flight.tolist())
+        self.goal = {flight: goal for flight, goal in self.goal.items() if flight in live_flights}
+        self.goal_timer = {flight: timer for flight, timer in self.goal_timer.items() if flight in live_flights}
+        
+    @staticmethod
+    def wrapped(delta, size):
+        # Shortest offset on a screen that wraps around
+        return delta - size * np.rint(delta / size)
+        
+    def update(self, targets):
+        # targets: the planes to chase and shoot at, the nearest one each time
+        n = len(self.ids)
+        if n == 0 or not targets:
+            return
+        target_x = np.array([plane.x for plane in targets])
+        target_y = np.array([plane.y for plane in targets])
+        config = self.config
+        dt = self.clock.dt
+        tick_ms = self.clock.tick_ms
+        rng = self.rng
+        self.prev_x = self.x.copy()
+        self.prev_y = self.y.copy()
+        self.prev_angle = self.angle.copy()
+        
+        # Leaders (first live plane of each flight) pick new goals now and then
+        flights, leaders = np.unique(self.flight, return_index=True)
+        for flight, leader in zip(flights.tolist(), leaders.tolist()):
+            self.goal_timer[flight] -= tick_ms
+            if self.goal_timer[flight] <= 0:
+                self.goal_timer[flight] = rng.uniform(2000, 5000)
+                if rng.random() < 0.7:
+                    # Chase the nearest player
+                    nearest = np.argmin((target_x - self.x[leader]) ** 2 + (target_y - self.y[leader]) ** 2)
+                    dx = target_x[nearest] - self.x[leader]
+                    dy = target_y[nearest] - self.y[leader]
+                    self.goal[flight] = (math.degrees(math.atan2(-dy, dx)) + 360) % 360
+                else:
+                    # Move randomly
+                    self.goal[flight] = rng.uniform(0, 360)
+                    
+        # Every plane heads for its flight's goal
+        flight_index = np.searchsorted(flights, self.flight)
+        goal = np.radians(np.array([self.goal[flight] for flight in flights.tolist()]))[flight_index]
+        forward_x = np.cos(goal)
+        forward_y = -np.sin(goal)
+        steer_x = forward_x.copy()
+        steer_y = forward_y.copy()
+        speed = self.speed.copy()
+        
+        # Wingmen steer for their slot behind the leader
+        spacing = config["spacing"]
+        if spacing > 0:
+            leader = leaders[flight_index]
+            slot_x = self.x[leader] - self.slot_back * forward_x - self.slot_side * forward_y
+            slot_y = self.y[leader] - self.slot_back * forward_y + self.slot_side * forward_x
+            offset_x = self.wrapped(slot_x - self.x, SCREEN_WIDTH) / spacing
+            offset_y = self.wrapped(slot_y - self.y, SCREEN_HEIGHT) / spacing
+            is_wingman = np.arange(n) != leader
+            steer_x += np.where(is_wingman, np.clip(offset_x, -1.5, 1.5), 0)
+            steer_y += np.where(is_wingman, np.clip(offset_y, -1.5, 1.5), 0)
+            # Speed up when behind the slot, slow down when ahead of it
+            along = offset_x * forward_x + offset_y * forward_y
+            speed *= np.where(is_wingman, 1 + np.clip(along, -0.3, 0.3), 1)
+            
+        # Separation from planes that are too close. Only pairs in
+        # neighbouring grid cells are tested; they are sorted so the pushes
+        # add up in the same order whatever the cell layout.
+        radius = config["separation"]
+        if radius > 0 and n > 1:
+            x = self.x.astype(np.float32)
+            y = self.y.astype(np.float32)
+            i, j = grid_pairs(x, y, x, y, radius)
+            pair_dx = self.wrapped(x[i] - x[j], SCREEN_WIDTH)
+            pair_dy = self.wrapped(y[i] - y[j], SCREEN_HEIGHT)
+            close = (pair_dx * pair_dx + pair_dy * pair_dy < radius * radius) & (i != j)  # Never pushes itself
+            i, j = i[close], j[close]
+            if len(i):
+                pair = np.lexsort((j, i))
+                i, j = i[pair], j[pair]
+                pair_dx = pair_dx[close][pair]
+                pair_dy = pair_dy[close][pair]
+                distance = np.maximum(np.hypot(pair_dx, pair_dy), 1e-3)
+                push = 2 * (radius - distance) / (radius * distance)
+                steer_x += np.bincount(i, push * pair_dx, n)
+                steer_y += np.bincount(i, push * pair_dy, n)
+                
+        # Turn towards the combined steering direction
+        desired = np.degrees(np.arctan2(-steer_y, steer_x)) % 360
+        turn_rate = config["turn_rate"]
+        if turn_rate > 0:
+            turn = (desired - self.angle + 180) % 360 - 180
+            self.angle = (self.angle + np.clip(turn, -turn_rate * dt, turn_rate * dt)) % 360
+        else:
+            self.angle = desired
+            
+        # Move and wrap around the screen
+        angle_rad = np.radians(self.angle)
+        self.x += speed * np.cos(angle_rad) * dt
+        self.y -= speed * np.sin(angle_rad) * dt
+        self.x = np.where(self.x > SCREEN_WIDTH, 0, np.where(self.x < 0, SCREEN_WIDTH, self.x))
+        self.y = np.where(self.y > SCREEN_HEIGHT, 0, np.where(self.y < 0, SCREEN_HEIGHT, self.y))
+        for trail, x, y in zip(self.trails, self.x.tolist(), self.y.tolist()):
+            trail.add(x, y)
+            
+        # Shoot at the nearest player when the cooldown runs out
+        self.fire_timer -= tick_ms
+        ready = np.flatnonzero(self.fire_timer <= 0)
+        if len(ready):
+            low, high = config["fire_delay"]
+            self.fire_timer[ready] = rng.uniform(low, high, len(ready))
+            dx = target_x[None, :] - self.x[ready][:, None]
+            dy = target_y[None, :] - self.y[ready][:, None]
+            nearest = np.argmin(dx * dx + dy * dy, axis=1)
+            dx = dx[np.arange(len(ready)), nearest]
+            dy = dy[np.arange(len(ready)), nearest]
+            # Add some randomness to make it less accurate
+            aim = np.degrees(np.arctan2(-dy, dx)) % 360 + rng.uniform(-10, 10, len(ready))
+            aim_rad = np.radians(aim)
+            bullet_x = self.x[ready] + (self.SIZE + 5) * np.cos(aim_rad)
+            bullet_y = self.y[ready] - (self.SIZE + 5) * np.sin(aim_rad)
+            for x, y, angle, owner in zip(bullet_x.tolist(), bullet_y.tolist(), aim.tolist(),
+                                          self.ids[ready].tolist()):
+                self.projectiles.spawn(x, y, angle, 7, ProjectileManager.ENEMY, owner=owner)
+                
+    def take_hits(self, projectiles, damage=20):
+        # Player bullets overlapping a plane hit the first plane they touch
+        n = len(self.ids)
+        if n == 0:
+            return
+        slots = projectiles.slots(ProjectileManager.PLAYER)
+        if len(slots) == 0:
+            return
+        # Only bullets and planes in neighbouring grid cells are tested
+        size = projectiles.size[slots]
+        bullet_x = projectiles.x[slots]
+        bullet_y = projectiles.y[slots]
+        i, j = grid_pairs(bullet_x, bullet_y, self.x, self.y, self.SIZE + size.max())
+        reach = self.SIZE + size[i]
+        dx = bullet_x[i] - self.x[j]
+        dy = bullet_y[i] - self.y[j]
+        overlap = dx * dx + dy * dy < reach * reach
+        if not overlap.any():
+            return
+        # The first plane in spawn order a bullet touches takes the hit
+        first = np.full(len(slots), n)
+        np.minimum.at(first, i[overlap], j[overlap])
+        hit = first < n
+        target = first[hit]
+        projectiles.release_slots(slots[hit])
+        np.subtract.at(self.health, target, damage)
+        
+        # A destroyed plane's shots disappear with it
+        destroyed = self.health <= 0
+        if destroyed.any():
+            for owner in self.ids[destroyed].tolist():
+                projectiles.release_owner(owner)
+            self.keep(~destroyed)
+            
+    def draw(self, surface, alpha=1.0):
+        # Returns the list of rects touched
+        rects = []
+        share = quality.settings["trail"]
+        for trail in self.trails:
+            rects.extend(trail.draw(surface, share))
+        if len(self.ids) == 0:
+            return rects
             
+        # Interpolate between the last two simulation ticks
+        xs = interpolate_array(self.prev_x, self.x, alpha, SCREEN_WIDTH)
+        ys = interpolate_array(self.prev_y, self.y, alpha, SCREEN_HEIGHT)
+        angles = interpolate_array(self.prev_angle, self.angle, alpha, 360)
+        size = self.SIZE
+        max_health = self.config["health"]
+        for x, y, angle, health in zip(xs.tolist(), ys.tolist(), angles.tolist(), self.health.tolist()):
+            sprite = sprite_cache.get(("enemy", size), angle, 3, EnemySquadron.build_sprite, size)
+            rects.append(SpriteCache.blit_centered(surface, sprite, x, y))
+            
+            # Draw health bar above enemy
+            health_width = int((health / max_health) * size * 2)
+            rects.append(pygame.draw.rect(surface, RED, (x - size, y - size - 10, size * 2, 5)))
+            pygame.draw.rect(surface, GREEN, (x - size, y - size - 10, health_width, 5))
+        return rects
+        
+    @staticmethod
+    def build_sprite(angle, antialias, size):
+        # Render the enemy plane pointing at angle, centered in its own surface
+        radius = size + 2
+        sprite = pygame.Surface((radius * 2 + 1, radius * 2 + 1), pygame.SRCALPHA)
+        x = y = radius
+        
         # Calculate points for the enemy plane
-        angle_rad = math.radians(self.angle)
+        angle_rad = math.radians(angle)
         
         # Nose of the plane
-        nose_x = self.x + self.size * math.cos(angle_rad)
-        nose_y = self.y - self.size * math.sin(angle_rad)
+        nose_x = x + size * math.cos(angle_rad)
+        nose_y = y - size * math.sin(angle_rad)
         
         # Right wing
         right_angle = angle_rad + 2.5
-        right_x = self.x + (self.size * 0.8) * math.cos(right_angle)
-        right_y = self.y - (self.size * 0.8) * math.sin(right_angle)
+        right_x = x + (size * 0.8) * math.cos(right_angle)
+        right_y = y - (size * 0.8) * math.sin(right_angle)
         
         # Left wing
         left_angle = angle_rad - 2.5
-        left_x = self.x + (self.size * 0.8) * math.cos(left_angle)
-        left_y = self.y - (self.size * 0.8) * math.sin(left_angle)
+        left_x = x + (size * 0.8) * math.cos(left_angle)
+        left_y = y - (size * 0.8) * math.sin(left_angle)
         
         # Tail points
-        tail_x = self.x - (self.size * 0.5) * math.cos(angle_rad)
-        tail_y = self.y + (self.size * 0.5) * math.sin(angle_rad)
+        tail_x = x - (size * 0.5) * math.cos(angle_rad)
+        tail_y = y + (size * 0.5) * math.sin(angle_rad)
         
         # Draw the enemy plane
-        pygame.draw.polygon(surface, ENEMY_COLOR, [
+        draw_polygon(sprite, ENEMY_COLOR, [
             (nose_x, nose_y), 
             (right_x, right_y), 
             (tail_x, tail_y),
             (left_x, left_y)
-        ])
+        ], antialias)
         
         # Draw a small cockpit
-        cockpit_x = self.x + (self.size * 0.3) * math.cos(angle_rad)
-        cockpit_y = self.y - (self.size * 0.3) * math.sin(angle_rad)
-        pygame.draw.circle(surface, BLACK, (int(cockpit_x), int(cockpit_y)), 3)
-        
-        # Draw health bar above enemy
-        health_width = int((self.health / 40) * self.size * 2)
-        pygame.draw.rect(surface, RED, (self.x - self.size, self.y - self.size - 10, self.size * 2, 5))
-        pygame.draw.rect(surface, GREEN, (self.x - self.size, self.y - self.size - 10, health_width, 5))
-        
-    def update(self, player):
-        current_time = pygame.time.get_ticks()
-        
-        # Periodically change direction
-        if current_time - self.change_direction_timer > self.direction_change_delay:
-            self.change_direction_timer = current_time
-            self.direction_change_delay = random.randint(2000, 5000)
-            
-            # Sometimes chase the player, sometimes move randomly
-            if random.random() < 0.7:
-                # Chase the player
-                dx = player.x - self.x
-                dy = player.y - self.y
-                self.angle = (math.degrees(math.atan2(-dy, dx)) + 360) % 360
-            else:
-                # Move randomly
-                self.angle = random.randint(0, 359)
-        
-        # Move the plane
-        angle_rad = math.radians(self.angle)
-        self.x += self.speed * math.cos(angle_rad)
-        self.y -= self.speed * math.sin(angle_rad)
-        
-        # Wrap around the screen
-        if self.x > SCREEN_WIDTH:
-            self.x = 0
-        elif self.x < 0:
-            self.x = SCREEN_WIDTH
-            
-        if self.y > SCREEN_HEIGHT:
-            self.y = 0
-        elif self.y < 0:
-            self.y = SCREEN_HEIGHT
-            
-        # Update bullets
-        for bullet in self.bullets[:]:
-            bullet.update()
-            if bullet.is_off_screen():
-                self.bullets.remove(bullet)
-                
-        # Shoot at player
-        if current_time - self.last_shot_time > self.shoot_delay:
-            self.shoot(player)
-            self.last_shot_time = current_time
-            self.shoot_delay = random.randint(1000, 3000)
-            
-    def shoot(self, player):
-        # Calculate angle to player
-        dx = player.x - self.x
-        dy = player.y - self.y
-        angle_to_player = (math.degrees(math.atan2(-dy, dx)) + 360) % 360
-        
-        # Add some randomness to make it less accurate
-        angle_to_player += random.uniform(-10, 10)
-        
-        bullet_x = self.x + (self.size + 5) * math.cos(math.radians(angle_to_player))
-        bullet_y = self.y - (self.size + 5) * math.sin(math.radians(angle_to_player))
-        self.bullets.append(Bullet(bullet_x, bullet_y, angle_to_player, speed=7, friendly=False))
-        
-    def check_bullet_collision(self, bullet):
-        # Check if a bullet hits this enemy
-        distance = math.sqrt((self.x - bullet.x) ** 2 + (self.y - bullet.y) ** 2)
-        return distance < (self.size + bullet.size)
+        cockpit_x = x + (size * 0.3) * math.cos(angle_rad)
+        cockpit_y = y - (size * 0.3) * math.sin(angle_rad)
+        draw_circle(sprite, BLACK, (int(cockpit_x), int(cockpit_y)), 3, antialias)
+        return sprite
 
 class Cloud:
-    def __init__(self):
+    # A cloud shape made of overlapping circles. Clouds don't draw themselves
+    # every frame; they are baked into the strip of a CloudLayer.
+    __slots__ = ("x", "y", "size", "circles")
+    
+    def __init__(self, min_size=30, max_size=60):
         self.x = random.randint(0, SCREEN_WIDTH)
         self.y = random.randint(0, SCREEN_HEIGHT // 2)
-        self.speed = random.uniform(0.5, 1.5)
-        self.size = random.randint(30, 60)
+        self.size = random.randint(min_size, max_size)
         self.circles = []
         
         # Generate random cloud shape
@@ -517,20 +1684,70 @@ class Cloud:
             size = random.uniform(self.size * 0.5, self.size)
             self.circles.append((offset_x, offset_y, size))
         
-    def draw(self, surface):
+    def draw(self, surface, x_offset=0):
         # Draw a cloud with multiple circles
         for offset_x, offset_y, size in self.circles:
             pygame.draw.circle(surface, CLOUD_WHITE, 
-                              (int(self.x + offset_x), int(self.y + offset_y)), 
+                              (int(self.x + x_offset + offset_x), int(self.y + offset_y)), 
                               int(size))
-        
-    def update(self):
-        self.x -= self.speed
-        if self.x < -self.size * 2:
-            self.x = SCREEN_WIDTH + self.size
-            self.y = random.randint(0, SCREEN_HEIGHT // 2)
+
+# Parallax cloud layers from far to near:
+# (clouds at density 1.0, scroll speed, min cloud size, max cloud size)
+CLOUD_LAYERS = [
+    (5, 0.5, 30, 40),
+    (5, 1.0, 40, 50),
+    (5, 1.5, 50, 60),
+]
+
+class CloudLayer:
+    # One depth of the sky. Its clouds are baked into a strip one screen wide
+    # that scrolls left and wraps around, so the layer costs two blits a frame
+    # however many clouds it holds.
+    COLORKEY = (255, 0, 255)
+    
+    def __init__(self, count, speed, min_size=30, max_size=60):
+        self.speed = speed
+        self.max_size = max_size
+        self.clouds = [Cloud(min_size, max_size) for _ in range(count)]
+        self.offset = 0.0
+        self.prev_offset = 0.0
+        self.strip = None  # Built on first draw
+        
+    def build_strip(self, surface):
+        # Tall enough for the lowest cloud's circles
+        height = SCREEN_HEIGHT // 2 + int(self.max_size * 1.3) + 1
+        self.strip = pygame.Surface((SCREEN_WIDTH, height), 0, surface)
+        self.strip.fill(self.COLORKEY)
+        self.strip.set_colorkey(self.COLORKEY, pygame.RLEACCEL)
+        for cloud in self.clouds:
+            # Also draw each cloud one strip width to either side so the seam tiles
+            cloud.draw(self.strip)
+            cloud.draw(self.strip, -SCREEN_WIDTH)
+            cloud.draw(self.strip, SCREEN_WIDTH)
+            
+    def update(self, dt=1.0):
+        self.prev_offset = self.offset
+        self.offset += self.speed * dt
+        if self.offset >= SCREEN_WIDTH:
+            self.offset -= SCREEN_WIDTH
+            self.prev_offset -= SCREEN_WIDTH
+            
+    def draw(self, surface, alpha=1.0):
+        if not self.clouds:
+            return
+        if self.strip is None:
+            self.build_strip(surface)
+        offset = int(self.prev_offset + (self.offset - self.prev_offset) * alpha) % SCREEN_WIDTH
+        surface.blit(self.strip, (-offset, 0))
+        surface.blit(self.strip, (SCREEN_WIDTH - offset, 0))
+
+def create_cloud_layers(density=1.0):
+    return [CloudLayer(round(count * density), speed, min_size, max_size)
+            for count, speed, min_size, max_size in CLOUD_LAYERS]
 
 class Mountain:
+    __slots__ = ("x", "base_width", "height", "color")
+    
     def __init__(self, x=None, height_factor=1.0):
         if x is None:
             self.x = random.randint(0, SCREEN_WIDTH)
@@ -544,7 +1761,7 @@ class Mountain:
             random.randint(10, 19)     # B
         )
         
-    def draw(self, surface):
+    def draw(self, surface, snow_caps=True):
         # Draw a triangle for the mountain
         points = [
             (self.x - self.base_width // 2, SCREEN_HEIGHT),
@@ -554,7 +1771,7 @@ class Mountain:
         pygame.draw.polygon(surface, self.color, points)
         
         # Add a snow cap if the mountain is tall enough
-        if self.height > 150:
+        if snow_caps and self.height > 150:
             snow_points = [
                 (self.x, SCREEN_HEIGHT - self.height),
                 (self.x - self.base_width // 6, SCREEN_HEIGHT - self.height + 30),
@@ -562,105 +1779,574 @@ class Mountain:
             ]
             pygame.draw.polygon(surface, CLOUD_WHITE, snow_points)
 
+class Terrain:
+    # Height of the mountain range at every screen column, the highest of
+    # all overlapping mountains. Built once per wave, so a collision check is
+    # one lookup however many mountains the wave has.
+    def __init__(self, mountains, width=SCREEN_WIDTH):
+        self.width = width
+        columns = np.arange(width + 1)
+        self.heights = np.zeros(width + 1)
+        for mountain in mountains:
+            # Triangle: full height at the center, zero at half the base width away
+            half_width = mountain.base_width / 2
+            profile = mountain.height * (1 - np.abs(columns - mountain.x) / half_width)
+            np.maximum(self.heights, profile, out=self.heights)
+        self.surface_y = SCREEN_HEIGHT - self.heights
+        self.surface_y_list = self.surface_y.tolist()  # For fast scalar lookups
+        
+    def height_at(self, x):
+        return self.heights[min(self.width, max(0, int(round(x))))]
+        
+    def collides(self, x, y):
+        # Whether a point is inside the mountains
+        return y > self.surface_y_list[min(self.width, max(0, int(round(x))))]
+        
+    def collides_many(self, xs, ys):
+        # collides() for arrays of points
+        columns = np.clip(np.rint(xs).astype(np.int64), 0, self.width)
+        return ys > self.surface_y[columns]
+
+class Background:
+    # Pre-rendered static scenery. The sky gradient only depends on the screen
+    # size and the ground/mountains only change when a wave is initialized, so
+    # both are rendered once into layers and blitted each frame. The two layers
+    # are kept separate so clouds can still pass between the sky and the terrain.
+    COLORKEY = (255, 0, 255)
+
+    def __init__(self):
+        self.size = None
+        self.mountains_key = None
+        self.sky_layer = None
+        self.terrain_layer = None
+
+    def build_sky(self, surface):
+        width, height = surface.get_size()
+        self.sky_layer = pygame.Surface((width, height), 0, surface)
+        for y in range(0, height):
+            # Calculate color gradient from top to bottom
+            t = y / height
+            r = int((1-t) * 135 + t * 65)
+            g = int((1-t) * 206 + t * 105)
+            b = int((1-t) * 235 + t * 225)
+            pygame.draw.line(self.sky_layer, (r, g, b), (0, y), (width, y))
+
+    def build_terrain(self, surface, mountains, snow_caps=True):
+        width, height = surface.get_size()
+        self.terrain_layer = pygame.Surface((width, height), 0, surface)
+        self.terrain_layer.fill(self.COLORKEY)
+        self.terrain_layer.set_colorkey(self.COLORKEY, pygame.RLEACCEL)
+
+        # Draw ground
+        pygame.draw.rect(self.terrain_layer, GROUND_GREEN, (0, SCREEN_HEIGHT * 3//4, SCREEN_WIDTH, SCREEN_HEIGHT//4))
+
+        # Draw mountains
+        for mountain in mountains:
+            mountain.draw(self.terrain_layer, snow_caps)
+
+    def check_rebuild(self, surface, mountains):
+        size = surface.get_size()
+        snow_caps = quality.settings["snow_caps"]
+        mountains_key = (snow_caps,) + tuple((m.x, m.base_width, m.height, m.color) for m in mountains)
+        if size != self.size:
+            self.build_sky(surface)
+            self.build_terrain(surface, mountains, snow_caps)
+        elif mountains_key != self.mountains_key:
+            self.build_terrain(surface, mountains, snow_caps)
+        self.size = size
+        self.mountains_key = mountains_key
+
+    def draw_sky(self, surface, mountains):
+        self.check_rebuild(surface, mountains)
+        surface.blit(self.sky_layer, (0, 0))
+
+    def draw_terrain(self, surface):
+        surface.blit(self.terrain_layer, (0, 0))
+
 class Obstacle:
+    __slots__ = ("x", "y", "size", "speed", "angle", "rotation_speed", "prev_x", "prev_y", "prev_angle",
+                 "serial")
+    
     def __init__(self):
+        self.serial = 0  # Set by the ObjectPool
+        self.spawn()
+        
+    def spawn(self):
         self.x = random.randint(0, SCREEN_WIDTH)
         self.y = random.randint(0, SCREEN_HEIGHT)
         self.size = random.randint(15, 25)
         self.speed = random.uniform(1, 3)
         self.angle = 0
         self.rotation_speed = random.uniform(-2, 2)
-        
-    def draw(self, surface):
-        # Draw a spinning obstacle (asteroid/bird)
-        self.angle += self.rotation_speed
-        angle_rad = math.radians(self.angle)
+        self.prev_x = self.x
+        self.prev_y = self.y
+        self.prev_angle = self.angle
+        
+    def draw(self, surface, alpha=1.0):
+        # Interpolate between the last two simulation ticks
+        x = interpolate(self.prev_x, self.x, alpha, SCREEN_WIDTH)
+        y = interpolate(self.prev_y, self.y, alpha, SCREEN_HEIGHT)
+        angle = self.prev_angle + (self.angle - self.prev_angle) * alpha
+        
+        # Draw a spinning obstacle (asteroid/bird); the star repeats every 72 degrees
+        sprite = sprite_cache.get(("star", self.size), angle, 2, Obstacle.build_sprite, self.size, period=72)
+        return [SpriteCache.blit_centered(surface, sprite, x, y)]
+        
+    @staticmethod
+    def build_sprite(angle, antialias, size):
+        # Render the star rotated by angle, centered in its own surface
+        radius = size + 1
+        sprite = pygame.Surface((radius * 2 + 1, radius * 2 + 1), pygame.SRCALPHA)
+        x = y = radius
+        angle_rad = math.radians(angle)
         
         points = []
         for i in range(5):  # 5-pointed star
             # Outer point
             outer_angle = angle_rad + i * 2 * math.pi / 5
-            outer_x = self.x + self.size * math.cos(outer_angle)
-            outer_y = self.y + self.size * math.sin(outer_angle)
+            outer_x = x + size * math.cos(outer_angle)
+            outer_y = y + size * math.sin(outer_angle)
             points.append((outer_x, outer_y))
             
             # Inner point
             inner_angle = angle_rad + (i + 0.5) * 2 * math.pi / 5
-            inner_x = self.x + (self.size * 0.4) * math.cos(inner_angle)
-            inner_y = self.y + (self.size * 0.4) * math.sin(inner_angle)
+            inner_x = x + (size * 0.4) * math.cos(inner_angle)
+            inner_y = y + (size * 0.4) * math.sin(inner_angle)
             points.append((inner_x, inner_y))
         
-        pygame.draw.polygon(surface, (200, 100, 50), points)
+        draw_polygon(sprite, (200, 100, 50), points, antialias)
+        return sprite
         
-    def update(self):
-        self.x -= self.speed
+    def update(self, dt=1.0):
+        self.prev_x = self.x
+        self.prev_y = self.y
+        self.prev_angle = self.angle
+        self.angle += self.rotation_speed * dt
+        self.x -= self.speed * dt
         if self.x < -self.size:
             self.x = SCREEN_WIDTH + self.size
             self.y = random.randint(0, SCREEN_HEIGHT)
 
 class Collectible:
+    __slots__ = ("x", "y", "size", "type", "angle", "serial")
+    
     def __init__(self, type="fuel"):
+        self.serial = 0  # Set by the ObjectPool
+        self.spawn(type)
+        
+    def spawn(self, type="fuel"):
         self.x = random.randint(0, SCREEN_WIDTH)
         self.y = random.randint(0, SCREEN_HEIGHT)
         self.size = 15
         self.type = type  # "fuel", "health", or "speed"
         self.angle = 0
         
-    def draw(self, surface):
-        self.angle += 2
-        if self.angle >= 360:
-            self.angle = 0
-            
-        if self.type == "fuel":
+    def draw(self, surface, alpha=1.0):
+        # The icon doesn't rotate, so a single sprite per type is enough
+        sprite = sprite_cache.get(("collectible", self.type, self.size), self.angle, 360,
+                                  Collectible.build_sprite, self.type, self.size)
+        return [SpriteCache.blit_centered(surface, sprite, self.x, self.y)]
+        
+    @staticmethod
+    def build_sprite(angle, antialias, type, size):
+        sprite = pygame.Surface((size * 2 + 1, size * 2 + 1), pygame.SRCALPHA)
+        x = y = size
+        
+        if type == "fuel":
             color = (255, 215, 0)  # Gold
-        elif self.type == "health":
+        elif type == "health":
             color = (0, 255, 0)    # Green
-        elif self.type == "speed":
+        elif type == "speed":
             color = (0, 191, 255)  # Deep Sky Blue
             
         # Draw a spinning collectible
-        pygame.draw.circle(surface, color, (int(self.x), int(self.y)), self.size)
+        draw_circle(sprite, color, (x, y), size, antialias)
         
         # Draw an icon inside based on type
-        if self.type == "fuel":
+        if type == "fuel":
             # Draw an F
-            font = pygame.font.SysFont(None, 20)
-            text = font.render("F", True, BLACK)
-            surface.blit(text, (self.x - 5, self.y - 8))
-        elif self.type == "health":
+            text = text_cache.render("F", BLACK, 20)
+            sprite.blit(text, (x - 5, y - 8))
+        elif type == "health":
             # Draw a +
-            pygame.draw.rect(surface, BLACK, (self.x - 2, self.y - 7, 4, 14))
-            pygame.draw.rect(surface, BLACK, (self.x - 7, self.y - 2, 14, 4))
-        elif self.type == "speed":
+            pygame.draw.rect(sprite, BLACK, (x - 2, y - 7, 4, 14))
+            pygame.draw.rect(sprite, BLACK, (x - 7, y - 2, 14, 4))
+        elif type == "speed":
             # Draw an S
-            font = pygame.font.SysFont(None, 20)
-            text = font.render("S", True, BLACK)
-            surface.blit(text, (self.x - 5, self.y - 8))
+            text = text_cache.render("S", BLACK, 20)
+            sprite.blit(text, (x - 5, y - 8))
+        return sprite
+        
+    def update(self, dt=1.0):
+        # Collectibles don't move in this version, they only spin
+        self.angle += 2 * dt
+        if self.angle >= 360:
+            self.angle = 0
+            
+class Leaderboard:
+    # Per-run records (score, wave reached, duration) in a SQLite database.
+    # A worker thread owns the connection: it loads the best runs once and
+    # then commits queued records in batches, one transaction per batch, so
+    # the game loop never waits on the disk. The best runs are kept in memory
+    # so top() and high_score() answer without a query.
+    CACHE_SIZE = 100
+    
+    def __init__(self, path="leaderboard.db", legacy_path="highscore.txt"):
+        self.path = path
+        self.legacy_path = legacy_path  # Single high score file of older versions, imported once
+        self.best = []  # (score, wave, duration, victory, played_at), best first
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.loaded = threading.Event()
+        self.thread = None
+        self.runs_written = 0
+        self.commits = 0
+        
+    @staticmethod
+    def sort_key(run):
+        # Highest score first, earlier runs win ties
+        return (-run[0], run[4])
+        
+    def open(self):
+        # Start loading in the background
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="leaderboard", daemon=True)
+            self.thread.start()
+        return self
+        
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS runs (
+                                      id INTEGER PRIMARY KEY,
+                                      score INTEGER NOT NULL,
+                                      wave INTEGER NOT NULL,
+                                      duration REAL NOT NULL,
+                                      victory INTEGER NOT NULL,
+                                      seed INTEGER,
+                                      played_at REAL NOT NULL)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS runs_by_score ON runs (score DESC, played_at)")
+        return connection
+        
+    def import_legacy(self, connection):
+        # Carry the old high score over into an empty leaderboard
+        if connection.execute("SELECT 1 FROM runs LIMIT 1").fetchone() is not None:
+            return
+        try:
+            with open(self.legacy_path, "r") as f:
+                score = int(f.read())
+            played_at = os.path.getmtime(self.legacy_path)
+        except (OSError, ValueError):
+            return
+        with connection:
+            connection.execute("INSERT INTO runs (score, wave, duration, victory, seed, played_at) "
+                               "VALUES (?, 0, 0, 0, NULL, ?)", (score, played_at))
+            
+    def run(self):
+        try:
+            connection = self.connect()
+            self.import_legacy(connection)
+            rows = connection.execute("SELECT score, wave, duration, victory, played_at FROM runs "
+                                      "ORDER BY score DESC, played_at LIMIT ?", (self.CACHE_SIZE,)).fetchall()
+        except sqlite3.Error as error:
+            print(f"Leaderboard unavailable, runs won't be saved: {error}")
+            self.loaded.set()
+            return
+        rows = [(score, wave, duration, bool(victory), played_at) for score, wave, duration, victory, played_at in rows]
+        with self.lock:
+            # Runs recorded while loading are still queued, so not in rows
+            self.best = sorted(rows + self.best, key=self.sort_key)[:self.CACHE_SIZE]
+        self.loaded.set()
+        
+        while True:
+            batch = [self.pending.get()]
+            while True:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            runs = [run for run in batch if run is not None]
+            if runs:
+                try:
+                    with connection:
+                        connection.executemany("INSERT INTO runs (score, wave, duration, victory, seed, played_at) "
+                                               "VALUES (?, ?, ?, ?, ?, ?)", runs)
+                    self.runs_written += len(runs)
+                    self.commits += 1
+                except sqlite3.Error as error:
+                    print(f"Could not save {len(runs)} runs to the leaderboard: {error}")
+            if None in batch:
+                break
+        connection.close()
+        
+    def record(self, score, wave, duration, victory=False, seed=None):
+        # Returns immediately; the worker writes the run
+        played_at = time.time()
+        with self.lock:
+            self.best.append((score, wave, duration, bool(victory), played_at))
+            self.best.sort(key=self.sort_key)
+            del self.best[self.CACHE_SIZE:]
+        self.pending.put((score, wave, duration, int(bool(victory)), seed, played_at))
+        
+    def high_score(self):
+        with self.lock:
+            return self.best[0][0] if self.best else 0
+            
+    def top(self, count=10):
+        # The best runs as (score, wave, duration, victory, played_at) tuples
+        if count > self.CACHE_SIZE:
+            return self.query_top(count)
+        with self.lock:
+            return list(self.best[:count])
+            
+    def query_top(self, count):
+        # Beyond the cached runs, read from the database directly
+        self.loaded.wait()
+        try:
+            connection = sqlite3.connect(self.path)
+            try:
+                return [(score, wave, duration, bool(victory), played_at) for score, wave, duration, victory, played_at in
+                        connection.execute("SELECT score, wave, duration, victory, played_at FROM runs "
+                                           "ORDER BY score DESC, played_at LIMIT ?", (count,))]
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return self.top(self.CACHE_SIZE)
+            
+    def close(self, timeout=10):
+        # Flush the queued runs before exiting
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+class Widget:
+    # A piece of UI drawn from a cached surface. bind(game) returns the value
+    # it shows and the surface is only re-rendered when that value changes.
+    # visible(game), when given, hides the widget while it returns False.
+    # With align "center" the widget is centered horizontally on position.
+    def __init__(self, position, bind=None, visible=None, align="left"):
+        self.position = position
+        self.bind = bind if bind is not None else (lambda game: None)
+        self.visible = visible
+        self.align = align
+        self.value = None
+        self.surface = None
+        self.rect = None
+        
+    def refresh(self, game):
+        # Returns whether the widget was re-rendered
+        value = self.bind(game)
+        if self.surface is not None and value == self.value:
+            return False
+        self.value = value
+        self.surface = self.render(value)
+        x, y = self.position
+        if self.align == "center":
+            x -= self.surface.get_width() // 2
+        self.rect = self.surface.get_rect(topleft=(x, y))
+        return True
+        
+    def render(self, value):
+        # A bare widget shows nothing
+        return pygame.Surface((0, 0))
+
+class Label(Widget):
+    # Text made by formatting the bound value into text, tuples fill one
+    # field per item
+    def __init__(self, position, text, size, color=BLACK, **options):
+        super().__init__(position, **options)
+        self.text = text
+        self.size = size
+        self.color = color
         
-    def update(self):
-        # Collectibles don't move in this version
-        pass
+    def render(self, value):
+        text = self.text.format(*value) if isinstance(value, tuple) else self.text.format(value)
+        return text_cache.render(text, self.color, self.size)
+
+class Bar(Widget):
+    # Outlined bar filled to the bound fraction. Only the filled width in
+    # pixels counts as a change.
+    def __init__(self, position, size, color, bind, **options):
+        fill_width = size[0] - 2
+        super().__init__(position, lambda game: max(0, int(bind(game) * fill_width)), **options)
+        self.size = size
+        self.color = color
+        
+    def render(self, filled):
+        width, height = self.size
+        surface = pygame.Surface(self.size, pygame.SRCALPHA)
+        pygame.draw.rect(surface, BLACK, (0, 0, width, height), 1)
+        pygame.draw.rect(surface, self.color, (1, 1, filled, height - 2))
+        return surface
+
+class Panel(Widget):
+    # Widgets shown together, optionally over a screen dimmed by dim
+    # (0 to 255). The panel's own surface is the dimming backdrop; it never
+    # changes so it is rendered once, and uses surface alpha, which blits
+    # much faster than a per-pixel alpha surface.
+    def __init__(self, widgets, visible=None, dim=0):
+        super().__init__((0, 0), visible=visible)
+        self.widgets = widgets
+        self.dim = dim
+        
+    def render(self, value):
+        if not self.dim:
+            return super().render(value)
+        backdrop = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        if pygame.display.get_surface() is not None:
+            backdrop = backdrop.convert()
+        backdrop.set_alpha(self.dim)
+        return backdrop
+
+class UILayer:
+    # Retained-mode UI: panels of widgets that keep their rendered surfaces
+    # between frames and are composited with one blits() call. drawn and
+    # rerendered count the widgets (panels included) of the last frame.
+    def __init__(self, panels):
+        self.panels = panels
+        self.drawn = 0
+        self.rerendered = 0
+        self.renders = 0  # Re-renders over the layer's lifetime
+        
+    def draw(self, surface, game):
+        # Returns the rects drawn to
+        blits = []
+        drawn = 0
+        rerendered = 0
+        for panel in self.panels:
+            if panel.visible is not None and not panel.visible(game):
+                continue
+            if panel.refresh(game):
+                rerendered += 1
+            if panel.dim:
+                blits.append((panel.surface, panel.rect))
+                drawn += 1
+            for widget in panel.widgets:
+                if widget.visible is not None and not widget.visible(game):
+                    continue
+                if widget.refresh(game):
+                    rerendered += 1
+                blits.append((widget.surface, widget.rect))
+                drawn += 1
+        self.drawn = drawn
+        self.rerendered = rerendered
+        self.renders += rerendered
+        return surface.blits(blits)
+        
+    def stats(self):
+        return {"widgets": sum(1 + len(panel.widgets) for panel in self.panels), "drawn": self.drawn,
+                "rerendered": self.rerendered, "renders": self.renders}
+
+def wave_seconds_left(game):
+    return int(max(0, game.wave_duration - (game.clock.get_ticks() - game.wave_start_time)) // 1000)
+
+def build_game_ui():
+    # The HUD and the overlay screens. Bindings take the game as an argument
+    # rather than closing over it, so snapshots can share the layer.
+    center = SCREEN_WIDTH // 2
+    middle = SCREEN_HEIGHT // 2
+    playing = lambda game: not (game.wave_transition or game.game_over or game.victory)
+    hud = Panel([
+        Label((10, 10), "Score: {}", 36, bind=lambda game: game.score),
+        Label((10, 50), "High Score: {}", 24, bind=lambda game: game.get_high_score()),
+        Label((10, 80), "Speed: {:.1f}", 36, bind=lambda game: game.airplane.speed),
+        Label((center - 60, 10), "Wave: {}/{}", 36, bind=lambda game: (game.current_wave, game.max_waves)),
+        Label((center - 40, 50), "Time: {}s", 36, bind=wave_seconds_left, visible=playing),
+        Bar((SCREEN_WIDTH - 210, 10), (200, 20), (255, 0, 0), lambda game: game.airplane.health / 100),
+        Label((SCREEN_WIDTH - 270, 10), "Health", 24),
+        Bar((SCREEN_WIDTH - 210, 40), (200, 20), (255, 215, 0), lambda game: game.airplane.fuel / 100),
+        Label((SCREEN_WIDTH - 270, 40), "Fuel", 24),
+        Label((center - 40, 90), "Enemies: {}", 24, bind=lambda game: len(game.squadron),
+              visible=lambda game: game.current_wave in game.wave_squadrons),
+        Label((SCREEN_WIDTH - 270, 70), "Quality: {}", 24, bind=lambda game: quality.settings["name"],
+              visible=lambda game: quality.enabled),
+        Label((10, 110), "{}", 24, visible=lambda game: len(game.airplanes) > 1,
+              bind=lambda game: "   ".join(f"P{i + 1}: {plane.score}" for i, plane in enumerate(game.airplanes))),
+    ])
+    transition = Panel([
+        Label((center, middle - 50), "WAVE {}", 72, WHITE, bind=lambda game: game.current_wave,
+              align="center", visible=lambda game: game.current_wave <= game.max_waves),
+        Label((center, middle + 50), "Enemy aircraft incoming! Survive for 30 seconds!", 36, WHITE,
+              align="center", visible=lambda game: game.current_wave == 5),
+    ], visible=lambda game: game.wave_transition, dim=128)
+    game_over = Panel([
+        Label((center, middle - 100), "GAME OVER", 72, WHITE, align="center"),
+        Label((center, middle), "Final Score: {}", 36, WHITE, bind=lambda game: game.score, align="center"),
+        Label((center, middle + 50), "High Score: {}", 36, WHITE, bind=lambda game: game.get_high_score(),
+              align="center"),
+        Label((center, middle + 100), "Reached Wave: {}/{}", 36, WHITE,
+              bind=lambda game: (game.current_wave, game.max_waves), align="center"),
+        Label((center, middle + 150), "Press SPACE to restart or ESC to quit", 36, WHITE, align="center"),
+    ], visible=lambda game: game.game_over, dim=128)
+    victory = Panel([
+        Label((center, middle - 100), "VICTORY!", 72, (255, 215, 0), align="center"),  # Gold color
+        Label((center, middle), "Final Score: {}", 36, WHITE, bind=lambda game: game.score, align="center"),
+        Label((center, middle + 50), "High Score: {}", 36, WHITE, bind=lambda game: game.get_high_score(),
+              align="center"),
+        Label((center, middle + 100), "You survived all waves!", 36, WHITE, align="center"),
+        Label((center, middle + 150), "Press SPACE to play again or ESC to quit", 36, WHITE, align="center"),
+    ], visible=lambda game: game.victory, dim=128)
+    return UILayer([hud, transition, game_over, victory])
+
 class Game:
-    def __init__(self):
-        self.airplane = Airplane()
-        self.clouds = [Cloud() for _ in range(15)]
+    # The simulation never touches the display or the mixer: input comes in as
+    # an InputState, time from the (injectable) clock and sounds go through the
+    # SoundBank. Only draw() needs a surface. Given a seed the whole run is
+    # deterministic for the same sequence of inputs.
+    def __init__(self, tick_rate=TICK_RATE, clock=None, sounds=None, high_score=None, cloud_density=1.0,
+                 seed=None, leaderboard=None, swarm=0, players=1, versus=False, announce=True):
+        self.clock = clock if clock is not None else SimulationClock(tick_rate)
+        self.sounds = sounds if sounds is not None else SoundBank()
+        self.projectiles = ProjectileManager()
+        # One plane per player, the first flies from the middle of the
+        # screen. airplane is the plane the HUD shows.
+        self.players = players
+        self.versus = versus  # Players' bullets hit each other
+        self.airplanes = [Airplane(self.clock, self.sounds, self.projectiles, PLAYER_COLORS[i % len(PLAYER_COLORS)],
+                                   (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 120 * i)) for i in range(players)]
+        self.airplane = self.airplanes[0]
+        self.obstacle_grid = SpatialHash()  # Broad-phase grid, rebuilt every update
+        self.cloud_density = cloud_density
+        self.clouds = create_cloud_layers(cloud_density)
+        
+        # Seeded after the clouds, which are cosmetic, so a recording replays
+        # the same with any cloud density
+        self.seed = seed
+        if seed is not None:
+            random.seed(seed)
+        self.leaderboard = leaderboard  # Finished runs are recorded here when given
+        self.announce = announce  # Print each wave's start; headless runners turn it off
+        
+        # swarm replaces the final wave's squadron with that many swarm planes
+        self.swarm = swarm
+        self.wave_squadrons = dict(WAVE_SQUADRONS)
+        if swarm:
+            self.wave_squadrons[5] = dict(SQUADRONS["swarm"], count=swarm)
         self.mountains = []
+        self.terrain = Terrain(self.mountains)
         self.obstacles = []
         self.collectibles = []
-        self.enemies = []
+        self.obstacle_pool = ObjectPool(Obstacle)
+        self.collectible_pool = ObjectPool(Collectible)
+        self.squadron = EnemySquadron(self.clock, self.projectiles)
+        self.background = Background()
+        self.ui = build_game_ui()
         self.score = 0
-        self.high_score = 0
-        self.font = pygame.font.SysFont(None, 36)
-        self.small_font = pygame.font.SysFont(None, 24)
+        self.score_remainder = 0.0  # Fractional score carried between ticks
+        self.high_score = high_score if high_score is not None else 0
         self.game_over = False
         self.victory = False
-        self.start_time = pygame.time.get_ticks()
+        self.entities_moved = False  # Whether the last tick moved anything worth interpolating
+        self.start_time = self.clock.get_ticks()
         self.last_collectible_time = 0
         
         # Wave system
         self.current_wave = 1
         self.max_waves = 5
-        self.wave_start_time = pygame.time.get_ticks()
+        self.wave_start_time = self.clock.get_ticks()
         self.wave_duration = 30000  # 30 seconds per wave
         self.wave_transition = False
         self.transition_start_time = 0
@@ -669,43 +2355,55 @@ class Game:
         # Initialize first wave
         self.initialize_wave(self.current_wave)
         
-        # Load high score if available
-        try:
-            with open("highscore.txt", "r") as f:
-                self.high_score = int(f.read())
-        except:
-            self.high_score = 0
+    def get_high_score(self):
+        # The leaderboard loads in the background, so ask it every time
+        if self.leaderboard is not None:
+            return max(self.high_score, self.leaderboard.high_score())
+        return self.high_score
+        
+    def record_run(self):
+        # Called once when the run ends; the leaderboard writes it to disk
+        # on its own thread
+        self.high_score = max(self.high_score, self.score)
+        if self.leaderboard is not None:
+            duration = (self.clock.get_ticks() - self.start_time) / 1000
+            self.leaderboard.record(self.score, self.current_wave, duration, self.victory, self.seed)
     
     def initialize_wave(self, wave_num):
-        # Clear existing objects
+        # Clear existing objects, keeping them for reuse
+        self.obstacle_pool.release_all(self.obstacles)
+        self.collectible_pool.release_all(self.collectibles)
         self.obstacles = []
         self.collectibles = []
-        self.enemies = []
+        self.squadron.clear()
+        self.projectiles.clear(ProjectileManager.ENEMY)
         
         # Reset wave timer
-        self.wave_start_time = pygame.time.get_ticks()
+        self.wave_start_time = self.clock.get_ticks()
         
         # Create mountains with increasing height based on wave
         self.mountains = []
         height_factor = 1.0 + (wave_num - 1) * 0.25  # Increase height by 25% each wave
         for x in range(0, SCREEN_WIDTH + 300, 200):
             self.mountains.append(Mountain(x, height_factor))
+        self.terrain = Terrain(self.mountains)
         
         # Add obstacles based on wave
         num_obstacles = 3 + wave_num
         for _ in range(num_obstacles):
-            self.obstacles.append(Obstacle())
+            self.obstacles.append(self.obstacle_pool.acquire())
             
         # Add collectibles
         for _ in range(3):
             self.add_random_collectible()
             
-        # Add enemies only in wave 5
-        if wave_num == 5:
-            for _ in range(3):
-                self.enemies.append(EnemyPlane())
+        # Add the wave's enemy squadron, if it has one
+        squadron = self.wave_squadrons.get(wave_num)
+        if squadron is not None:
+            self.squadron.spawn(squadron)
                 
-        print(f"Wave {wave_num} started!")
+        if self.announce:
+            print(f"Wave {wave_num} started!")
         
     def add_random_collectible(self):
         # Determine type based on probabilities
@@ -717,189 +2415,94 @@ class Game:
         else:
             collectible_type = "speed"
             
-        self.collectibles.append(Collectible(collectible_type))
-        
-    def draw(self, surface):
-        # Draw sky with gradient
-        for y in range(0, SCREEN_HEIGHT):
-            # Calculate color gradient from top to bottom
-            t = y / SCREEN_HEIGHT
-            r = int((1-t) * 135 + t * 65)
-            g = int((1-t) * 206 + t * 105)
-            b = int((1-t) * 235 + t * 225)
-            pygame.draw.line(surface, (r, g, b), (0, y), (SCREEN_WIDTH, y))
-        
-        # Draw clouds
-        for cloud in self.clouds:
-            cloud.draw(surface)
-        
-        # Draw ground
-        pygame.draw.rect(surface, GROUND_GREEN, (0, SCREEN_HEIGHT * 3//4, SCREEN_WIDTH, SCREEN_HEIGHT//4))
-        
-        # Draw mountains
-        for mountain in self.mountains:
-            mountain.draw(surface)
+        self.collectibles.append(self.collectible_pool.acquire(collectible_type))
+        
+    def draw(self, surface, alpha=1.0):
+        # alpha is how far the renderer is between the last two simulation
+        # ticks, used to interpolate moving objects
+        self.draw_backdrop(surface, alpha)
+        return self.draw_scene(surface, alpha)
+        
+    def draw_backdrop(self, surface, alpha=1.0):
+        # Everything behind the entities: sky, clouds and terrain
+        if not self.entities_moved:
+            alpha = 1.0
+            
+        # Draw cached sky gradient (rebuilt only when the screen size changes)
+        profiler.start("draw sky")
+        self.background.draw_sky(surface, self.mountains)
+        profiler.stop("draw sky")
+        
+        # Draw cloud layers, far to near; lower quality drops the far ones
+        profiler.start("draw clouds")
+        for cloud in self.clouds[max(0, len(self.clouds) - quality.settings["cloud_layers"]):]:
+            cloud.draw(surface, alpha)
+        profiler.stop("draw clouds")
+        
+        # Draw cached ground and mountains
+        profiler.start("draw terrain")
+        self.background.draw_terrain(surface)
+        profiler.stop("draw terrain")
+        
+    def draw_scene(self, surface, alpha=1.0):
+        # Entities, HUD and overlays. Returns the list of rects drawn to.
+        if not self.entities_moved:
+            alpha = 1.0
+        rects = []
         
         # Draw collectibles
+        profiler.start("draw collectibles")
         for collectible in self.collectibles:
-            collectible.draw(surface)
+            rects.extend(collectible.draw(surface, alpha))
+        profiler.stop("draw collectibles")
             
         # Draw obstacles
+        profiler.start("draw obstacles")
         for obstacle in self.obstacles:
-            obstacle.draw(surface)
+            rects.extend(obstacle.draw(surface, alpha))
+        profiler.stop("draw obstacles")
+            
+        # Draw bullets
+        profiler.start("draw bullets")
+        rects.extend(self.projectiles.draw(surface, alpha))
+        profiler.stop("draw bullets")
             
         # Draw enemies
-        for enemy in self.enemies:
-            enemy.draw(surface)
-        
-        # Draw airplane
-        self.airplane.draw(surface)
-        
-        # Draw HUD
-        self.draw_hud(surface)
-        
-        # Draw wave transition
-        if self.wave_transition:
-            self.draw_wave_transition(surface)
-        
-        # Draw game over screen if needed
-        if self.game_over:
-            self.draw_game_over(surface)
-            
-        # Draw victory screen if needed
-        if self.victory:
-            self.draw_victory(surface)
-        
-    def draw_hud(self, surface):
-        # Draw score
-        score_text = self.font.render(f"Score: {self.score}", True, BLACK)
-        surface.blit(score_text, (10, 10))
-        
-        # Draw high score
-        high_score_text = self.small_font.render(f"High Score: {self.high_score}", True, BLACK)
-        surface.blit(high_score_text, (10, 50))
-        
-        # Draw speed
-        speed_text = self.font.render(f"Speed: {self.airplane.speed:.1f}", True, BLACK)
-        surface.blit(speed_text, (10, 80))
-        
-        # Draw wave info
-        wave_text = self.font.render(f"Wave: {self.current_wave}/{self.max_waves}", True, BLACK)
-        surface.blit(wave_text, (SCREEN_WIDTH // 2 - 60, 10))
-        
-        # Draw wave timer
-        if not self.wave_transition and not self.game_over and not self.victory:
-            elapsed = pygame.time.get_ticks() - self.wave_start_time
-            remaining = max(0, self.wave_duration - elapsed)
-            seconds = remaining // 1000
-            timer_text = self.font.render(f"Time: {seconds}s", True, BLACK)
-            surface.blit(timer_text, (SCREEN_WIDTH // 2 - 40, 50))
-        
-        # Draw health bar
-        pygame.draw.rect(surface, BLACK, (SCREEN_WIDTH - 210, 10, 200, 20), 1)
-        health_width = int((self.airplane.health / 100) * 198)
-        pygame.draw.rect(surface, (255, 0, 0), (SCREEN_WIDTH - 209, 11, health_width, 18))
-        health_text = self.small_font.render("Health", True, BLACK)
-        surface.blit(health_text, (SCREEN_WIDTH - 270, 10))
-        
-        # Draw fuel bar
-        pygame.draw.rect(surface, BLACK, (SCREEN_WIDTH - 210, 40, 200, 20), 1)
-        fuel_width = int((self.airplane.fuel / 100) * 198)
-        pygame.draw.rect(surface, (255, 215, 0), (SCREEN_WIDTH - 209, 41, fuel_width, 18))
-        fuel_text = self.small_font.render("Fuel", True, BLACK)
-        surface.blit(fuel_text, (SCREEN_WIDTH - 270, 40))
-        
-        # Draw enemy count in wave 5
-        if self.current_wave == 5:
-            enemy_text = self.small_font.render(f"Enemies: {len(self.enemies)}", True, BLACK)
-            surface.blit(enemy_text, (SCREEN_WIDTH // 2 - 40, 90))
-    
-    def draw_wave_transition(self, surface):
-        # Semi-transparent overlay
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 128))
-        surface.blit(overlay, (0, 0))
-        
-        # Wave transition text
-        if self.current_wave <= self.max_waves:
-            wave_font = pygame.font.SysFont(None, 72)
-            wave_text = wave_font.render(f"WAVE {self.current_wave}", True, WHITE)
-            surface.blit(wave_text, (SCREEN_WIDTH // 2 - wave_text.get_width() // 2, SCREEN_HEIGHT // 2 - 50))
-            
-            # Instructions for final wave
-            if self.current_wave == 5:
-                instruction_font = pygame.font.SysFont(None, 36)
-                instruction_text = instruction_font.render("Enemy aircraft incoming! Survive for 30 seconds!", True, WHITE)
-                surface.blit(instruction_text, (SCREEN_WIDTH // 2 - instruction_text.get_width() // 2, SCREEN_HEIGHT // 2 + 50))
-    
-    def draw_game_over(self, surface):
-        # Semi-transparent overlay
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 128))
-        surface.blit(overlay, (0, 0))
-        
-        # Game over text
-        game_over_font = pygame.font.SysFont(None, 72)
-        game_over_text = game_over_font.render("GAME OVER", True, WHITE)
-        surface.blit(game_over_text, (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2, SCREEN_HEIGHT // 2 - 100))
-        
-        # Score
-        final_score_text = self.font.render(f"Final Score: {self.score}", True, WHITE)
-        surface.blit(final_score_text, (SCREEN_WIDTH // 2 - final_score_text.get_width() // 2, SCREEN_HEIGHT // 2))
-        
-        # High score
-        high_score_text = self.font.render(f"High Score: {self.high_score}", True, WHITE)
-        surface.blit(high_score_text, (SCREEN_WIDTH // 2 - high_score_text.get_width() // 2, SCREEN_HEIGHT // 2 + 50))
-        
-        # Wave reached
-        wave_text = self.font.render(f"Reached Wave: {self.current_wave}/{self.max_waves}", True, WHITE)
-        surface.blit(wave_text, (SCREEN_WIDTH // 2 - wave_text.get_width() // 2, SCREEN_HEIGHT // 2 + 100))
-        
-        # Restart instructions
-        restart_text = self.font.render("Press SPACE to restart or ESC to quit", True, WHITE)
-        surface.blit(restart_text, (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, SCREEN_HEIGHT // 2 + 150))
-        
-    def draw_victory(self, surface):
-        # Semi-transparent overlay
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 128))
-        surface.blit(overlay, (0, 0))
-        
-        # Victory text
-        victory_font = pygame.font.SysFont(None, 72)
-        victory_text = victory_font.render("VICTORY!", True, (255, 215, 0))  # Gold color
-        surface.blit(victory_text, (SCREEN_WIDTH // 2 - victory_text.get_width() // 2, SCREEN_HEIGHT // 2 - 100))
-        
-        # Score
-        final_score_text = self.font.render(f"Final Score: {self.score}", True, WHITE)
-        surface.blit(final_score_text, (SCREEN_WIDTH // 2 - final_score_text.get_width() // 2, SCREEN_HEIGHT // 2))
-        
-        # High score
-        high_score_text = self.font.render(f"High Score: {self.high_score}", True, WHITE)
-        surface.blit(high_score_text, (SCREEN_WIDTH // 2 - high_score_text.get_width() // 2, SCREEN_HEIGHT // 2 + 50))
-        
-        # Congratulations
-        congrats_text = self.font.render("You survived all waves!", True, WHITE)
-        surface.blit(congrats_text, (SCREEN_WIDTH // 2 - congrats_text.get_width() // 2, SCREEN_HEIGHT // 2 + 100))
-        
-        # Restart instructions
-        restart_text = self.font.render("Press SPACE to play again or ESC to quit", True, WHITE)
-        surface.blit(restart_text, (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, SCREEN_HEIGHT // 2 + 150))
-        
-    def update(self):
+        profiler.start("draw enemies")
+        rects.extend(self.squadron.draw(surface, alpha))
+        profiler.stop("draw enemies")
+        
+        # Draw the planes still flying, all of them once the game is over
+        profiler.start("draw airplane")
+        for plane in self.airplanes:
+            if not plane.down or self.game_over:
+                rects.extend(plane.draw(surface, alpha))
+        profiler.stop("draw airplane")
+        
+        # Draw the HUD and the transition, game over or victory screen
+        profiler.start("draw hud")
+        rects.extend(self.ui.draw(surface, self))
+        profiler.stop("draw hud")
+        return rects
+        
+    def update(self, controls=None):
+        # Advance the game by one fixed simulation tick
+        self.entities_moved = False
         if self.game_over or self.victory:
             return
+        self.clock.advance()
+        dt = self.clock.dt
             
         # Handle wave transitions
         if self.wave_transition:
-            if pygame.time.get_ticks() - self.transition_start_time > self.transition_duration:
+            if self.clock.get_ticks() - self.transition_start_time > self.transition_duration:
                 self.wave_transition = False
                 self.initialize_wave(self.current_wave)
             else:
                 return
                 
         # Check if wave time is up
-        current_time = pygame.time.get_ticks()
+        current_time = self.clock.get_ticks()
         if current_time - self.wave_start_time > self.wave_duration:
             # Wave completed
             if self.current_wave < self.max_waves:
@@ -912,55 +2515,68 @@ class Game:
                 # Game completed - victory!
                 self.victory = True
                 self.score += 5000  # Big bonus for winning
-                
-                # Update high score if needed
-                if self.score > self.high_score:
-                    self.high_score = self.score
-                    try:
-                        with open("highscore.txt", "w") as f:
-                            f.write(str(self.high_score))
-                    except:
-                        pass
+                self.record_run()
             return
             
-        keys = pygame.key.get_pressed()
-        result = self.airplane.update(keys, self.obstacles, self.collectibles, self.mountains, self.enemies)
+        # controls is one InputState, or a sequence with one per player
+        if controls is None:
+            controls = InputState()
+        if isinstance(controls, InputState):
+            controls = [controls]
+        planes = [plane for plane in self.airplanes if not plane.down]
+        for index, plane in enumerate(self.airplanes):
+            if not plane.down:
+                plane.fly(controls[index] if index < len(controls) else InputState.from_mask(0))
+                
+        # Advance every bullet (player and enemy) in one batched pass
+        self.projectiles.update(dt)
         
-        # Unpack the result
-        hit_obstacles, collected_items = result
+        profiler.start("collisions")
+        hit_obstacles = self.shoot_obstacles()
+        collected_items = []
+        for plane in planes:
+            for collectible in plane.collide(self.obstacle_grid, self.collectibles, self.terrain, self.versus):
+                collected_items.append((plane, collectible))
+                
+        # Check for hits on enemies
+        self.squadron.take_hits(self.projectiles)
+        profiler.stop("collisions")
         
         # Handle hit obstacles and update score
-        for obstacle in hit_obstacles:
+        for obstacle, shooter in hit_obstacles:
             if obstacle in self.obstacles:
                 self.obstacles.remove(obstacle)
+                self.obstacle_pool.release(obstacle)
                 self.score += 50  # Add score for shooting a star
+                if shooter is not None:
+                    shooter.score += 50
         
         # Handle collected items
-        for collectible in collected_items:
+        for plane, collectible in collected_items:
             if collectible in self.collectibles:
                 if collectible.type == "fuel":
-                    self.airplane.fuel = min(100, self.airplane.fuel + 20)
+                    plane.fuel = min(100, plane.fuel + 20)
                 elif collectible.type == "health":
-                    self.airplane.health = min(100, self.airplane.health + 20)
+                    plane.health = min(100, plane.health + 20)
                 elif collectible.type == "speed":
-                    self.airplane.max_speed = min(15, self.airplane.max_speed + 1)
+                    plane.max_speed = min(15, plane.max_speed + 1)
                 self.collectibles.remove(collectible)
-                try:
-                    collect_sound.play()
-                except:
-                    pass
+                self.collectible_pool.release(collectible)
+                self.sounds.play("collect")
         
         for cloud in self.clouds:
-            cloud.update()
+            cloud.update(dt)
             
         for obstacle in self.obstacles:
-            obstacle.update()
+            obstacle.update(dt)
             
         for collectible in self.collectibles:
-            collectible.update()
+            collectible.update(dt)
             
-        for enemy in self.enemies:
-            enemy.update(self.airplane)
+        profiler.start("enemy ai")
+        self.squadron.update(planes)
+        profiler.stop("enemy ai")
+        self.entities_moved = True
             
         # Spawn new collectibles periodically
         if current_time - self.last_collectible_time > 5000:  # Every 5 seconds
@@ -969,26 +2585,88 @@ class Game:
             
             # Limit number of collectibles
             if len(self.collectibles) > 10:
-                self.collectibles.pop(0)
-        
-        # Increase score over time
-        self.score += int(self.airplane.speed * 0.1)
-        
-        # Check game over conditions
-        if self.airplane.health <= 0 or (self.airplane.fuel <= 0 and self.airplane.speed <= 1.1):
+                self.collectible_pool.release(self.collectibles.pop(0))
+        
+        # Increase score over time (int(speed * 0.1) points per 60 Hz tick
+        # for every plane still flying)
+        self.score_remainder += sum(int(plane.speed * 0.1) for plane in planes) * dt
+        points = int(self.score_remainder)
+        self.score += points
+        self.score_remainder -= points
+        
+        # Planes go down when shot down or out of fuel, the game is over once
+        # every plane is down
+        for plane in planes:
+            if plane.health <= 0 or (plane.fuel <= 0 and plane.speed <= 1.1):
+                plane.down = True
+        if all(plane.down for plane in self.airplanes):
             self.game_over = True
-            
-            # Update high score if needed
-            if self.score > self.high_score:
-                self.high_score = self.score
-                try:
-                    with open("highscore.txt", "w") as f:
-                        f.write(str(self.high_score))
-                except:
-                    pass
+            self.record_run()
         
-    def reset(self):
-        self.__init__()
+    def shoot_obstacles(self):
+        # Player bullets against the stars. Returns (star, shooter) for every
+        # star hit; the grid is kept for the planes' own collision checks.
+        self.obstacle_grid.clear()
+        for obstacle in self.obstacles:
+            self.obstacle_grid.insert(obstacle, obstacle.x, obstacle.y, obstacle.size)
+            
+        hit_obstacles = []
+        projectiles = self.projectiles
+        player_slots = projectiles.slots(ProjectileManager.PLAYER)
+        for slot, bullet_x, bullet_y, bullet_size in zip(player_slots.tolist(),
+                                                         projectiles.x[player_slots].tolist(),
+                                                         projectiles.y[player_slots].tolist(),
+                                                         projectiles.size[player_slots].tolist()):
+            for obstacle in self.obstacle_grid.query(bullet_x, bullet_y, bullet_size):
+                # Squared distance between bullet and obstacle
+                reach = bullet_size + obstacle.size
+                if (bullet_x - obstacle.x) ** 2 + (bullet_y - obstacle.y) ** 2 < reach * reach:
+                    # Remove bullet and mark obstacle for removal
+                    shooter = projectiles.owner[slot]
+                    projectiles.release(slot)
+                    if all(obstacle is not hit for hit, _ in hit_obstacles):
+                        hit_obstacles.append((obstacle, shooter))
+                    break
+        return hit_obstacles
+        
+    def reset(self, seed=None):
+        self.__init__(self.clock.tick_rate, sounds=self.sounds, high_score=self.high_score,
+                      cloud_density=self.cloud_density, seed=seed, leaderboard=self.leaderboard,
+                      swarm=self.swarm, players=self.players, versus=self.versus, announce=self.announce)
+        
+    def pool_stats(self):
+        # Allocation counters of the recycled entities, for tuning pool sizes
+        # Particle counters are summed over every plane's system
+        particles = [plane.particles.stats() for plane in self.airplanes]
+        return {
+            "particles": {key: sum(stats[key] for stats in particles) for key in particles[0]},
+            "projectiles": self.projectiles.stats(),
+            "obstacles": self.obstacle_pool.stats(),
+            "collectibles": self.collectible_pool.stats(),
+        }
+        
+    def shared_objects(self):
+        # Objects a snapshot refers to instead of copying: sounds, rendering
+        # caches, the UI, the cosmetic clouds and the leaderboard
+        shared = [self.sounds, self.leaderboard, self.background, self.ui, self.clouds]
+        for trail in [plane.trail for plane in self.airplanes] + self.squadron.trails:
+            if trail.stamps is not None:
+                shared.append(trail.stamps)
+        return {id(obj): obj for obj in shared}
+        
+    def snapshot(self):
+        # Copy of the simulation state, including the random generator
+        state = copy.deepcopy(self.__dict__, self.shared_objects())
+        return state, random.getstate()
+        
+    def restore(self, snapshot):
+        # Copy again so the same snapshot can be restored more than once
+        state, random_state = snapshot
+        memo = self.shared_objects()
+        memo.update({id(obj): obj for obj in (state["sounds"], state["leaderboard"],
+                                               state["background"], state["ui"], state["clouds"])})
+        self.__dict__.update(copy.deepcopy(state, memo))
+        random.setstate(random_state)
         
     def display_instructions(self):
         print("""
@@ -997,6 +2675,9 @@ Wave-Based Flight Combat Game Controls:
 - Arrow Up/Down: Increase/Decrease speed
 - SPACE: Shoot (in all waves)
 - F12: Take screenshot
+- F11: Save the last seconds of play as a clip
+- F3: Toggle the frame profiler overlay
+- Left/Right: Seek when playing back a recording (--replay)
 - Shoot orange star obstacles to destroy them and earn points
 - Collect gold items for fuel
 - Collect green items for health
@@ -1007,16 +2688,440 @@ Wave-Based Flight Combat Game Controls:
 - SPACE: Restart (when game over)
 """)
 
+class InputRecording:
+    # The seed of a run plus the controls of every simulation tick, one
+    # bitmask byte per tick (see InputState.to_mask), stored zlib-compressed.
+    # Long stretches of the same keys compress to almost nothing.
+    MAGIC = b"SWRP"
+    VERSION = 2
+    HEADER = struct.Struct("<4sBHQIq")  # magic, version, tick rate, seed, ticks, final score
+    OPTIONS = struct.Struct("<I")  # swarm size, from version 2 on
+    
+    def __init__(self, seed, tick_rate=TICK_RATE, masks=None, final_score=-1, swarm=0):
+        self.seed = seed
+        self.tick_rate = tick_rate
+        self.swarm = swarm
+        self.masks = masks if masks is not None else bytearray()
+        self.final_score = final_score  # -1 when the run wasn't finished
+        
+    def __len__(self):
+        return len(self.masks)
+        
+    def append(self, controls):
+        self.masks.append(controls.to_mask())
+        
+    def controls(self, tick):
+        return InputState.from_mask(self.masks[tick])
+        
+    def save(self, path):
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, self.tick_rate, self.seed,
+                                  len(self.masks), self.final_score) + self.OPTIONS.pack(self.swarm)
+        with open(path, "wb") as f:
+            f.write(header + zlib.compress(bytes(self.masks), 9))
+            
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, tick_rate, seed, ticks, final_score = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version not in (1, cls.VERSION):
+            raise ValueError(f"{path} is not a version {cls.VERSION} input recording")
+        offset = cls.HEADER.size
+        swarm = 0
+        if version >= 2:
+            swarm, = cls.OPTIONS.unpack_from(data, offset)
+            offset += cls.OPTIONS.size
+        masks = bytearray(zlib.decompress(data[offset:]))
+        if len(masks) != ticks:
+            raise ValueError(f"{path} is truncated: {len(masks)} of {ticks} ticks")
+        return cls(seed, tick_rate, masks, final_score, swarm)
+
+class Replay:
+    # Re-simulates a recording. A snapshot of the game is kept every
+    # checkpoint interval as playback passes it, so seeking only has to
+    # simulate forward from the nearest earlier checkpoint.
+    def __init__(self, recording, checkpoint_seconds=10, **game_options):
+        self.recording = recording
+        self.game = Game(recording.tick_rate, seed=recording.seed, swarm=recording.swarm, **game_options)
+        self.checkpoint_interval = max(1, checkpoint_seconds * recording.tick_rate)
+        self.checkpoints = {0: self.game.snapshot()}
+        self.tick = 0
+        
+    @property
+    def finished(self):
+        return self.tick >= len(self.recording)
+        
+    def step(self):
+        # Simulate one recorded tick, returns False at the end of the recording
+        if self.finished:
+            return False
+        self.game.update(self.recording.controls(self.tick))
+        self.tick += 1
+        if self.tick % self.checkpoint_interval == 0 and self.tick not in self.checkpoints:
+            self.checkpoints[self.tick] = self.game.snapshot()
+        return True
+        
+    def run(self):
+        # Play to the end as fast as possible
+        while self.step():
+            pass
+            
+    def seek(self, tick):
+        # Jump to any tick of the recording
+        tick = max(0, min(tick, len(self.recording)))
+        checkpoint = max(t for t in self.checkpoints if t <= tick)
+        if tick < self.tick or checkpoint > self.tick:
+            self.game.restore(self.checkpoints[checkpoint])
+            self.tick = checkpoint
+        while self.tick < tick:
+            self.step()
+
+class CaptureEncoder:
+    # Saves captured frames on a background thread so PNG encoding never
+    # stalls the game loop. Jobs go through a bounded queue; when it is full
+    # new captures are dropped rather than blocking the frame.
+    def __init__(self, max_jobs=4):
+        self.jobs = queue.Queue(max_jobs)
+        self.thread = None
+        
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="capture-encoder", daemon=True)
+            self.thread.start()
+            
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            for filename, surface in job:
+                try:
+                    pygame.image.save(surface, filename)
+                except Exception as error:
+                    print(f"Could not save {filename}: {error}")
+                    
+    def submit(self, job):
+        # job is a list of (filename, surface) pairs the caller no longer
+        # draws to. Returns False if the queue was full and the job dropped.
+        self.start()
+        try:
+            self.jobs.put_nowait(job)
+            return True
+        except queue.Full:
+            return False
+            
+    def screenshot(self, screen, filename):
+        # Copy the frame now and encode it later
+        return self.submit([(filename, screen.copy())])
+        
+    def close(self, timeout=10):
+        # Let queued captures finish before the game exits
+        if self.thread is not None:
+            self.jobs.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+class ClipBuffer:
+    # Rolling instant replay: the last few seconds of frames, downscaled into
+    # a ring of surfaces that are allocated once and reused. dump() hands the
+    # ring's surfaces over to the encoder and starts a fresh ring, so saving
+    # a clip copies nothing on the game loop.
+    def __init__(self, seconds=10, fps=10, scale=0.5):
+        self.length = max(1, int(seconds * fps))
+        self.interval = 1000 / fps
+        self.size = (int(SCREEN_WIDTH * scale), int(SCREEN_HEIGHT * scale))
+        self.frames = [None] * self.length
+        self.head = 0
+        self.count = 0
+        self.last_capture = None
+        
+    def capture(self, screen, now):
+        # now is the wall-clock time in milliseconds
+        if self.last_capture is not None and now - self.last_capture < self.interval:
+            return
+        self.last_capture = now
+        frame = self.frames[self.head]
+        if frame is None:
+            frame = pygame.Surface(self.size, 0, screen)
+            self.frames[self.head] = frame
+        pygame.transform.scale(screen, self.size, frame)
+        self.head = (self.head + 1) % self.length
+        self.count = min(self.count + 1, self.length)
+        
+    def dump(self, encoder, directory):
+        # Queue the buffered frames, oldest first, as numbered PNGs in directory
+        if self.count == 0:
+            return 0
+        start = self.head - self.count
+        frames = [self.frames[(start + i) % self.length] for i in range(self.count)]
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as error:
+            print(f"Could not create {directory}: {error}")
+            return 0
+        job = [(os.path.join(directory, f"frame_{i:04d}.png"), frame) for i, frame in enumerate(frames)]
+        if not encoder.submit(job):
+            return 0
+        self.frames = [None] * self.length
+        self.head = 0
+        self.count = 0
+        return len(job)
+
+class DirtyRectRenderer:
+    # Presents only the parts of the screen that changed. The sky, clouds and
+    # terrain are rendered once into a backdrop; each frame the rects drawn
+    # on the previous frame are restored from it, the scene is drawn on top
+    # and only the old and new rects are pushed to the display. Clouds are
+    # frozen in this mode since scrolling them would dirty most of the
+    # screen. When the dirty area gets too large (overlays, many bullets) a
+    # full flip is cheaper than many small updates.
+    def __init__(self, max_dirty_share=0.4):
+        self.max_dirty_share = max_dirty_share
+        self.backdrop = None
+        self.terrain_layer = None
+        self.clouds = None
+        self.previous_rects = []
+        self.frames = 0
+        self.full_updates = 0
+
+    def invalidate(self):
+        # Redraw and present the whole screen on the next frame
+        self.backdrop = None
+        
+    def check_backdrop(self, screen, game):
+        # The terrain layer is rebuilt by the background when a wave changes
+        # the mountains, and reset() creates new cloud layers
+        game.background.check_rebuild(screen, game.mountains)
+        if (self.backdrop is not None and self.terrain_layer is game.background.terrain_layer
+                and self.clouds is game.clouds):
+            return False
+        if self.backdrop is None or self.backdrop.get_size() != screen.get_size():
+            self.backdrop = pygame.Surface(screen.get_size(), 0, screen)
+        game.draw_backdrop(self.backdrop)
+        self.terrain_layer = game.background.terrain_layer
+        self.clouds = game.clouds
+        return True
+
+    def begin(self, screen, game):
+        # Erase the previous frame's scene. Returns True if the whole screen
+        # has to be redrawn.
+        if self.check_backdrop(screen, game):
+            screen.blit(self.backdrop, (0, 0))
+            self.previous_rects = []
+            return True
+        for rect in self.previous_rects:
+            screen.blit(self.backdrop, rect, rect)
+        return False
+
+    def present(self, screen, rects, full=False):
+        # Push the previous and current rects to the display
+        self.frames += 1
+        bounds = screen.get_rect()
+        rects = [rect.clip(bounds) for rect in rects]
+        rects = [rect for rect in rects if rect.width and rect.height]
+        dirty = self.previous_rects + rects
+        self.previous_rects = rects
+        area = sum(rect.width * rect.height for rect in dirty)
+        if full or area > self.max_dirty_share * bounds.width * bounds.height:
+            self.full_updates += 1
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Wave-Based Flight Combat Game")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE,
+                        help="simulation ticks per second (default: %(default)s)")
+    parser.add_argument("--max-fps", type=int, default=60,
+                        help="rendered frames per second cap, 0 for uncapped (default: %(default)s)")
+    parser.add_argument("--cloud-density", type=float, default=1.0,
+                        help="cloud count multiplier for the parallax sky layers (default: %(default)s)")
+    parser.add_argument("--antialias", action="store_true",
+                        help="anti-alias the pre-rendered entity sprites")
+    parser.add_argument("--quality", choices=["auto"] + quality.names(), default="auto",
+                        help="rendering quality, auto adjusts it to hold the frame rate (default: %(default)s)")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="print how long each startup phase took")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only update the changed parts of the screen (clouds stay still)")
+    parser.add_argument("--profile", action="store_true",
+                        help="start with the frame profiler overlay shown (toggle with F3)")
+    parser.add_argument("--clip-seconds", type=float, default=10,
+                        help="seconds of half-resolution frames kept for F11 instant replay clips, 0 to disable (default: %(default)s)")
+    parser.add_argument("--leaderboard", type=int, metavar="N", nargs="?", const=10,
+                        help="print the N best runs (default 10) and exit")
+    parser.add_argument("--swarm", type=int, metavar="N", nargs="?", const=SQUADRONS["swarm"]["count"], default=0,
+                        help=f"fly the final wave against a swarm of N enemy planes (default {SQUADRONS['swarm']['count']})")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed for the run (default: random)")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the seed and inputs of each run to FILE (later runs get -2, -3, ... suffixes)")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play back an input recording (Left/Right arrows seek)")
+    parser.add_argument("--fast", action="store_true",
+                        help="with --replay, simulate as fast as possible without a window and print the result")
+    parser.add_argument("--seek", type=float, default=0.0, metavar="SECONDS",
+                        help="with --replay, start playback this far into the recording")
+    return parser.parse_args(argv)
+
+def load_recording(path):
+    try:
+        return InputRecording.load(path)
+    except (OSError, ValueError, struct.error, zlib.error) as error:
+        print(f"Could not load recording {path}: {error}")
+        return None
+
+def save_recording(recording, game, path):
+    if game.game_over or game.victory:
+        recording.final_score = game.score
+    try:
+        recording.save(path)
+        print(f"Recording saved to {path} ({len(recording)} ticks)")
+    except OSError as error:
+        print(f"Could not save recording {path}: {error}")
+
+def recording_path(path, run):
+    # The first run is saved as given, later ones get a run number
+    if run == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{run}{ext}"
+
+def replay_fast(path):
+    # Re-simulate a recording without rendering, returns the exit status
+    recording = load_recording(path)
+    if recording is None:
+        return 1
+    replay = Replay(recording, high_score=0)
+    start = time.perf_counter()
+    replay.run()
+    elapsed = time.perf_counter() - start
+    game = replay.game
+    ticks = len(recording)
+    print(f"Replayed {ticks} ticks ({ticks / recording.tick_rate:.1f} s of play) in {elapsed:.2f} s "
+          f"({ticks / max(elapsed, 1e-9):.0f} ticks/s)")
+    print(f"Score {game.score}, wave {game.current_wave}, health {game.airplane.health}, "
+          f"fuel {game.airplane.fuel:.1f}, game over {game.game_over}, victory {game.victory}")
+    if recording.final_score >= 0 and game.score != recording.final_score:
+        print(f"Mismatch: the recorded run ended with a score of {recording.final_score}")
+        return 1
+    return 0
+
+def print_pool_stats(game):
+    print("Pools:")
+    for name, stats in game.pool_stats().items():
+        print(f"  {name:<14}" + "  ".join(f"{key} {value}" for key, value in stats.items()))
+    print("UI widgets (last frame): " + "  ".join(f"{key} {value}" for key, value in game.ui.stats().items()))
+
+def print_leaderboard(count):
+    leaderboard = Leaderboard().open()
+    leaderboard.loaded.wait()
+    runs = leaderboard.top(count)
+    leaderboard.close()
+    if not runs:
+        print("No runs recorded yet")
+        return
+    print(f"{'#':>3} {'score':>8} {'wave':>5} {'time':>7}  played")
+    for rank, (score, wave, duration, victory, played_at) in enumerate(runs, 1):
+        played = time.strftime("%Y-%m-%d %H:%M", time.localtime(played_at))
+        result = "victory" if victory else ""
+        print(f"{rank:>3} {score:>8} {wave:>5} {duration:>6.0f}s  {played} {result}")
+
+def init_display():
+    # Only start the subsystems the game uses; the mixer is started by the
+    # sound loader in the background
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Wave-Based Flight Combat Game")
+    return screen
+
 def main():
-    game = Game()
+    profile = StartupProfile(enabled="--startup-profile" in sys.argv)
+    profile.record("imports", IMPORT_START_TIME, time.perf_counter())
+    
+    args = parse_args()
+    if args.replay and args.fast:
+        sys.exit(replay_fast(args.replay))
+    if args.leaderboard is not None:
+        print_leaderboard(args.leaderboard)
+        sys.exit()
+        
+    with profile.phase("display init"):
+        screen = init_display()
+    if args.quality == "auto":
+        quality.enabled = True
+    else:
+        quality.set_level(quality.names().index(args.quality))
+    sprite_cache.set_antialias(args.antialias and quality.settings["antialias"])
+    
+    # Clock for controlling frame rate
+    clock = pygame.time.Clock()
+    
+    # Sounds and fonts load while the first frames are drawn
+    sounds = SoundBank(assets)
+    assets_start = time.perf_counter()
+    def assets_loaded():
+        if assets.missing("sound"):
+            print("Sound files not found. Game will run without sound.")
+        sounds.play("engine", -1)  # Loop indefinitely
+        profile.record("assets (background)", assets_start, time.perf_counter())
+        if profile.reported:
+            # Finished after the first frame, so report it on its own
+            profile.report("background loading")
+        if profile.enabled:
+            assets.report()
+    assets.load_async(assets_loaded)
+    
+    # Past runs load in the background; finished runs are saved from there too
+    leaderboard = Leaderboard().open()
+    
+    replay = None
+    recording = None
+    with profile.phase("game setup"):
+        if args.replay:
+            replay_recording = load_recording(args.replay)
+            if replay_recording is None:
+                pygame.quit()
+                sys.exit(1)
+            replay = Replay(replay_recording, sounds=sounds, high_score=0, cloud_density=args.cloud_density)
+            replay.seek(int(args.seek * replay_recording.tick_rate))
+            game = replay.game
+        else:
+            seed = args.seed
+            if args.record:
+                seed = seed if seed is not None else random.randrange(2 ** 32)
+                recording = InputRecording(seed, args.tick_rate, swarm=args.swarm)
+                run = 1
+            game = Game(args.tick_rate, sounds=sounds, cloud_density=args.cloud_density, seed=seed,
+                        leaderboard=leaderboard, swarm=args.swarm)
     game.display_instructions()
     
+    # Everything created during startup lives until exit; keep it out of
+    # the garbage collector's full passes so they stay short
+    gc.freeze()
+    first_frame = True
+    renderer = DirtyRectRenderer() if args.dirty_rects else None
+    profiler.set_enabled(args.profile)
+    frame_budget = 1000 / args.max_fps if args.max_fps > 0 else 1000 / 60
+    quality.budget_ms = frame_budget
+    
+    # Screenshots and clips are encoded in the background
+    encoder = CaptureEncoder()
+    clip_buffer = ClipBuffer(args.clip_seconds) if args.clip_seconds > 0 else None
+    
     # Add screenshot notification text
     screenshot_text = None
     screenshot_time = 0
     
+    # Real time not yet consumed by simulation ticks, in milliseconds
+    accumulator = 0.0
+    previous_time = time.perf_counter()
+    
     running = True
     while running:
+        frame_start = time.perf_counter()
+        
         # Handle events
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -1024,34 +3129,135 @@ def main():
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     running = False
-                elif event.key == pygame.K_SPACE and (game.game_over or game.victory):
-                    game.reset()
+                elif event.key == pygame.K_SPACE and (game.game_over or game.victory) and not replay:
+                    if recording is not None:
+                        # Each run is recorded to its own file
+                        save_recording(recording, game, recording_path(args.record, run))
+                        run += 1
+                        recording = InputRecording(random.randrange(2 ** 32), args.tick_rate, swarm=args.swarm)
+                        game.reset(recording.seed)
+                    else:
+                        game.reset()
+                elif event.key in (pygame.K_LEFT, pygame.K_RIGHT) and replay:
+                    # Seek one checkpoint interval back or forward
+                    direction = -1 if event.key == pygame.K_LEFT else 1
+                    replay.seek(replay.tick + direction * replay.checkpoint_interval)
+                    accumulator = 0.0
+                    if renderer:
+                        renderer.invalidate()
                 elif event.key == pygame.K_F12:  # F12 key for screenshot
                     timestamp = pygame.time.get_ticks()
                     filename = f"flight_game_screenshot_{timestamp}.png"
-                    pygame.image.save(screen, filename)
-                    screenshot_text = f"Screenshot saved as {filename}"
+                    if encoder.screenshot(screen, filename):
+                        screenshot_text = f"Screenshot saved as {filename}"
+                    else:
+                        screenshot_text = "Still saving earlier captures, screenshot skipped"
                     screenshot_time = pygame.time.get_ticks()
                     print(screenshot_text)
+                elif event.key == pygame.K_F11 and clip_buffer:
+                    timestamp = pygame.time.get_ticks()
+                    directory = f"flight_game_clip_{timestamp}"
+                    frames = clip_buffer.dump(encoder, directory)
+                    if frames:
+                        screenshot_text = f"Saving {frames} clip frames to {directory}"
+                    else:
+                        screenshot_text = "Clip not saved"
+                    screenshot_time = pygame.time.get_ticks()
+                    print(screenshot_text)
+                elif event.key == pygame.K_F3:
+                    if profiler.enabled:
+                        profiler.report()
+                        print_pool_stats(game)
+                    profiler.set_enabled(not profiler.enabled)
+                    if renderer:
+                        # Repaint everything so the overlay doesn't linger
+                        renderer.invalidate()
+        
+        # Update game state in fixed ticks covering the elapsed real time
+        now = time.perf_counter()
+        elapsed_ms = (now - previous_time) * 1000
+        accumulator += elapsed_ms
+        previous_time = now
+        tick_ms = game.clock.tick_ms
+        steps = 0
+        controls = InputState.from_keys(pygame.key.get_pressed())
+        profiler.start("update")
+        while accumulator >= tick_ms and steps < MAX_TICKS_PER_FRAME:
+            if replay:
+                replay.step()
+            else:
+                if recording is not None and not (game.game_over or game.victory):
+                    recording.append(controls)
+                game.update(controls)
+            accumulator -= tick_ms
+            steps += 1
+        profiler.stop("update")
+        if accumulator >= tick_ms:
+            # Too far behind, drop the backlog instead of catching up forever
+            accumulator = accumulator % tick_ms
+        
+        # Draw everything, interpolated between the last two ticks
+        alpha = accumulator / tick_ms
+        if renderer:
+            full_redraw = renderer.begin(screen, game)
+            rects = game.draw_scene(screen, alpha)
+        else:
+            rects = game.draw(screen, alpha)
         
-        # Update game state
-        game.update()
-        
-        # Draw everything
-        game.draw(screen)
+        # Keep the instant replay frames before any notifications are drawn
+        if clip_buffer:
+            profiler.start("clip capture")
+            clip_buffer.capture(screen, pygame.time.get_ticks())
+            profiler.stop("clip capture")
         
         # Display screenshot notification if needed
         if screenshot_text and pygame.time.get_ticks() - screenshot_time < 3000:  # Show for 3 seconds
-            font = pygame.font.SysFont(None, 24)
-            text = font.render(screenshot_text, True, (255, 255, 255))
-            screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, SCREEN_HEIGHT - 50))
+            text = text_cache.render(screenshot_text, (255, 255, 255), 24)
+            rects.append(screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, SCREEN_HEIGHT - 50)))
+            
+        # Show the playback position
+        if replay:
+            rate = replay.recording.tick_rate
+            text = text_cache.render(f"REPLAY {replay.tick // rate}s / {len(replay.recording) // rate}s"
+                                     "   Left/Right: seek", WHITE, 24)
+            rects.append(screen.blit(text, (SCREEN_WIDTH - text.get_width() - 10, SCREEN_HEIGHT - 30)))
+            
+        # Draw the profiler overlay
+        if profiler.enabled:
+            rects.extend(profiler.draw(screen, frame_budget,
+                                       [f"ui widgets: {game.ui.drawn} drawn, {game.ui.rerendered} re-rendered",
+                                        f"quality: {quality.settings['name']}, p90 work {quality.load_ms:.2f} ms"]))
         
         # Update the display
-        pygame.display.flip()
+        profiler.start("display update")
+        if renderer:
+            renderer.present(screen, rects, full_redraw)
+        else:
+            pygame.display.flip()
+        profiler.stop("display update")
+        profiler.end_frame()
+        
+        if first_frame:
+            first_frame = False
+            profile.record("first frame", previous_time, time.perf_counter())
+            profile.report("launch to first frame")
+        elif quality.record((time.perf_counter() - frame_start) * 1000, elapsed_ms):
+            # Adjust to the new quality level before the next frame
+            print(f"Quality {quality.settings['name']} (p90 frame work {quality.load_ms:.1f} ms)")
+            sprite_cache.set_antialias(args.antialias and quality.settings["antialias"])
+            if renderer:
+                renderer.invalidate()
         
         # Cap the frame rate
-        clock.tick(60)
+        clock.tick(args.max_fps)
     
+    if recording is not None:
+        save_recording(recording, game, recording_path(args.record, run))
+    encoder.close()
+    leaderboard.close()
+    if profiler.enabled:
+        profiler.report()
+        print_pool_stats(game)
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,1354 @@
+import os
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import heapq
+import math
+import multiprocessing
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+
+import numpy as np
+import pygame
+
+from flight_game import (Airplane, Collectible, Game, InputState, Mountain, Obstacle, SimulationClock,
+                         SoundBank, Trail, BLACK, ENEMY_COLOR, MAX_TICKS_PER_FRAME, SCREEN_WIDTH,
+                         SCREEN_HEIGHT, SQUADRONS, TICK_RATE, WHITE, assets, init_display, interpolate,
+                         interpolate_array, text_cache)
+
+# Networked co-op and versus games over UDP. One authoritative server runs
+# the only real Game. Every tick each client sends its controls (plus the
+# ones the server hasn't confirmed yet, so a lost packet costs nothing) and
+# the server sends back snapshots of the game state, delta-compressed
+# against the last snapshot that client acknowledged. Clients predict their
+# own plane from their inputs and draw everything else interpolated between
+# snapshots a little in the past.
+#
+#   python netplay.py server --players 2
+#   python netplay.py client HOST[:PORT]
+#   python netplay.py local --bot --latency 40 --loss 0.05
+#   python netplay.py test --latency 40 --jitter 10 --loss 0.05
+
+DEFAULT_PORT = 47800
+MAGIC = b"SW"
+
+# Packet types
+HELLO = 1
+WELCOME = 2
+FULL = 3
+INPUT = 4
+SNAPSHOT = 5
+BYE = 6
+
+HEADER = struct.Struct("<2sBH")  # magic, packet type, sequence number
+WELCOME_FORMAT = struct.Struct("<BBHBHB")  # player, players, tick rate, versus, swarm, snapshot interval
+INPUT_FORMAT = struct.Struct("<BIIB")  # acked snapshot epoch and tick, newest input, input count
+SNAPSHOT_FORMAT = struct.Struct("<BIII")  # epoch, tick, baseline tick, newest input applied
+COUNTS = struct.Struct("<HHH")  # removed, new and changed rows of a table
+NO_BASELINE = 0xFFFFFFFF
+
+RESTART = 32  # Input bit asking for a new game once this one has ended
+MAX_INPUTS_PER_PACKET = 32  # Unconfirmed inputs resent in every input packet
+INPUT_BACKLOG = 6  # Queued inputs beyond this are skipped to keep the delay down
+QUEUE_WINDOW = 120  # Ticks; an input queue that never got shorter than 2 in this long loses one input
+HISTORY = 64  # Snapshots kept as delta baselines
+UDP_OVERHEAD = 28  # IPv4 and UDP headers, counted in the bandwidth figures
+POSITION_SCALE = 8  # Positions are sent in 1/8 pixels
+DEAD_RECKONING_TOLERANCE = 0.5  # Pixels of drift before an obstacle or bullet gets a new origin
+SMOOTHING = 0.85  # Share of a prediction correction still drawn one tick later
+SNAP_DISTANCE = 64  # Corrections larger than this aren't smoothed
+STATS_SAMPLES = 1000
+
+# Snapshot tables. Every row has an id, rows are kept sorted by it.
+# Obstacles and bullets are sent as dead reckoning origins: where the object
+# was at a game clock tick and how it moves, so the row only changes when
+# the object does something its motion doesn't predict.
+GAME_TRANSITION, GAME_OVER, GAME_VICTORY = 1, 2, 4
+PLANE_INVINCIBLE, PLANE_DOWN = 1, 2
+COLLECTIBLE_TYPES = ["fuel", "health", "speed"]
+TABLES = [
+    ("game", np.dtype([("id", "<u1"), ("score", "<i4"), ("high_score", "<i4"), ("wave", "<u1"),
+                       ("flags", "<u1"), ("clock", "<u4"), ("wave_start", "<u4")])),
+    ("planes", np.dtype([("id", "<u1"), ("x", "<i2"), ("y", "<i2"), ("angle", "<u2"), ("speed", "<u2"),
+                         ("max_speed", "<u1"), ("health", "<i2"), ("fuel", "<u2"), ("flags", "<u1"),
+                         ("score", "<i4")])),
+    ("mountains", np.dtype([("id", "<u1"), ("x", "<i2"), ("base_width", "<u2"), ("height", "<f4"),
+                            ("r", "<u1"), ("g", "<u1"), ("b", "<u1")])),
+    ("collectibles", np.dtype([("id", "<u4"), ("x", "<i2"), ("y", "<i2"), ("type", "<u1")])),
+    ("obstacles", np.dtype([("id", "<u4"), ("x", "<f4"), ("y", "<f4"), ("angle", "<f4"), ("speed", "<f4"),
+                            ("rotation", "<f4"), ("tick", "<u4"), ("size", "<u1")])),
+    ("enemies", np.dtype([("id", "<u4"), ("x", "<i2"), ("y", "<i2"), ("angle", "<u1"), ("health", "<u1")])),
+    ("bullets", np.dtype([("id", "<u2"), ("x", "<f4"), ("y", "<f4"), ("vx", "<f4"), ("vy", "<f4"),
+                          ("tick", "<u4"), ("faction", "<u1")])),
+]
+EMPTY_STATE = {name: np.zeros(0, dtype) for name, dtype in TABLES}
+
+def wrapped(delta, size):
+    # Shortest offset on a screen that wraps around
+    return delta - size * round(delta / size)
+
+def unsigned(dtype):
+    # Deltas are taken on the raw bits, so they wrap instead of overflowing
+    return np.dtype(f"<u{dtype.itemsize}")
+
+def encode_table(current, baseline, out):
+    # Appends the delta from baseline to current to the list of byte strings
+    # out: the ids removed, the new rows in full and, for rows in both, the
+    # field differences of the rows that changed. Columns are written one
+    # after another so zlib sees runs of similar values.
+    dtype = current.dtype
+    ids = current["id"]
+    base_ids = baseline["id"]
+    if len(base_ids):
+        index = np.minimum(np.searchsorted(base_ids, ids), len(base_ids) - 1)
+        matched = base_ids[index] == ids
+    else:
+        index = np.zeros(len(ids), dtype=np.int64)
+        matched = np.zeros(len(ids), dtype=bool)
+    removed = base_ids[~np.isin(base_ids, ids)]
+    new = current[~matched]
+    kept = current[matched]
+    previous = baseline[index[matched]]
+    deltas = []
+    changed = np.zeros(len(kept), dtype=bool)
+    for name in dtype.names[1:]:
+        kind = unsigned(dtype[name])
+        delta = np.ascontiguousarray(kept[name]).view(kind) - np.ascontiguousarray(previous[name]).view(kind)
+        deltas.append(delta)
+        changed |= delta != 0
+    out.append(COUNTS.pack(len(removed), len(new), int(changed.sum())))
+    out.append(removed.tobytes())
+    for name in dtype.names:
+        out.append(np.ascontiguousarray(new[name]).tobytes())
+    out.append(np.ascontiguousarray(kept["id"][changed]).tobytes())
+    for delta in deltas:
+        out.append(delta[changed].tobytes())
+
+def decode_table(data, offset, dtype, baseline):
+    # Inverse of encode_table(), returns the table and the offset after it
+    removed_count, new_count, changed_count = COUNTS.unpack_from(data, offset)
+    offset += COUNTS.size
+    id_type = dtype["id"]
+    removed = np.frombuffer(data, id_type, removed_count, offset)
+    offset += removed.nbytes
+    new = np.zeros(new_count, dtype)
+    for name in dtype.names:
+        column = np.frombuffer(data, dtype[name], new_count, offset)
+        new[name] = column
+        offset += column.nbytes
+    changed = np.frombuffer(data, id_type, changed_count, offset)
+    offset += changed.nbytes
+
+    table = baseline[~np.isin(baseline["id"], removed)]
+    index = np.searchsorted(table["id"], changed)
+    for name in dtype.names[1:]:
+        kind = unsigned(dtype[name])
+        delta = np.frombuffer(data, kind, changed_count, offset)
+        offset += delta.nbytes
+        if changed_count:
+            values = np.ascontiguousarray(table[name]).view(kind).copy()
+            values[index] += delta
+            table[name] = values.view(dtype[name])
+    if new_count:
+        table = np.concatenate([table, new])
+        table = table[np.argsort(table["id"], kind="stable")]
+    return table, offset
+
+def encode_snapshot(state, baseline=None):
+    baseline = baseline if baseline is not None else EMPTY_STATE
+    out = []
+    for name, _ in TABLES:
+        encode_table(state[name], baseline[name], out)
+    return zlib.compress(b"".join(out))
+
+def decode_snapshot(payload, baseline=None):
+    baseline = baseline if baseline is not None else EMPTY_STATE
+    data = zlib.decompress(payload)
+    state = {}
+    offset = 0
+    for name, dtype in TABLES:
+        state[name], offset = decode_table(data, offset, dtype, baseline[name])
+    return state
+
+def sorted_table(rows, dtype):
+    table = np.array(rows, dtype=dtype) if rows else np.zeros(0, dtype)
+    return table[np.argsort(table["id"], kind="stable")]
+
+class StateCapture:
+    # Reads the server's Game into snapshot tables. Obstacles and
+    # collectibles are sent with their pool serial number as id, so a pooled
+    # object that comes back into play is a new row, not a moved one. Dead
+    # reckoning origins are kept between captures and only replaced once the
+    # object drifts from them.
+    def __init__(self):
+        self.obstacle_origins = {}  # Serial -> (x, y, angle, speed, rotation, tick, size)
+        self.bullet_x = None  # Per projectile slot: origin of the bullet in it
+
+    def read(self, game):
+        clock = game.clock.ticks
+        dt = game.clock.dt
+        flags = (game.wave_transition * GAME_TRANSITION | game.game_over * GAME_OVER |
+                 game.victory * GAME_VICTORY)
+        state = {"game": np.array([(0, game.score, game.get_high_score(), game.current_wave, flags, clock,
+                                    round(game.wave_start_time / game.clock.tick_ms))], dtype=TABLES[0][1])}
+
+        planes = []
+        for index, plane in enumerate(game.airplanes):
+            planes.append((index, round(plane.x * POSITION_SCALE), round(plane.y * POSITION_SCALE),
+                           round(plane.angle % 360 * 100) % 36000, round(plane.speed * 1000),
+                           int(plane.max_speed), int(plane.health), round(plane.fuel * 500),
+                           plane.invincible * PLANE_INVINCIBLE | plane.down * PLANE_DOWN, plane.score))
+        state["planes"] = np.array(planes, dtype=TABLES[1][1])
+        state["mountains"] = np.array([(index, round(m.x), m.base_width, m.height) + tuple(m.color)
+                                       for index, m in enumerate(game.mountains)], dtype=TABLES[2][1])
+
+        state["collectibles"] = sorted_table([(c.serial, round(c.x), round(c.y),
+                                               COLLECTIBLE_TYPES.index(c.type)) for c in game.collectibles],
+                                             TABLES[3][1])
+
+        origins = {}
+        for obstacle in game.obstacles:
+            wire = obstacle.serial
+            origin = self.obstacle_origins.get(wire)
+            if origin is not None:
+                x, y, angle, speed, rotation, tick, size = origin
+                elapsed = (clock - tick) * dt
+                if (speed != obstacle.speed or rotation != obstacle.rotation_speed or size != obstacle.size or
+                        abs(x - speed * elapsed - obstacle.x) > DEAD_RECKONING_TOLERANCE or
+                        abs(y - obstacle.y) > DEAD_RECKONING_TOLERANCE or
+                        abs(angle + rotation * elapsed - obstacle.angle) > 1):
+                    origin = None
+            if origin is None:
+                origin = (obstacle.x, obstacle.y, obstacle.angle, obstacle.speed, obstacle.rotation_speed,
+                          clock, obstacle.size)
+            origins[wire] = origin
+        self.obstacle_origins = origins
+        state["obstacles"] = sorted_table([(wire,) + origin for wire, origin in origins.items()], TABLES[4][1])
+
+        squadron = game.squadron
+        enemies = np.zeros(len(squadron), dtype=TABLES[5][1])
+        enemies["id"] = squadron.ids
+        enemies["x"] = np.rint(squadron.x * POSITION_SCALE)
+        enemies["y"] = np.rint(squadron.y * POSITION_SCALE)
+        enemies["angle"] = np.rint(squadron.angle % 360 * (256 / 360)).astype(np.int64) % 256
+        enemies["health"] = np.clip(squadron.health, 0, 255)
+        state["enemies"] = enemies
+
+        state["bullets"] = self.read_bullets(game.projectiles, clock, dt)
+        return state
+
+    def read_bullets(self, projectiles, clock, dt):
+        # Bullets fly in a straight line, so a slot keeps its origin until a
+        # new bullet is fired from it
+        active = projectiles.active
+        if self.bullet_x is None:
+            capacity = projectiles.capacity
+            self.bullet_x, self.bullet_y = np.zeros(capacity), np.zeros(capacity)
+            self.bullet_vx, self.bullet_vy = np.zeros(capacity), np.zeros(capacity)
+            self.bullet_tick = np.zeros(capacity, dtype=np.int64)
+            self.bullet_active = np.zeros(capacity, dtype=bool)
+        elapsed = (clock - self.bullet_tick) * dt
+        drift = (np.abs(self.bullet_x + self.bullet_vx * elapsed - projectiles.x) +
+                 np.abs(self.bullet_y + self.bullet_vy * elapsed - projectiles.y))
+        reset = active & (~self.bullet_active | (self.bullet_vx != projectiles.vx) |
+                          (self.bullet_vy != projectiles.vy) | (drift > DEAD_RECKONING_TOLERANCE))
+        self.bullet_x[reset] = projectiles.x[reset]
+        self.bullet_y[reset] = projectiles.y[reset]
+        self.bullet_vx[reset] = projectiles.vx[reset]
+        self.bullet_vy[reset] = projectiles.vy[reset]
+        self.bullet_tick[reset] = clock
+        self.bullet_active = active.copy()
+
+        slots = np.flatnonzero(active)
+        bullets = np.zeros(len(slots), dtype=TABLES[6][1])
+        bullets["id"] = slots
+        bullets["x"] = self.bullet_x[slots]
+        bullets["y"] = self.bullet_y[slots]
+        bullets["vx"] = self.bullet_vx[slots]
+        bullets["vy"] = self.bullet_vy[slots]
+        bullets["tick"] = self.bullet_tick[slots]
+        bullets["faction"] = projectiles.faction[slots]
+        return bullets
+
+class NetworkConditions:
+    # Simulated network for testing on one machine. Every packet sent is
+    # delayed by latency plus up to jitter milliseconds (one way) and lost
+    # with probability loss. Uses its own generator so the game's random
+    # numbers are never touched.
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+
+    def drop(self):
+        return self.loss > 0 and self.rng.random() < self.loss
+
+    def delay(self):
+        return (self.latency + self.rng.uniform(0, self.jitter)) / 1000
+
+    def describe(self):
+        return f"latency {self.latency:g} ms, jitter {self.jitter:g} ms, loss {self.loss:.0%}"
+
+class Traffic:
+    # Packets and bytes to and from one peer, with per second rates. Loss is
+    # counted at the receiver from gaps in the peer's sequence numbers.
+    __slots__ = ("sent_bytes", "sent_packets", "received_bytes", "received_packets", "lost", "late",
+                 "next_sequence", "expected", "rate_time", "rate_sent", "rate_received", "send_rate",
+                 "receive_rate")
+
+    def __init__(self):
+        self.sent_bytes = self.sent_packets = 0
+        self.received_bytes = self.received_packets = 0
+        self.lost = self.late = 0
+        self.next_sequence = 0
+        self.expected = None
+        self.rate_time = time.perf_counter()
+        self.rate_sent = self.rate_received = 0
+        self.send_rate = self.receive_rate = 0.0
+
+    def received(self, sequence, size):
+        self.received_packets += 1
+        self.received_bytes += size + UDP_OVERHEAD
+        if self.expected is not None:
+            gap = (sequence - self.expected) & 0xFFFF
+            if gap >= 0x8000:
+                # Older than one already received: it was counted as lost
+                self.late += 1
+                self.lost = max(0, self.lost - 1)
+                return
+            self.lost += gap
+        self.expected = (sequence + 1) & 0xFFFF
+
+    def update_rates(self, now):
+        elapsed = now - self.rate_time
+        if elapsed >= 1.0:
+            self.send_rate = (self.sent_bytes - self.rate_sent) / elapsed
+            self.receive_rate = (self.received_bytes - self.rate_received) / elapsed
+            self.rate_time = now
+            self.rate_sent = self.sent_bytes
+            self.rate_received = self.received_bytes
+
+    def loss(self):
+        total = self.received_packets + self.lost
+        return self.lost / total if total else 0.0
+
+class NetSocket:
+    # Non-blocking UDP socket that counts the traffic of every peer and can
+    # run packets through simulated network conditions on the way out
+    def __init__(self, address=("0.0.0.0", 0), conditions=None):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(address)
+        self.socket.setblocking(False)
+        self.conditions = conditions if conditions is not None else NetworkConditions()
+        self.delayed = []  # Heap of (due time, order, data, address)
+        self.order = 0
+        self.peers = {}  # Address -> Traffic
+        self.dropped = 0  # Packets lost by the simulated network
+
+    def address(self):
+        return self.socket.getsockname()
+
+    def traffic(self, address):
+        traffic = self.peers.get(address)
+        if traffic is None:
+            traffic = self.peers[address] = Traffic()
+        return traffic
+
+    def send(self, kind, payload, address):
+        traffic = self.traffic(address)
+        data = HEADER.pack(MAGIC, kind, traffic.next_sequence) + payload
+        traffic.next_sequence = (traffic.next_sequence + 1) & 0xFFFF
+        traffic.sent_packets += 1
+        traffic.sent_bytes += len(data) + UDP_OVERHEAD
+        if self.conditions.drop():
+            self.dropped += 1
+            return
+        delay = self.conditions.delay()
+        if delay > 0:
+            heapq.heappush(self.delayed, (time.perf_counter() + delay, self.order, data, address))
+            self.order += 1
+        else:
+            self.transmit(data, address)
+
+    def transmit(self, data, address):
+        try:
+            self.socket.sendto(data, address)
+        except OSError:
+            pass  # An unreachable peer or a full buffer loses the packet, like the network would
+
+    def flush(self):
+        # Sends the delayed packets that are due
+        now = time.perf_counter()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, data, address = heapq.heappop(self.delayed)
+            self.transmit(data, address)
+
+    def next_due(self):
+        return self.delayed[0][0] if self.delayed else None
+
+    def wait(self, deadline):
+        # Sleeps until a packet arrives, a delayed packet is due or the deadline
+        due = self.next_due()
+        if due is not None:
+            deadline = min(deadline, due)
+        timeout = deadline - time.perf_counter()
+        if timeout > 0:
+            select.select([self.socket], [], [], timeout)
+
+    def receive(self):
+        # Returns the packets waiting as (type, payload, address)
+        self.flush()
+        packets = []
+        while True:
+            try:
+                data, address = self.socket.recvfrom(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionError:
+                continue  # Refused by a peer that went away, left over from an earlier send
+            if len(data) < HEADER.size:
+                continue
+            magic, kind, sequence = HEADER.unpack_from(data)
+            if magic != MAGIC:
+                continue
+            self.traffic(address).received(sequence, len(data))
+            packets.append((kind, data[HEADER.size:], address))
+        now = time.perf_counter()
+        for traffic in self.peers.values():
+            traffic.update_rates(now)
+        return packets
+
+    def close(self):
+        self.socket.close()
+
+class ClientSlot:
+    # The server's view of one connected player
+    __slots__ = ("player", "address", "inputs", "applied", "newest", "last_mask", "acked_tick",
+                 "waits", "skipped", "shortest_queue", "queue_ticks", "snapshots", "full_snapshots",
+                 "snapshot_bytes")
+
+    def __init__(self, player, address):
+        self.player = player
+        self.address = address
+        self.inputs = {}  # Sequence -> mask, not applied yet
+        self.applied = 0  # Newest input sequence applied
+        self.newest = 0  # Newest input sequence received
+        self.last_mask = 0
+        self.acked_tick = None  # Newest snapshot of this game the client has
+        self.waits = 0  # Ticks the input hadn't arrived yet and the last one was repeated
+        self.skipped = 0  # Inputs lost or dropped from a backlog
+        self.shortest_queue = INPUT_BACKLOG
+        self.queue_ticks = 0
+        self.snapshots = 0
+        self.full_snapshots = 0
+        self.snapshot_bytes = 0
+
+    def next_mask(self):
+        # The controls for the next tick. A missing input is repeated from
+        # the last one; it is skipped once later inputs have arrived. A burst
+        # of jitter leaves inputs queued, which would delay every later one,
+        # so a queue that stays long is shortened.
+        queued = self.newest - self.applied
+        self.shortest_queue = min(self.shortest_queue, queued)
+        self.queue_ticks += 1
+        if self.queue_ticks >= QUEUE_WINDOW:
+            if self.shortest_queue > 1:
+                self.skip()
+            self.shortest_queue = INPUT_BACKLOG
+            self.queue_ticks = 0
+        while self.newest - self.applied > INPUT_BACKLOG:
+            self.skip()
+        sequence = self.applied + 1
+        mask = self.inputs.pop(sequence, None)
+        if mask is None:
+            if self.newest > sequence:
+                self.applied = sequence
+                self.skipped += 1
+            elif self.newest:
+                self.waits += 1
+            return self.last_mask & ~RESTART
+        self.applied = sequence
+        self.last_mask = mask
+        return mask
+
+    def skip(self):
+        self.applied += 1
+        self.last_mask = self.inputs.pop(self.applied, self.last_mask)
+        self.skipped += 1
+
+class NetServer:
+    # Authoritative game host. The game starts once every player has joined.
+    # Each tick applies one input per player; every snapshot interval each
+    # client gets the state as a delta from the newest snapshot it has
+    # acknowledged, or in full when there is none.
+    def __init__(self, host="0.0.0.0", port=DEFAULT_PORT, players=2, versus=False, swarm=0, seed=None,
+                 tick_rate=TICK_RATE, snapshot_rate=30, conditions=None, verbose=True):
+        self.socket = NetSocket((host, port), conditions)
+        self.players = players
+        self.versus = versus
+        self.swarm = swarm
+        self.tick_rate = tick_rate
+        self.interval = max(1, round(tick_rate / snapshot_rate))
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.slots = [None] * players
+        self.game = None
+        self.epoch = 0  # Counts restarts; snapshots of an older game are never used as baselines
+        self.tick = 0
+        self.capture = StateCapture()
+        self.history = {}  # Tick -> state of the snapshots sent
+        self.ticks_sent = deque()
+
+    def slot_of(self, address):
+        for slot in self.slots:
+            if slot is not None and slot.address == address:
+                return slot
+        return None
+
+    def welcome(self, slot):
+        payload = WELCOME_FORMAT.pack(slot.player, self.players, self.tick_rate, self.versus, self.swarm,
+                                      self.interval)
+        self.socket.send(WELCOME, payload, slot.address)
+
+    def handle(self, kind, payload, address):
+        slot = self.slot_of(address)
+        if kind == HELLO:
+            if slot is None:
+                if None not in self.slots:
+                    self.socket.send(FULL, b"", address)
+                    return
+                player = self.slots.index(None)
+                slot = self.slots[player] = ClientSlot(player, address)
+                self.log(f"Player {player + 1} joined from {address[0]}:{address[1]}")
+            self.welcome(slot)
+            if self.game is None and None not in self.slots:
+                self.start()
+        elif kind == INPUT and slot is not None and len(payload) >= INPUT_FORMAT.size:
+            epoch, acked_tick, newest, count = INPUT_FORMAT.unpack_from(payload)
+            if epoch == self.epoch and acked_tick in self.history:
+                if slot.acked_tick is None or acked_tick > slot.acked_tick:
+                    slot.acked_tick = acked_tick
+            masks = payload[INPUT_FORMAT.size:INPUT_FORMAT.size + count]
+            first = newest - len(masks) + 1
+            for sequence, mask in enumerate(masks, first):
+                if sequence > slot.applied:
+                    slot.inputs[sequence] = mask
+            slot.newest = max(slot.newest, newest)
+        elif kind == BYE and slot is not None:
+            # The plane flies on without controls; someone else may take the slot
+            self.slots[slot.player] = None
+            self.log(f"Player {slot.player + 1} left")
+
+    def start(self):
+        seed = self.rng.randrange(2 ** 32)
+        self.game = Game(self.tick_rate, high_score=0, seed=seed, swarm=self.swarm, players=self.players,
+                         versus=self.versus, announce=self.verbose)
+        self.log(f"All {self.players} players joined, game started with seed {seed}")
+
+    def restart(self):
+        self.game.reset(self.rng.randrange(2 ** 32))
+        self.epoch = (self.epoch + 1) & 0xFF
+        self.capture = StateCapture()
+        self.history.clear()
+        self.ticks_sent.clear()
+        for slot in self.slots:
+            if slot is not None:
+                slot.acked_tick = None
+        self.log("Game restarted")
+
+    def step(self):
+        masks = [slot.next_mask() if slot is not None else 0 for slot in self.slots]
+        game = self.game
+        if (game.game_over or game.victory) and any(mask & RESTART for mask in masks):
+            self.restart()
+        else:
+            game.update([InputState.from_mask(mask & ~RESTART) for mask in masks])
+        self.tick += 1
+        if self.tick % self.interval == 0:
+            self.send_snapshots()
+
+    def send_snapshots(self):
+        state = self.capture.read(self.game)
+        self.history[self.tick] = state
+        self.ticks_sent.append(self.tick)
+        while len(self.ticks_sent) > HISTORY:
+            del self.history[self.ticks_sent.popleft()]
+
+        # Clients with the same baseline share one encoding
+        encoded = {}
+        for slot in self.slots:
+            if slot is None:
+                continue
+            baseline_tick = slot.acked_tick if slot.acked_tick in self.history else None
+            payload = encoded.get(baseline_tick)
+            if payload is None:
+                payload = encoded[baseline_tick] = encode_snapshot(state, self.history.get(baseline_tick))
+            header = SNAPSHOT_FORMAT.pack(self.epoch, self.tick,
+                                          NO_BASELINE if baseline_tick is None else baseline_tick,
+                                          slot.applied)
+            self.socket.send(SNAPSHOT, header + payload, slot.address)
+            slot.snapshots += 1
+            slot.full_snapshots += baseline_tick is None
+            slot.snapshot_bytes += HEADER.size + len(header) + len(payload) + UDP_OVERHEAD
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def report(self):
+        lines = [f"Tick {self.tick}, epoch {self.epoch}"]
+        for slot in self.slots:
+            if slot is None:
+                continue
+            traffic = self.socket.traffic(slot.address)
+            average = slot.snapshot_bytes / slot.snapshots if slot.snapshots else 0
+            lines.append(f"  P{slot.player + 1}: down {traffic.send_rate / 1000:.1f} kB/s, "
+                         f"up {traffic.receive_rate / 1000:.1f} kB/s, snapshot {average:.0f} B "
+                         f"({slot.full_snapshots} full), input loss {traffic.loss():.1%}, "
+                         f"queued {slot.newest - slot.applied}, waits {slot.waits}, skipped {slot.skipped}")
+        return "\n".join(lines)
+
+    def run(self, duration=None, stop=None, report_interval=5.0):
+        tick_seconds = 1 / self.tick_rate
+        now = time.perf_counter()
+        end = now + duration if duration else None
+        next_tick = now
+        next_report = now + report_interval
+        try:
+            while not (stop is not None and stop.is_set()) and (end is None or now < end):
+                for packet in self.socket.receive():
+                    self.handle(*packet)
+                now = time.perf_counter()
+                if self.game is None:
+                    next_tick = now + tick_seconds
+                else:
+                    steps = 0
+                    while now >= next_tick and steps < MAX_TICKS_PER_FRAME:
+                        self.step()
+                        next_tick += tick_seconds
+                        steps += 1
+                    if now >= next_tick:
+                        next_tick = now  # Too far behind, drop the time
+                self.socket.flush()
+                if self.verbose and self.game is not None and now >= next_report:
+                    print(self.report())
+                    next_report = now + report_interval
+                self.socket.wait(next_tick)
+                now = time.perf_counter()
+        finally:
+            for slot in self.slots:
+                if slot is not None:
+                    self.socket.transmit(HEADER.pack(MAGIC, BYE, 0), slot.address)
+            self.socket.close()
+
+class NetClient:
+    # One player's connection. Every tick sends the controls, predicts the
+    # player's own plane from them and keeps the snapshots received so the
+    # rest of the game can be drawn interpolated interp_delay milliseconds
+    # behind the newest one.
+    def __init__(self, server, conditions=None, interp_delay=100):
+        host, port = server
+        self.server = (socket.gethostbyname(host), port)
+        self.socket = NetSocket(("0.0.0.0", 0), conditions)
+        self.interp_delay = interp_delay
+        self.player = None
+        self.closed = False
+        self.epoch = None
+        self.snapshots = {}  # Tick -> state of the current game
+        self.latest = None  # Tick of the newest snapshot
+        self.clock_tick = None  # The server tick as seen here, advanced every client tick
+        self.input_sequence = 0
+        self.inputs = deque()  # (sequence, mask, time sent) not confirmed by the server yet
+        self.plane = None  # The predicted plane
+        self.correction = [0.0, 0.0]  # Prediction error still being blended out of the drawn plane
+
+        # Counters
+        self.ack_latency = deque(maxlen=STATS_SAMPLES)  # Input sent to the snapshot that applied it, ms
+        self.screen_latency = deque(maxlen=STATS_SAMPLES)  # Input sampled to the frame showing it, ms
+        self.prediction_errors = deque(maxlen=STATS_SAMPLES)  # Pixels
+        self.snapshot_sizes = deque(maxlen=STATS_SAMPLES)  # Bytes on the wire
+        self.full_snapshots = 0
+        self.undecodable = 0  # Deltas against a baseline this client doesn't have
+        self.starved = 0  # Frames drawn past the newest snapshot
+        self.frames = 0
+
+    def connect(self, timeout=5.0):
+        # Returns whether the server let us in
+        now = time.perf_counter()
+        end = now + timeout
+        next_hello = now
+        while now < end:
+            if now >= next_hello:
+                self.socket.send(HELLO, b"", self.server)
+                next_hello = now + 0.25
+            for kind, payload, address in self.socket.receive():
+                if address != self.server:
+                    continue
+                if kind == WELCOME:
+                    self.welcome(payload)
+                    return True
+                if kind == FULL:
+                    return False
+            self.socket.wait(min(next_hello, end))
+            now = time.perf_counter()
+        return False
+
+    def welcome(self, payload):
+        (self.player, self.players, self.tick_rate, versus, self.swarm,
+         self.interval) = WELCOME_FORMAT.unpack_from(payload)
+        self.versus = bool(versus)
+        self.clock = SimulationClock(self.tick_rate)
+        self.interp_ticks = self.interp_delay / self.clock.tick_ms
+        self.plane = Airplane(self.clock)
+
+    def close(self):
+        if self.player is not None:
+            self.socket.transmit(HEADER.pack(MAGIC, BYE, 0), self.server)
+        self.socket.close()
+
+    def poll(self):
+        for kind, payload, address in self.socket.receive():
+            if address != self.server:
+                continue
+            if kind == SNAPSHOT and len(payload) >= SNAPSHOT_FORMAT.size:
+                self.receive_snapshot(payload)
+            elif kind == BYE:
+                self.closed = True
+
+    def receive_snapshot(self, payload):
+        epoch, tick, baseline_tick, applied = SNAPSHOT_FORMAT.unpack_from(payload)
+        if epoch != self.epoch or self.latest is None:
+            if baseline_tick != NO_BASELINE:
+                return  # A delta within a game we haven't seen the start of
+            self.epoch = epoch
+            self.snapshots.clear()
+            self.latest = None
+        elif tick in self.snapshots or tick <= self.latest - HISTORY * self.interval:
+            return
+        baseline = None
+        if baseline_tick != NO_BASELINE:
+            baseline = self.snapshots.get(baseline_tick)
+            if baseline is None:
+                self.undecodable += 1
+                return
+        try:
+            state = decode_snapshot(payload[SNAPSHOT_FORMAT.size:], baseline)
+        except (zlib.error, struct.error, ValueError, IndexError):
+            # A truncated or corrupt snapshot is dropped like a lost one
+            self.undecodable += 1
+            return
+        self.snapshots[tick] = state
+        self.snapshot_sizes.append(HEADER.size + len(payload) + UDP_OVERHEAD)
+        self.full_snapshots += baseline is None
+        oldest = tick - HISTORY * self.interval
+        for old in [old for old in self.snapshots if old < oldest]:
+            del self.snapshots[old]
+
+        if self.latest is None or tick > self.latest:
+            self.latest = tick
+            if self.clock_tick is None or tick > self.clock_tick:
+                self.clock_tick = float(tick)
+            now = time.perf_counter()
+            while self.inputs and self.inputs[0][0] <= applied:
+                sequence, _, sent = self.inputs.popleft()
+                if sequence == applied:
+                    self.ack_latency.append((now - sent) * 1000)
+            self.reconcile(state)
+
+    def own_row(self, state):
+        planes = state["planes"]
+        rows = planes[planes["id"] == self.player]
+        return rows[0] if len(rows) else None
+
+    def playing(self):
+        # Whether the server is moving our plane, so it's worth predicting
+        if self.latest is None:
+            return False
+        state = self.snapshots[self.latest]
+        row = self.own_row(state)
+        return state["game"]["flags"][0] == 0 and row is not None and not row["flags"] & PLANE_DOWN
+
+    def game_ended(self):
+        return self.latest is not None and bool(self.snapshots[self.latest]["game"]["flags"][0] &
+                                                (GAME_OVER | GAME_VICTORY))
+
+    def reconcile(self, state):
+        # Reset the predicted plane to the server's and replay the inputs the
+        # server hasn't applied yet
+        row = self.own_row(state)
+        if row is None:
+            return
+        plane = self.plane
+        before_x, before_y = plane.x, plane.y
+        angle = int(row["angle"]) / 100
+        plane.x = int(row["x"]) / POSITION_SCALE
+        plane.y = int(row["y"]) / POSITION_SCALE
+        plane.angle = angle + 360 * round((plane.angle - angle) / 360)  # Keep the angle continuous
+        plane.speed = int(row["speed"]) / 1000
+        plane.max_speed = int(row["max_speed"])
+        plane.health = int(row["health"])
+        plane.fuel = int(row["fuel"]) / 500
+        plane.invincible = bool(row["flags"] & PLANE_INVINCIBLE)
+        plane.down = bool(row["flags"] & PLANE_DOWN)
+        plane.score = int(row["score"])
+        if self.playing():
+            for _, mask, _ in self.inputs:
+                self.predict(mask)
+
+        # Blend the error out over the next ticks instead of jumping. What is
+        # left of earlier corrections carries over, so the drawn plane stays put.
+        dx = wrapped(before_x - plane.x, SCREEN_WIDTH)
+        dy = wrapped(before_y - plane.y, SCREEN_HEIGHT)
+        self.prediction_errors.append(math.hypot(dx, dy))
+        dx += self.correction[0]
+        dy += self.correction[1]
+        if math.hypot(dx, dy) > SNAP_DISTANCE:
+            dx = dy = 0.0
+        self.correction = [dx, dy]
+        plane.prev_x += plane.x - before_x
+        plane.prev_y += plane.y - before_y
+
+    def predict(self, mask):
+        # The plane's own movement, as Airplane.fly() does it on the server
+        controls = InputState.from_mask(mask & ~RESTART)
+        self.plane.turn(controls)
+        self.plane.move()
+        self.plane.burn_fuel()
+
+    def tick(self, mask):
+        # One client tick: send this tick's controls and predict with them
+        if self.latest is None:
+            return
+        self.input_sequence += 1
+        self.inputs.append((self.input_sequence, mask, time.perf_counter()))
+        while len(self.inputs) > HISTORY * 4:
+            self.inputs.popleft()  # The server isn't answering; don't grow forever
+        plane = self.plane
+        plane.prev_x, plane.prev_y, plane.prev_angle = plane.x, plane.y, plane.angle
+        if self.playing():
+            self.predict(mask)
+        self.correction = [self.correction[0] * SMOOTHING, self.correction[1] * SMOOTHING]
+
+        recent = list(self.inputs)[-MAX_INPUTS_PER_PACKET:]
+        payload = INPUT_FORMAT.pack(self.epoch, self.latest, self.input_sequence, len(recent))
+        self.socket.send(INPUT, payload + bytes(mask for _, mask, _ in recent), self.server)
+
+        # Follow the server's tick, never running too far past the newest snapshot
+        self.clock_tick = min(self.clock_tick + 1, self.latest + 2 * self.interval)
+
+    def frame(self, alpha=0.0):
+        # The two snapshots around the tick drawn now and the fraction between them
+        render_tick = self.clock_tick + alpha - self.interp_ticks
+        self.frames += 1
+        older = newer = None
+        for tick in self.snapshots:
+            if tick <= render_tick:
+                if older is None or tick > older:
+                    older = tick
+            elif newer is None or tick < newer:
+                newer = tick
+        if newer is None:
+            self.starved += 1
+            return self.snapshots[older], self.snapshots[older], 0.0
+        if older is None:
+            return self.snapshots[newer], self.snapshots[newer], 0.0
+        return self.snapshots[older], self.snapshots[newer], (render_tick - older) / (newer - older)
+
+    def stats(self):
+        traffic = self.socket.traffic(self.server)
+        mean = lambda values: sum(values) / len(values) if values else 0.0
+        return {
+            "down": traffic.receive_rate,
+            "up": traffic.send_rate,
+            "received": traffic.received_bytes,
+            "sent": traffic.sent_bytes,
+            "loss": traffic.loss(),
+            "snapshot": mean(self.snapshot_sizes),
+            "full_snapshots": self.full_snapshots,
+            "ack_ms": mean(self.ack_latency),
+            "ack_p95_ms": float(np.percentile(self.ack_latency, 95)) if self.ack_latency else 0.0,
+            "screen_ms": mean(self.screen_latency),
+            "error": mean(self.prediction_errors),
+            "starved": self.starved / self.frames if self.frames else 0.0,
+            "undecodable": self.undecodable,
+        }
+
+class ClientView:
+    # A Game used only for drawing: every frame it is filled from the
+    # client's interpolated snapshots and predicted plane, then drawn with
+    # the game's own draw(). Its objects are made with __new__ since their
+    # constructors would roll random values the snapshot overwrites anyway.
+    def __init__(self, client, sounds=None):
+        self.client = client
+        game = self.game = Game(client.tick_rate, sounds=sounds, high_score=0, swarm=client.swarm,
+                                players=client.players, versus=client.versus)
+        game.airplane = game.airplanes[client.player]
+        game.obstacles = []
+        game.collectibles = []
+        game.squadron.clear()
+        game.projectiles.clear()
+        game.entities_moved = True
+        self.obstacles = {}  # Wire id -> Obstacle
+        self.collectibles = {}
+        self.enemy_trails = {}  # Enemy id -> Trail
+        self.mountains_key = None
+        self.epoch = None
+        self.health = None
+        self.rng = random.Random()  # Engine particles are cosmetic
+
+    def tick(self):
+        # Per tick effects the server doesn't send: clouds, trails and engine particles
+        game = self.game
+        dt = game.clock.dt
+        for cloud in game.clouds:
+            cloud.update(dt)
+        for plane in game.airplanes:
+            plane.particles.update(dt)
+            if plane.down:
+                continue
+            plane.trail.add(plane.x, plane.y)
+            if plane.speed > 5 and self.rng.random() < 0.3 * dt:
+                angle_rad = math.radians(plane.angle)
+                plane.particles.emit(plane.x - (plane.size * 0.5) * math.cos(angle_rad),
+                                     plane.y + (plane.size * 0.5) * math.sin(angle_rad), (200, 100, 0),
+                                     count=2, color_spread=(55, 155, 0), jitter=2)
+        squadron = game.squadron
+        for trail, x, y in zip(squadron.trails, squadron.x.tolist(), squadron.y.tolist()):
+            trail.add(x, y)
+
+    def update(self, alpha):
+        client = self.client
+        game = self.game
+        if client.epoch != self.epoch:
+            self.epoch = client.epoch
+            self.enemy_trails.clear()
+            for plane in game.airplanes:
+                plane.trail.clear()
+        older, newer, fraction = client.frame(alpha)
+
+        row = older["game"][0]
+        next_row = newer["game"][0]
+        game.score = int(row["score"])
+        game.high_score = int(row["high_score"])
+        game.current_wave = int(row["wave"])
+        game.wave_transition = bool(row["flags"] & GAME_TRANSITION)
+        game.game_over = bool(row["flags"] & GAME_OVER)
+        game.victory = bool(row["flags"] & GAME_VICTORY)
+        game.wave_start_time = int(row["wave_start"]) * game.clock.tick_ms
+        clock = int(row["clock"]) + (int(next_row["clock"]) - int(row["clock"])) * fraction
+        game.clock.ticks = clock
+
+        self.update_planes(older, newer, fraction)
+        self.update_mountains(older["mountains"])
+        self.update_collectibles(older["collectibles"])
+        self.update_obstacles(older["obstacles"], clock)
+        self.update_bullets(older["bullets"], clock)
+        self.update_enemies(older["enemies"], newer["enemies"], fraction)
+
+    def update_planes(self, older, newer, fraction):
+        client = self.client
+        planes = self.game.airplanes
+        newer_rows = {int(row["id"]): row for row in newer["planes"]}
+        for row in older["planes"]:
+            plane = planes[int(row["id"])]
+            next_row = newer_rows.get(int(row["id"]), row)
+            plane.x = plane.prev_x = interpolate(int(row["x"]), int(next_row["x"]), fraction,
+                                                 SCREEN_WIDTH * POSITION_SCALE) / POSITION_SCALE
+            plane.y = plane.prev_y = interpolate(int(row["y"]), int(next_row["y"]), fraction,
+                                                 SCREEN_HEIGHT * POSITION_SCALE) / POSITION_SCALE
+            plane.angle = plane.prev_angle = interpolate(int(row["angle"]), int(next_row["angle"]), fraction,
+                                                         36000) / 100
+            plane.speed = int(row["speed"]) / 1000
+            plane.max_speed = int(row["max_speed"])
+            plane.health = int(row["health"])
+            plane.fuel = int(row["fuel"]) / 500
+            plane.invincible = bool(row["flags"] & PLANE_INVINCIBLE)
+            plane.down = bool(row["flags"] & PLANE_DOWN)
+            plane.score = int(row["score"])
+
+        # Our own plane is drawn where we predict it, with the newest server
+        # values for what we don't predict
+        own = planes[client.player]
+        predicted = client.plane
+        dx, dy = client.correction
+        own.prev_x, own.x = predicted.prev_x + dx, predicted.x + dx
+        own.prev_y, own.y = predicted.prev_y + dy, predicted.y + dy
+        own.prev_angle, own.angle = predicted.prev_angle, predicted.angle
+        for name in ("speed", "max_speed", "health", "fuel", "invincible", "down", "score"):
+            setattr(own, name, getattr(predicted, name))
+        if self.health is not None and own.health < self.health:
+            self.game.sounds.play("hit")
+        self.health = own.health
+
+    def update_mountains(self, rows):
+        key = rows.tobytes()
+        if key == self.mountains_key:
+            return
+        self.mountains_key = key
+        mountains = []
+        for row in rows:
+            mountain = Mountain.__new__(Mountain)
+            mountain.x = int(row["x"])
+            mountain.base_width = int(row["base_width"])
+            mountain.height = float(row["height"])
+            mountain.color = (int(row["r"]), int(row["g"]), int(row["b"]))
+            mountains.append(mountain)
+        self.game.mountains = mountains
+
+    def update_collectibles(self, rows):
+        collectibles = {}
+        for wire, x, y, kind in zip(rows["id"].tolist(), rows["x"].tolist(), rows["y"].tolist(),
+                                    rows["type"].tolist()):
+            collectible = self.collectibles.get(wire)
+            if collectible is None:
+                collectible = Collectible.__new__(Collectible)
+                collectible.size = 15
+                collectible.angle = 0
+            collectible.x, collectible.y, collectible.type = x, y, COLLECTIBLE_TYPES[kind]
+            collectibles[wire] = collectible
+        self.collectibles = collectibles
+        self.game.collectibles = list(collectibles.values())
+
+    def update_obstacles(self, rows, clock):
+        # Dead reckoned from their origins to the game clock drawn
+        elapsed = (clock - rows["tick"].astype(np.float64)) * self.game.clock.dt
+        xs = rows["x"] - rows["speed"] * elapsed
+        angles = rows["angle"] + rows["rotation"] * elapsed
+        obstacles = {}
+        for wire, x, y, angle, size in zip(rows["id"].tolist(), xs.tolist(), rows["y"].tolist(),
+                                           angles.tolist(), rows["size"].tolist()):
+            obstacle = self.obstacles.get(wire)
+            if obstacle is None:
+                obstacle = Obstacle.__new__(Obstacle)
+            obstacle.x = obstacle.prev_x = x
+            obstacle.y = obstacle.prev_y = y
+            obstacle.angle = obstacle.prev_angle = angle
+            obstacle.size = size
+            obstacles[wire] = obstacle
+        self.obstacles = obstacles
+        self.game.obstacles = list(obstacles.values())
+
+    def update_bullets(self, rows, clock):
+        elapsed = (clock - rows["tick"].astype(np.float64)) * self.game.clock.dt
+        xs = rows["x"] + rows["vx"] * elapsed
+        ys = rows["y"] + rows["vy"] * elapsed
+        visible = (xs >= 0) & (xs <= SCREEN_WIDTH) & (ys >= 0) & (ys <= SCREEN_HEIGHT)
+        projectiles = self.game.projectiles
+        count = min(int(visible.sum()), projectiles.capacity)
+        projectiles.active[:] = False
+        projectiles.active[:count] = True
+        projectiles.x[:count] = projectiles.prev_x[:count] = xs[visible][:count]
+        projectiles.y[:count] = projectiles.prev_y[:count] = ys[visible][:count]
+        projectiles.size[:count] = 3
+        projectiles.faction[:count] = rows["faction"][visible][:count]
+
+    def update_enemies(self, rows, next_rows, fraction):
+        game = self.game
+        squadron = game.squadron
+        ids = rows["id"]
+        x = rows["x"].astype(np.float64)
+        y = rows["y"].astype(np.float64)
+        angle = rows["angle"].astype(np.float64)
+        next_x, next_y, next_angle = x.copy(), y.copy(), angle.copy()
+        if len(next_rows) and len(ids):
+            index = np.minimum(np.searchsorted(next_rows["id"], ids), len(next_rows) - 1)
+            matched = next_rows["id"][index] == ids
+            next_x[matched] = next_rows["x"][index[matched]]
+            next_y[matched] = next_rows["y"][index[matched]]
+            next_angle[matched] = next_rows["angle"][index[matched]]
+        squadron.ids = ids.astype(np.int64)
+        squadron.x = squadron.prev_x = interpolate_array(x, next_x, fraction,
+                                                         SCREEN_WIDTH * POSITION_SCALE) / POSITION_SCALE
+        squadron.y = squadron.prev_y = interpolate_array(y, next_y, fraction,
+                                                         SCREEN_HEIGHT * POSITION_SCALE) / POSITION_SCALE
+        squadron.angle = squadron.prev_angle = interpolate_array(angle, next_angle, fraction, 256) * (360 / 256)
+        squadron.health = rows["health"].astype(np.float64)
+        config = squadron.config = game.wave_squadrons.get(game.current_wave, SQUADRONS["classic"])
+        if config["trail"]:
+            length = max(1, round(config["trail"] / game.clock.dt))
+            color = tuple(min(255, c + 50) for c in ENEMY_COLOR)
+            trails = {}
+            for enemy in squadron.ids.tolist():
+                # A trail that is still empty has a length of 0, so test for None
+                trail = self.enemy_trails.get(enemy)
+                if trail is None:
+                    trail = Trail(color, length=length)
+                trails[enemy] = trail
+            self.enemy_trails = trails
+            squadron.trails = list(self.enemy_trails.values())
+        else:
+            squadron.trails = []
+
+def bot_mask(tick, player):
+    # Scripted controls for test clients: weave, keep the speed up and fire
+    phase = (tick // 90 + player) % 4
+    return InputState(left=phase == 0, right=phase == 2, up=tick % 240 < 160, shoot=tick % 20 < 10).to_mask()
+
+def run_headless(client, duration=None, stop=None):
+    # Plays a bot through the client in real time, restarting finished games
+    tick_seconds = 1 / client.tick_rate
+    now = time.perf_counter()
+    end = now + duration if duration else None
+    next_tick = now
+    tick = 0
+    while not client.closed and not (stop is not None and stop.is_set()) and (end is None or now < end):
+        client.poll()
+        if now >= next_tick:
+            client.tick(bot_mask(tick, client.player) | (RESTART if client.game_ended() else 0))
+            tick += 1
+            next_tick += tick_seconds
+            if now >= next_tick:
+                next_tick = now
+        client.socket.wait(next_tick)
+        now = time.perf_counter()
+
+def draw_stats(surface, client):
+    stats = client.stats()
+    lines = [
+        f"Input to screen {stats['screen_ms']:.0f} ms, to server and back {stats['ack_ms']:.0f} ms",
+        f"Down {stats['down'] / 1000:.1f} kB/s, up {stats['up'] / 1000:.1f} kB/s, "
+        f"loss {stats['loss']:.1%}, snapshot {stats['snapshot']:.0f} B",
+        f"Prediction error {stats['error']:.1f} px, interpolation starved {stats['starved']:.0%}",
+    ]
+    for index, line in enumerate(lines):
+        surface.blit(text_cache.render(line, WHITE, 20), (10, SCREEN_HEIGHT - 70 + index * 20))
+
+def run_window(client, max_fps=120):
+    # The interactive client: same controls as the single player game, F3
+    # toggles the network counters
+    screen = init_display()
+    pygame.display.set_caption(f"Wave-Based Flight Combat Game - Player {client.player + 1}")
+    sounds = SoundBank(assets)
+    assets.load_async(lambda: sounds.play("engine", -1))
+    view = ClientView(client, sounds)
+    clock = pygame.time.Clock()
+    tick_seconds = 1 / client.tick_rate
+    accumulator = 0.0
+    previous = time.perf_counter()
+    sampled = []  # When the inputs of the ticks not drawn yet were read
+    restart = False
+    show_stats = True
+    running = True
+    while running and not client.closed:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_SPACE and client.game_ended():
+                    restart = True
+                elif event.key == pygame.K_F3:
+                    show_stats = not show_stats
+
+        client.poll()
+        now = time.perf_counter()
+        accumulator += now - previous
+        previous = now
+        steps = 0
+        while accumulator >= tick_seconds and steps < MAX_TICKS_PER_FRAME:
+            mask = InputState.from_keys(pygame.key.get_pressed()).to_mask()
+            if restart:
+                mask |= RESTART
+                restart = client.game_ended()
+            sampled.append(time.perf_counter())
+            client.tick(mask)
+            view.tick()
+            accumulator -= tick_seconds
+            steps += 1
+        if steps == MAX_TICKS_PER_FRAME:
+            accumulator = 0.0
+        alpha = accumulator / tick_seconds
+
+        if client.latest is None:
+            screen.fill(BLACK)
+            text = text_cache.render(f"Player {client.player + 1}: waiting for the other players...", WHITE, 36)
+            screen.blit(text, text.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)))
+            sampled.clear()
+        else:
+            view.update(alpha)
+            view.game.draw(screen, alpha)
+        if show_stats:
+            draw_stats(screen, client)
+        pygame.display.flip()
+        shown = time.perf_counter()
+        client.screen_latency.extend((shown - sample) * 1000 for sample in sampled)
+        sampled.clear()
+        clock.tick(max_fps)
+    client.close()
+    pygame.quit()
+
+def parse_address(text):
+    host, _, port = text.partition(":")
+    return host or "127.0.0.1", int(port) if port else DEFAULT_PORT
+
+def conditions_from(options):
+    return NetworkConditions(options.latency, options.jitter, options.loss)
+
+def serve(options):
+    server = NetServer(options.host, options.port, options.players, options.versus, options.swarm,
+                       options.seed, options.tick_rate, options.snapshot_rate, conditions_from(options))
+    print(f"Serving {options.players} players on {options.host}:{server.socket.address()[1]}")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+
+def connect_client(options, address):
+    try:
+        client = NetClient(address, conditions_from(options), options.interp_delay)
+    except OSError as error:
+        print(f"Could not reach {address[0]}: {error}")
+        return None
+    if not client.connect():
+        print(f"Could not join the server at {address[0]}:{address[1]}")
+        client.close()
+        return None
+    return client
+
+def run_local(options):
+    # Server in its own process, this window as player 1 and optionally a
+    # bot as player 2, all over loopback
+    options.host = "127.0.0.1"
+    server = multiprocessing.Process(target=serve, args=(options,), daemon=True)
+    server.start()
+    client = connect_client(options, (options.host, options.port))
+    if client is None:
+        server.terminate()
+        return 1
+    stop = threading.Event()
+    bots = []
+    if options.bot:
+        for _ in range(options.players - 1):
+            bot = connect_client(options, (options.host, options.port))
+            if bot is not None:
+                thread = threading.Thread(target=run_headless, args=(bot, None, stop), daemon=True)
+                thread.start()
+                bots.append((bot, thread))
+    try:
+        run_window(client)
+    finally:
+        stop.set()
+        for bot, thread in bots:
+            thread.join()
+            bot.close()
+        server.terminate()
+        server.join()
+    return 0
+
+def run_test(options):
+    # Headless loopback run: a server and bot clients in threads, then the
+    # bandwidth and latency of every client
+    conditions = conditions_from(options)
+    server = NetServer("127.0.0.1", 0, options.players, options.versus, options.swarm, options.seed,
+                       options.tick_rate, options.snapshot_rate, conditions_from(options), verbose=False)
+    address = ("127.0.0.1", server.socket.address()[1])
+    stop = threading.Event()
+    server_thread = threading.Thread(target=server.run, kwargs={"stop": stop})
+    server_thread.start()
+    clients = []
+    threads = []
+    try:
+        for _ in range(options.players):
+            client = connect_client(options, address)
+            if client is None:
+                return 1
+            clients.append(client)
+        for client in clients:
+            thread = threading.Thread(target=run_headless, args=(client, options.seconds))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        stop.set()
+        server_thread.join()
+
+        print(f"{options.players} players for {options.seconds:g} s at {options.tick_rate} Hz, "
+              f"{options.tick_rate / server.interval:g} snapshots/s, {conditions.describe()}")
+        print(f"{'player':<8}{'down kB/s':>10}{'up kB/s':>9}{'snapshot B':>11}{'full':>6}{'loss':>7}"
+              f"{'ack ms':>8}{'ack p95':>9}{'pred px':>9}{'starved':>9}")
+        for client in clients:
+            stats = client.stats()
+            slot = server.slots[client.player]
+            # Averages over the whole run, rates only cover the last second
+            down = stats["received"] / options.seconds / 1000
+            up = stats["sent"] / options.seconds / 1000
+            print(f"{'P' + str(client.player + 1):<8}{down:>10.2f}{up:>9.2f}{stats['snapshot']:>11.0f}"
+                  f"{stats['full_snapshots']:>6}{stats['loss']:>7.1%}{stats['ack_ms']:>8.1f}"
+                  f"{stats['ack_p95_ms']:>9.1f}{stats['error']:>9.2f}{stats['starved']:>9.1%}")
+            if slot is not None:
+                print(f"{'':<8}server: {slot.waits} input waits, {slot.skipped} inputs skipped, "
+                      f"{slot.newest - slot.applied} queued")
+        print(f"Remote planes are drawn about {options.interp_delay} ms behind the newest snapshot; "
+              f"run 'local' for the measured input to screen latency")
+        return 0
+    finally:
+        # Also reached when a client fails to connect
+        stop.set()
+        server_thread.join()
+        for client in clients:
+            client.close()
+
+def parse_args(argv=None):
+    network = argparse.ArgumentParser(add_help=False)
+    network.add_argument("--latency", type=float, default=0.0,
+                         help="simulated one way latency in milliseconds (default: %(default)s)")
+    network.add_argument("--jitter", type=float, default=0.0,
+                         help="extra random latency up to this many milliseconds (default: %(default)s)")
+    network.add_argument("--loss", type=float, default=0.0,
+                         help="simulated packet loss, 0 to 1 (default: %(default)s)")
+    game = argparse.ArgumentParser(add_help=False)
+    game.add_argument("--port", type=int, default=DEFAULT_PORT, help="UDP port (default: %(default)s)")
+    game.add_argument("--players", type=int, default=2, choices=(1, 2, 3, 4),
+                      help="players the game waits for (default: %(default)s)")
+    game.add_argument("--versus", action="store_true", help="players' bullets hit each other")
+    game.add_argument("--swarm", type=int, default=0, help="swarm planes in the final wave")
+    game.add_argument("--seed", type=int, default=None, help="seed for the games played")
+    game.add_argument("--tick-rate", type=int, default=TICK_RATE,
+                      help="simulation ticks per second (default: %(default)s)")
+    game.add_argument("--snapshot-rate", type=int, default=30,
+                      help="snapshots sent per second (default: %(default)s)")
+    view = argparse.ArgumentParser(add_help=False)
+    view.add_argument("--interp-delay", type=float, default=100,
+                      help="milliseconds remote objects are drawn in the past (default: %(default)s)")
+
+    parser = argparse.ArgumentParser(description="Networked co-op and versus games of flight_game")
+    commands = parser.add_subparsers(dest="command", required=True)
+    server = commands.add_parser("server", parents=[game, network], help="host a game")
+    server.add_argument("--host", default="0.0.0.0", help="address to listen on (default: %(default)s)")
+    client = commands.add_parser("client", parents=[network, view], help="join a game")
+    client.add_argument("address", type=parse_address, help="server as HOST[:PORT]")
+    local = commands.add_parser("local", parents=[game, network, view],
+                                help="server and window on this machine over loopback")
+    local.add_argument("--bot", action="store_true", help="fill the other player slots with bots")
+    test = commands.add_parser("test", parents=[game, network, view],
+                               help="headless loopback run with bots, prints bandwidth and latency")
+    test.add_argument("--seconds", type=float, default=10.0, help="length of the run (default: %(default)s)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.command == "server":
+        serve(options)
+        return 0
+    if options.command == "client":
+        client = connect_client(options, options.address)
+        if client is None:
+            return 1
+        run_window(client)
+        return 0
+    if options.command == "local":
+        return run_local(options)
+    return run_test(options)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import sqlite3
+
+from flight_game import Leaderboard
+
+def open_leaderboard(tmp_path):
+    leaderboard = Leaderboard(str(tmp_path / "leaderboard.db"), str(tmp_path / "highscore.txt")).open()
+    leaderboard.loaded.wait(10)
+    return leaderboard
+
+def test_top_is_ordered_by_score_with_earlier_runs_first(tmp_path):
+    leaderboard = open_leaderboard(tmp_path)
+    for score in (300, 900, 100, 900, 500):
+        leaderboard.record(score, 3, 60.0, seed=score)
+    top = leaderboard.top(4)
+    assert [run[0] for run in top] == [900, 900, 500, 300]
+    assert top[0][4] <= top[1][4]
+    assert leaderboard.high_score() == 900
+    leaderboard.close()
+
+def test_no_runs_are_lost_when_closing_right_after_recording(tmp_path):
+    leaderboard = open_leaderboard(tmp_path)
+    for score in range(500):
+        leaderboard.record(score, 1 + score % 5, score / 10, victory=score % 7 == 0)
+    leaderboard.close()
+    assert leaderboard.runs_written == 500
+
+    connection = sqlite3.connect(str(tmp_path / "leaderboard.db"))
+    assert connection.execute("SELECT COUNT(*), MAX(score) FROM runs").fetchone() == (500, 499)
+    connection.close()
+
+    # A new session sees them, beyond the cached best runs too
+    reopened = open_leaderboard(tmp_path)
+    assert reopened.high_score() == 499
+    top = reopened.top(Leaderboard.CACHE_SIZE + 50)
+    assert [run[0] for run in top] == list(range(499, 499 - Leaderboard.CACHE_SIZE - 50, -1))
+    reopened.close()
+
+def test_legacy_high_score_is_imported_once(tmp_path):
+    (tmp_path / "highscore.txt").write_text("4200")
+    leaderboard = open_leaderboard(tmp_path)
+    assert leaderboard.high_score() == 4200
+    leaderboard.close()
+    (tmp_path / "highscore.txt").write_text("9999")
+    reopened = open_leaderboard(tmp_path)
+    assert reopened.high_score() == 4200
+    reopened.close()
@@ -0,0 +1,236 @@
+import math
+import socket
+import threading
+from collections import deque
+
+import numpy as np
+import pytest
+
+from flight_game import Game, InputState, TICK_RATE
+from netplay import (COUNTS, EMPTY_STATE, INPUT_BACKLOG, NO_BASELINE, QUEUE_WINDOW, RESTART, SNAPSHOT_FORMAT,
+                     TABLES, WELCOME_FORMAT, ClientSlot, NetClient, NetServer, NetworkConditions, StateCapture,
+                     bot_mask, decode_snapshot, decode_table, encode_snapshot, encode_table, run_headless)
+
+DTYPES = dict(TABLES)
+
+def assert_same_state(actual, expected):
+    for name, dtype in TABLES:
+        assert actual[name].dtype == dtype
+        assert actual[name].tobytes() == expected[name].tobytes(), name
+
+def round_trip(state, baseline=None):
+    return decode_snapshot(encode_snapshot(state, baseline), baseline)
+
+def table(name, rows):
+    return np.array(rows, dtype=DTYPES[name])
+
+def table_counts(current, baseline):
+    # (removed, new, changed) rows of the delta
+    out = []
+    encode_table(current, baseline, out)
+    return COUNTS.unpack(out[0])
+
+@pytest.fixture
+def game():
+    return Game(seed=11, announce=False)
+
+@pytest.fixture
+def sink():
+    # Somewhere for a client's input packets to go
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    yield sink.getsockname()
+    sink.close()
+
+def test_snapshots_round_trip_in_full_and_as_deltas(game):
+    capture = StateCapture()
+    baseline = capture.read(game)
+    assert_same_state(round_trip(baseline), baseline)
+    for _ in range(90):
+        game.update(InputState(up=True, shoot=True, left=True))
+    state = capture.read(game)
+    assert_same_state(round_trip(state, baseline), state)
+    # Nothing changed, nothing but the counts is sent
+    assert len(encode_snapshot(state, state)) < len(encode_snapshot(state, baseline))
+    assert_same_state(round_trip(state, state), state)
+
+def test_deltas_wrap_around_the_integer_range():
+    baseline = dict(EMPTY_STATE, planes=table("planes", [(0, 32767, -32768, 35999, 0, 5, 100, 50000, 0, 0),
+                                                         (1, -5, 6399, 0, 9000, 5, -3, 0, 3, 2 ** 31 - 1)]))
+    state = dict(EMPTY_STATE, planes=table("planes", [(0, -32768, 32767, 0, 65535, 5, -100, 0, 1, -7),
+                                                      (1, 6399, -5, 35999, 0, 5, 100, 50000, 0, -2 ** 31)]))
+    assert table_counts(state["planes"], baseline["planes"]) == (0, 0, 2)
+    assert_same_state(round_trip(state, baseline), state)
+
+def test_a_new_serial_is_a_despawn_and_a_spawn():
+    baseline = table("collectibles", [(3, 100, 100, 0), (5, 200, 300, 1), (9, 50, 60, 2)])
+    # The object that was serial 5 came back from the pool as serial 12, in the same place
+    current = table("collectibles", [(3, 100, 100, 0), (9, 51, 60, 2), (12, 200, 300, 1)])
+    assert table_counts(current, baseline) == (1, 1, 1)
+    out = []
+    encode_table(current, baseline, out)
+    decoded, offset = decode_table(b"".join(out), 0, DTYPES["collectibles"], baseline)
+    assert offset == len(b"".join(out))
+    assert decoded.tobytes() == current.tobytes()
+
+def test_pooled_objects_get_new_rows_when_reused(game):
+    capture = StateCapture()
+    baseline = capture.read(game)
+    old = game.collectibles.pop(0)
+    game.collectible_pool.release(old)
+    new = game.collectible_pool.acquire(old.type)
+    assert new is old
+    game.collectibles.append(new)
+    state = capture.read(game)
+    assert table_counts(state["collectibles"], baseline["collectibles"])[:2] == (1, 1)
+    assert_same_state(round_trip(state, baseline), state)
+
+def test_dead_reckoning_origins_predict_obstacles_and_bullets(game):
+    capture = StateCapture()
+    first = capture.read(game)
+    for _ in range(30):
+        game.update(InputState(shoot=True))
+    state = capture.read(game)
+    clock, dt = game.clock.ticks, game.clock.dt
+
+    # Every row predicts where its object is now
+    rows = {int(row["id"]): row for row in state["obstacles"]}
+    for obstacle in game.obstacles:
+        row = rows[obstacle.serial]
+        elapsed = (clock - int(row["tick"])) * dt
+        assert abs(float(row["x"]) - float(row["speed"]) * elapsed - obstacle.x) <= 0.5
+        assert float(row["y"]) == pytest.approx(obstacle.y)
+    projectiles = game.projectiles
+    for row in state["bullets"]:
+        slot = int(row["id"])
+        elapsed = (clock - int(row["tick"])) * dt
+        assert float(row["x"]) + float(row["vx"]) * elapsed == pytest.approx(projectiles.x[slot], abs=0.5)
+        assert float(row["y"]) + float(row["vy"]) * elapsed == pytest.approx(projectiles.y[slot], abs=0.5)
+
+    # Obstacles flying straight (not wrapped around) keep their origin, so
+    # their rows don't change
+    first_rows = {int(row["id"]): row for row in first["obstacles"]}
+    straight = [o for o in game.obstacles if o.serial in first_rows and o.x < float(first_rows[o.serial]["x"])]
+    assert straight
+    assert all(rows[o.serial].tobytes() == first_rows[o.serial].tobytes() for o in straight)
+
+    # An obstacle pushed off its course gets a new origin
+    game.obstacles[0].y += 10
+    moved = capture.read(game)
+    row = moved["obstacles"][moved["obstacles"]["id"] == game.obstacles[0].serial][0]
+    assert row["tick"] == clock
+    assert float(row["y"]) == pytest.approx(game.obstacles[0].y)
+
+def queue_inputs(slot, first, masks):
+    for sequence, mask in enumerate(masks, first):
+        if sequence > slot.applied:
+            slot.inputs[sequence] = mask
+    slot.newest = max(slot.newest, first + len(masks) - 1)
+
+def test_inputs_are_applied_in_order_one_per_tick():
+    slot = ClientSlot(0, None)
+    queue_inputs(slot, 1, [1, 2, 3])
+    assert [slot.next_mask() for _ in range(3)] == [1, 2, 3]
+    assert (slot.applied, slot.waits, slot.skipped) == (3, 0, 0)
+
+def test_a_late_input_is_waited_for_then_skipped_once_later_ones_arrive():
+    slot = ClientSlot(0, None)
+    queue_inputs(slot, 1, [4])
+    assert slot.next_mask() == 4
+    # Input 2 is late: the last controls are held
+    assert slot.next_mask() == 4
+    assert (slot.applied, slot.waits) == (1, 1)
+    # Input 2 is lost, 3 and 4 arrive: 2 is skipped rather than waited for
+    queue_inputs(slot, 3, [8, 16])
+    assert slot.next_mask() == 4
+    assert (slot.applied, slot.skipped) == (2, 1)
+    assert [slot.next_mask() for _ in range(2)] == [8, 16]
+
+def test_restart_is_not_repeated_for_a_missing_input():
+    slot = ClientSlot(0, None)
+    queue_inputs(slot, 1, [RESTART | 1])
+    assert slot.next_mask() == RESTART | 1
+    assert slot.next_mask() == 1
+
+def test_a_backlog_is_cut_down():
+    slot = ClientSlot(0, None)
+    queue_inputs(slot, 1, list(range(1, 21)))
+    # The older inputs are skipped, leaving the newest INPUT_BACKLOG queued
+    assert slot.next_mask() == 20 - INPUT_BACKLOG + 1
+    assert slot.skipped == 20 - INPUT_BACKLOG
+    assert slot.newest - slot.applied == INPUT_BACKLOG - 1
+
+def test_a_queue_that_stays_long_loses_an_input():
+    slot = ClientSlot(0, None)
+    queue_inputs(slot, 1, [1, 1, 1])
+    sequence = 3
+    for _ in range(QUEUE_WINDOW):
+        sequence += 1
+        queue_inputs(slot, sequence, [1])
+        slot.next_mask()
+    assert slot.skipped == 1
+    assert slot.newest - slot.applied == 2
+
+def test_reconciliation_converges_after_a_misprediction(game, sink):
+    client = NetClient(sink)
+    client.welcome(WELCOME_FORMAT.pack(0, 1, TICK_RATE, 0, 0, 2))
+    capture = StateCapture()
+    server_tick = applied = 0
+
+    def send_snapshot():
+        payload = encode_snapshot(capture.read(game))
+        client.receive_snapshot(SNAPSHOT_FORMAT.pack(0, server_tick, NO_BASELINE, applied) + payload)
+
+    send_snapshot()
+    in_flight = deque()  # Inputs on their way to the server, 4 ticks of latency
+    corrections = []
+    for tick in range(1, 241):
+        mask = bot_mask(tick, 0)
+        client.tick(mask)
+        in_flight.append(mask)
+        if len(in_flight) > 4:
+            game.update(InputState.from_mask(in_flight.popleft()))
+            applied += 1
+            server_tick += 1
+            if server_tick == 120:
+                game.airplane.y += 40  # Something the client couldn't predict
+            if server_tick % 2 == 0:
+                send_snapshot()
+        corrections.append(math.hypot(*client.correction))
+
+    errors = list(client.prediction_errors)
+    jump = int(np.argmax(errors))
+    assert errors[jump] == pytest.approx(40, abs=1)
+    # Before and after the jump the prediction is only off by rounding
+    assert max(errors[:jump]) < 1
+    assert max(errors[jump + 1:]) < 1
+    # The correction is eased in over several ticks rather than jumping, and
+    # then fully applied
+    start = int(np.argmax(corrections))
+    assert corrections[start] > 30
+    assert corrections[start + 6] > 10
+    assert all(later <= earlier + 0.5 for earlier, later in zip(corrections[start:], corrections[start + 1:]))
+    assert corrections[-1] < 0.5
+    client.socket.close()
+
+def test_lossy_loopback_client_matches_the_server():
+    conditions = dict(latency=5, jitter=5, loss=0.2)
+    server = NetServer("127.0.0.1", 0, players=1, seed=4, verbose=False,
+                       conditions=NetworkConditions(seed=1, **conditions))
+    stop = threading.Event()
+    server_thread = threading.Thread(target=server.run, kwargs={"stop": stop})
+    server_thread.start()
+    client = NetClient(("127.0.0.1", server.socket.address()[1]), NetworkConditions(seed=2, **conditions))
+    try:
+        assert client.connect()
+        run_headless(client, 2.5)
+    finally:
+        stop.set()
+        server_thread.join()
+        client.close()
+
+    assert server.socket.dropped > 0 and client.socket.dropped > 0
+    assert client.undecodable == 0
+    assert client.full_snapshots * 2 < len(client.snapshot_sizes)  # Most snapshots were deltas
+    assert client.latest in server.history
+    assert_same_state(client.snapshots[client.latest], server.history[client.latest])
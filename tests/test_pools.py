@@ -0,0 +1,41 @@
+from flight_game import Collectible, Game, ObjectPool, Obstacle
+
+def test_released_objects_are_reused_with_a_new_serial():
+    pool = ObjectPool(Obstacle)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert (first.serial, second.serial) == (1, 2)
+    pool.release(first)
+    again = pool.acquire()
+    assert again is first
+    assert again.serial == 3  # A reused object must not look like its earlier life
+    assert pool.stats() == {"allocated": 2, "reused": 1, "peak": 2, "live": 2, "free": 0}
+
+def test_reused_objects_are_set_up_again():
+    pool = ObjectPool(Collectible)
+    star = pool.acquire("star")
+    pool.release(star)
+    fuel = pool.acquire("fuel")
+    assert fuel is star
+    assert fuel.type == "fuel"
+
+def test_stats_track_live_objects_and_peak():
+    pool = ObjectPool(Obstacle)
+    obstacles = [pool.acquire() for _ in range(5)]
+    pool.release_all(obstacles[:3])
+    assert pool.stats() == {"allocated": 5, "reused": 0, "peak": 5, "live": 2, "free": 3}
+    serials = {pool.acquire().serial for _ in range(4)}
+    assert serials == {6, 7, 8, 9}
+    assert pool.stats() == {"allocated": 6, "reused": 3, "peak": 6, "live": 6, "free": 0}
+
+def test_game_pool_stats_cover_every_plane():
+    game = Game(seed=3, players=2, announce=False)
+    for plane in game.airplanes:
+        plane.particles.clear()
+        plane.particles.emitted = 0
+        plane.particles.emit(plane.x, plane.y, (200, 100, 0), count=10)
+    stats = game.pool_stats()
+    assert stats["particles"]["live"] == 20
+    assert stats["particles"]["reused"] == 20
+    assert stats["obstacles"]["live"] == len(game.obstacles)
+    assert stats["collectibles"]["live"] == len(game.collectibles)
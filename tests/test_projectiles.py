@@ -0,0 +1,58 @@
+from flight_game import ProjectileManager, SCREEN_WIDTH
+
+PLAYER = ProjectileManager.PLAYER
+ENEMY = ProjectileManager.ENEMY
+
+def test_released_slots_are_reused_before_new_ones():
+    projectiles = ProjectileManager(capacity=8)
+    first = projectiles.spawn(100, 100, 0, 5, PLAYER)
+    second = projectiles.spawn(100, 100, 0, 5, PLAYER)
+    projectiles.release(first)
+    projectiles.release(first)  # Releasing twice must not free the slot twice
+    assert projectiles.spawn(200, 200, 90, 5, ENEMY) == first
+    assert len(projectiles.free) == 8 - 2
+    assert projectiles.stats() == {"allocated": 8, "reused": 3, "peak": 2, "live": 2, "dropped": 0}
+    assert projectiles.slots().tolist() == sorted([first, second])
+
+def test_spawn_drops_bullets_when_full():
+    projectiles = ProjectileManager(capacity=4)
+    slots = [projectiles.spawn(100, 100, 0, 5, PLAYER) for _ in range(4)]
+    assert sorted(slots) == [0, 1, 2, 3]
+    assert projectiles.spawn(100, 100, 0, 5, PLAYER) == -1
+    assert projectiles.stats()["dropped"] == 1
+    projectiles.clear()
+    assert projectiles.count() == 0
+    assert projectiles.spawn(100, 100, 0, 5, PLAYER) != -1
+
+def test_release_owner_only_frees_that_owners_bullets():
+    projectiles = ProjectileManager(capacity=16)
+    red, blue = object(), object()
+    for _ in range(3):
+        projectiles.spawn(100, 100, 0, 5, ENEMY, owner=red)
+        projectiles.spawn(100, 100, 0, 5, ENEMY, owner=blue)
+    projectiles.spawn(100, 100, 0, 5, PLAYER)
+    projectiles.release_owner(red)
+    live = projectiles.slots()
+    assert len(live) == 4
+    assert all(projectiles.owner[slot] is not red for slot in live.tolist())
+    assert projectiles.count(ENEMY) == 3
+    # Freed slots forget their owner
+    assert all(projectiles.owner[slot] is None for slot in projectiles.free)
+
+def test_update_moves_bullets_and_culls_off_screen_ones():
+    projectiles = ProjectileManager(capacity=8)
+    inside = projectiles.spawn(100, 100, 0, 10, PLAYER)
+    leaving = projectiles.spawn(SCREEN_WIDTH - 5, 100, 0, 10, PLAYER)
+    projectiles.update()
+    assert projectiles.x[inside] == 110
+    assert projectiles.prev_x[inside] == 100
+    assert projectiles.slots().tolist() == [inside]
+    assert leaving in projectiles.free
+
+def test_hits_only_matches_the_faction_asked_for():
+    projectiles = ProjectileManager(capacity=8)
+    player = projectiles.spawn(100, 100, 0, 0, PLAYER)
+    enemy = projectiles.spawn(104, 100, 0, 0, ENEMY)
+    projectiles.spawn(300, 300, 0, 0, ENEMY)
+    assert projectiles.hits(100, 100, 5, ENEMY).tolist() == [enemy]
+    assert projectiles.hits(100, 100, 5, PLAYER).tolist() == [player]
@@ -0,0 +1,73 @@
+import random
+import zlib
+
+import pytest
+
+from flight_game import InputRecording, InputState, Replay
+
+def random_recording(ticks, seed=7):
+    rng = random.Random(seed)
+    recording = InputRecording(seed, swarm=0)
+    controls = InputState()
+    for tick in range(ticks):
+        # Hold keys for a while like a player would
+        if tick % 20 == 0:
+            controls = InputState(left=rng.random() < 0.3, right=rng.random() < 0.3,
+                                  up=rng.random() < 0.5, shoot=rng.random() < 0.6)
+        recording.append(controls)
+    return recording
+
+def game_state(game):
+    plane = game.airplane
+    return (game.score, game.current_wave, plane.x, plane.y, plane.angle, plane.health, plane.fuel,
+            [(o.x, o.y) for o in game.obstacles], [(c.x, c.y, c.type) for c in game.collectibles],
+            game.projectiles.x[game.projectiles.slots()].tolist(), game.squadron.x.tolist())
+
+def test_recording_round_trips_through_a_file(tmp_path):
+    recording = random_recording(500)
+    recording.final_score = 1234
+    recording.swarm = 80
+    path = tmp_path / "run.swr"
+    recording.save(path)
+    loaded = InputRecording.load(path)
+    assert (loaded.seed, loaded.tick_rate, loaded.final_score, loaded.swarm) == (7, recording.tick_rate, 1234, 80)
+    assert loaded.masks == recording.masks
+    assert loaded.controls(40).to_mask() == recording.controls(40).to_mask()
+
+def test_version_1_recordings_still_load(tmp_path):
+    masks = bytes(random_recording(100).masks)
+    header = InputRecording.HEADER.pack(InputRecording.MAGIC, 1, 60, 99, len(masks), 500)
+    path = tmp_path / "old.swr"
+    path.write_bytes(header + zlib.compress(masks))
+    loaded = InputRecording.load(path)
+    assert (loaded.seed, loaded.tick_rate, loaded.final_score, loaded.swarm) == (99, 60, 500, 0)
+    assert bytes(loaded.masks) == masks
+
+def test_bad_and_truncated_files_are_rejected(tmp_path):
+    recording = random_recording(100)
+    path = tmp_path / "run.swr"
+    recording.save(path)
+    data = path.read_bytes()
+    path.write_bytes(b"NOPE" + data[4:])
+    with pytest.raises(ValueError):
+        InputRecording.load(path)
+    header = InputRecording.HEADER.pack(InputRecording.MAGIC, 2, 60, 1, 200, -1) + InputRecording.OPTIONS.pack(0)
+    path.write_bytes(header + zlib.compress(bytes(recording.masks)))
+    with pytest.raises(ValueError):
+        InputRecording.load(path)
+
+def test_seek_lands_on_the_same_state_as_playing_straight_through():
+    recording = random_recording(900)
+    straight = Replay(recording, checkpoint_seconds=2, announce=False)
+    straight.seek(700)
+    expected = game_state(straight.game)
+
+    replay = Replay(recording, checkpoint_seconds=2, announce=False)
+    replay.seek(850)
+    replay.seek(130)  # Back to before the first checkpoint
+    replay.seek(700)
+    assert replay.tick == 700
+    assert game_state(replay.game) == expected
+    replay.seek(310)  # Restored from a checkpoint
+    replay.seek(700)
+    assert game_state(replay.game) == expected
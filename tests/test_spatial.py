@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+import pytest
+
+from flight_game import GRID_PAIRS_DENSE_LIMIT, SpatialHash, grid_pairs, SCREEN_WIDTH, SCREEN_HEIGHT
+
+def boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def test_query_returns_every_overlapping_object_once():
+    rng = random.Random(5)
+    grid = SpatialHash(cell_size=64)
+    objects = {}
+    for name in range(300):
+        x, y, radius = rng.uniform(0, SCREEN_WIDTH), rng.uniform(0, SCREEN_HEIGHT), rng.uniform(2, 90)
+        objects[name] = (x - radius, y - radius, x + radius, y + radius)
+        grid.insert(name, x, y, radius)
+    for _ in range(200):
+        x, y, radius = rng.uniform(0, SCREEN_WIDTH), rng.uniform(0, SCREEN_HEIGHT), rng.uniform(1, 40)
+        query = (x - radius, y - radius, x + radius, y + radius)
+        found = grid.query(x, y, radius)
+        assert len(found) == len(set(found))
+        expected = {name for name, box in objects.items() if boxes_overlap(box, query)}
+        assert expected <= set(found)
+
+def test_objects_across_an_edge_are_found_from_the_other_side():
+    grid = SpatialHash(cell_size=64)
+    grid.insert("right", SCREEN_WIDTH - 2, 300, 10)  # Sticks out past the right edge
+    grid.insert("bottom", 400, SCREEN_HEIGHT + 5, 8)  # Drifted below the screen
+    assert "right" in grid.query(3, 300, 5)
+    assert "bottom" in grid.query(400, 2, 5)
+
+def test_box_wider_than_the_grid_touches_each_cell_once():
+    grid = SpatialHash(cell_size=64)
+    cells = list(grid.cell_range(-100, -100, SCREEN_WIDTH + 100, SCREEN_HEIGHT + 100))
+    assert len(cells) == len(set(cells)) == grid.cols * grid.rows
+    grid.insert("huge", SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, SCREEN_WIDTH)
+    assert grid.query(0, 0, 1) == ["huge"]
+
+def test_clear_empties_the_grid():
+    grid = SpatialHash()
+    grid.insert("a", 100, 100, 10)
+    grid.clear()
+    assert grid.query(100, 100, 10) == []
+
+def close_pairs_brute_force(query_x, query_y, x, y, radius):
+    dx = query_x[:, None] - x[None, :]
+    dy = query_y[:, None] - y[None, :]
+    dx -= SCREEN_WIDTH * np.round(dx / SCREEN_WIDTH)
+    dy -= SCREEN_HEIGHT * np.round(dy / SCREEN_HEIGHT)
+    i, j = np.nonzero(dx * dx + dy * dy < radius * radius)
+    return set(zip(i.tolist(), j.tolist()))
+
+@pytest.mark.parametrize("radius", [12, 33, 64, 350])
+def test_grid_pairs_include_every_close_pair_across_the_edges(radius):
+    rng = np.random.default_rng(radius)
+    # Crowd the points along the edges and corners so many pairs wrap
+    x = np.concatenate([rng.uniform(0, SCREEN_WIDTH, 200), rng.uniform(-5, 20, 100),
+                        rng.uniform(SCREEN_WIDTH - 20, SCREEN_WIDTH, 100)])
+    y = np.concatenate([rng.uniform(0, SCREEN_HEIGHT, 200), rng.uniform(SCREEN_HEIGHT - 20, SCREEN_HEIGHT + 5, 100),
+                        rng.uniform(0, 20, 100)])
+    query_x = rng.uniform(0, SCREEN_WIDTH, 150)
+    query_y = rng.uniform(0, SCREEN_HEIGHT, 150)
+    for qx, qy in ((query_x, query_y), (x, y)):
+        assert len(qx) * len(x) > GRID_PAIRS_DENSE_LIMIT
+        i, j = grid_pairs(qx, qy, x, y, radius)
+        pairs = set(zip(i.tolist(), j.tolist()))
+        assert len(pairs) == len(i)  # No pair twice
+        assert close_pairs_brute_force(qx, qy, x, y, radius) <= pairs
+
+def test_grid_pairs_of_small_groups_are_every_pair():
+    x = np.array([1.0, 400.0, 799.0])
+    y = np.array([1.0, 300.0, 599.0])
+    i, j = grid_pairs(x[:2], y[:2], x, y, 10)
+    assert sorted(zip(i.tolist(), j.tolist())) == [(a, b) for a in range(2) for b in range(3)]
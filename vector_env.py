@@ -0,0 +1,381 @@
+import os
+
+# Workers never open a window or play sounds
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import argparse
+import math
+import multiprocessing
+import random
+import sys
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from flight_game import Game, InputState, ProjectileManager, SCREEN_WIDTH, SCREEN_HEIGHT, TICK_RATE
+
+# Vectorized training environments. Many independent Games are stepped with
+# a batch of actions and return a batch of observations, rewards and done
+# flags. The games are spread over worker processes that write their results
+# straight into shared memory, so a step only sends a one word command down
+# each worker's pipe.
+
+# An action is an InputState mask: left 1, right 2, up 4, down 8, shoot 16
+ACTION_COUNT = 32
+
+# Observation layout: the player, then the nearest few of each kind of
+# object, closest first. Positions are offsets from the player across the
+# wrapping screen edges, scaled so half a screen is 1. Unused object rows are
+# all zero; the first feature of a row is 1 when it holds an object.
+PLAYER_FEATURES = 14  # x, y, sin, cos, speed, max speed, fuel, health, invincible,
+                      # shot ready, wave, wave progress, wave transition, height above terrain
+OBSTACLE_SLOTS, OBSTACLE_FEATURES = 8, 5  # present, dx, dy, size, speed
+ENEMY_SLOTS, ENEMY_FEATURES = 8, 6  # present, dx, dy, sin, cos, health
+BULLET_SLOTS, BULLET_FEATURES = 16, 5  # present, dx, dy, vx, vy (enemy bullets only)
+COLLECTIBLE_SLOTS, COLLECTIBLE_FEATURES = 4, 6  # present, dx, dy, fuel, health, speed
+
+OBSERVATION_LAYOUT = [
+    ("player", 1, PLAYER_FEATURES),
+    ("obstacles", OBSTACLE_SLOTS, OBSTACLE_FEATURES),
+    ("enemies", ENEMY_SLOTS, ENEMY_FEATURES),
+    ("bullets", BULLET_SLOTS, BULLET_FEATURES),
+    ("collectibles", COLLECTIBLE_SLOTS, COLLECTIBLE_FEATURES),
+]
+OBSERVATION_SLICES = {}
+OBSERVATION_SIZE = 0
+for _name, _slots, _features in OBSERVATION_LAYOUT:
+    OBSERVATION_SLICES[_name] = slice(OBSERVATION_SIZE, OBSERVATION_SIZE + _slots * _features)
+    OBSERVATION_SIZE += _slots * _features
+
+COLLECTIBLE_TYPES = {"fuel": 0, "health": 1, "speed": 2}
+COLLECTIBLE_ONE_HOT = np.eye(len(COLLECTIBLE_TYPES))
+
+def fill_nearest(rows, x, y, player_x, player_y, columns):
+    # Writes the objects closest to the player into rows, nearest first.
+    # columns returns the per-object features after present, dx and dy; it
+    # is only called when there are objects.
+    rows[:] = 0
+    if len(x) == 0:
+        return
+    # Shortest offsets from the player, the screen wraps on both axes
+    dx = (np.asarray(x, dtype=np.float64) - player_x + SCREEN_WIDTH / 2) % SCREEN_WIDTH - SCREEN_WIDTH / 2
+    dy = (np.asarray(y, dtype=np.float64) - player_y + SCREEN_HEIGHT / 2) % SCREEN_HEIGHT - SCREEN_HEIGHT / 2
+    distance_sq = dx * dx + dy * dy
+    count = min(len(rows), len(dx))
+    if len(dx) > count:
+        order = np.argpartition(distance_sq, count - 1)[:count]
+        order = order[np.argsort(distance_sq[order])]
+    else:
+        order = np.argsort(distance_sq)
+    rows[:count, 0] = 1
+    rows[:count, 1] = dx[order] / (SCREEN_WIDTH / 2)
+    rows[:count, 2] = dy[order] / (SCREEN_HEIGHT / 2)
+    rows[:count, 3:] = columns()[order]
+
+def observe(game, out):
+    # Writes the observation of a game into out, a float32 array of OBSERVATION_SIZE
+    plane = game.airplane
+    angle_rad = math.radians(plane.angle)
+    now = game.clock.get_ticks()
+    out[OBSERVATION_SLICES["player"]] = (
+        plane.x / SCREEN_WIDTH,
+        plane.y / SCREEN_HEIGHT,
+        math.sin(angle_rad),
+        math.cos(angle_rad),
+        plane.speed / 15,
+        plane.max_speed / 15,
+        plane.fuel / 100,
+        plane.health / 100,
+        plane.invincible,
+        now - plane.last_shot_time > plane.shoot_delay,
+        game.current_wave / game.max_waves,
+        min(1, (now - game.wave_start_time) / game.wave_duration),
+        game.wave_transition,
+        (game.terrain.surface_y_list[min(SCREEN_WIDTH, max(0, int(round(plane.x))))] - plane.y) / SCREEN_HEIGHT,
+    )
+    x, y = plane.x, plane.y
+
+    obstacles = game.obstacles
+    fill_nearest(out[OBSERVATION_SLICES["obstacles"]].reshape(OBSTACLE_SLOTS, OBSTACLE_FEATURES),
+                 [o.x for o in obstacles], [o.y for o in obstacles], x, y,
+                 lambda: np.array([(o.size / 25, o.speed / 3) for o in obstacles]))
+
+    squadron = game.squadron
+    def enemy_columns():
+        angles = np.radians(squadron.angle)
+        return np.column_stack((np.sin(angles), np.cos(angles), squadron.health / squadron.config["health"]))
+    fill_nearest(out[OBSERVATION_SLICES["enemies"]].reshape(ENEMY_SLOTS, ENEMY_FEATURES),
+                 squadron.x, squadron.y, x, y, enemy_columns)
+
+    projectiles = game.projectiles
+    slots = projectiles.slots(ProjectileManager.ENEMY)
+    fill_nearest(out[OBSERVATION_SLICES["bullets"]].reshape(BULLET_SLOTS, BULLET_FEATURES),
+                 projectiles.x[slots], projectiles.y[slots], x, y,
+                 lambda: np.column_stack((projectiles.vx[slots] / 10, projectiles.vy[slots] / 10)))
+
+    collectibles = game.collectibles
+    fill_nearest(out[OBSERVATION_SLICES["collectibles"]].reshape(COLLECTIBLE_SLOTS, COLLECTIBLE_FEATURES),
+                 [c.x for c in collectibles], [c.y for c in collectibles], x, y,
+                 lambda: COLLECTIBLE_ONE_HOT[[COLLECTIBLE_TYPES[c.type] for c in collectibles]])
+
+class Environment:
+    # One Game driven by action masks. The game code draws from the global
+    # random generator, so each environment swaps its own generator state in
+    # and out around a step: episodes only depend on their seed and actions
+    # however many environments share a process, and can be saved as an
+    # InputRecording and replayed in the game.
+    def __init__(self, seed=0, seed_stride=1, action_repeat=1, max_ticks=0, swarm=0, tick_rate=TICK_RATE):
+        self.next_seed = seed
+        self.seed_stride = seed_stride  # Added to the seed for each new episode
+        self.action_repeat = action_repeat  # Simulation ticks per step
+        self.max_ticks = max_ticks  # Episodes are cut off after this many ticks, 0 for no limit
+        self.swarm = swarm
+        self.tick_rate = tick_rate
+        self.game = None
+        self.seed = None
+        self.ticks = 0
+        self.random_state = None
+
+    def reset(self):
+        self.seed = self.next_seed
+        self.next_seed += self.seed_stride
+        self.game = Game(self.tick_rate, high_score=0, seed=self.seed, swarm=self.swarm, announce=False)
+        # Particles only use their own generator, seed it too
+        self.game.airplane.particles.rng = np.random.default_rng(self.seed)
+        self.random_state = random.getstate()
+        self.ticks = 0
+
+    def step(self, action):
+        # Returns the score gained and whether the episode ended
+        game = self.game
+        controls = InputState.from_mask(int(action))
+        score = game.score
+        random.setstate(self.random_state)
+        for _ in range(self.action_repeat):
+            game.update(controls)
+            self.ticks += 1
+            if game.game_over or game.victory:
+                break
+        self.random_state = random.getstate()
+        done = game.game_over or game.victory or (self.max_ticks and self.ticks >= self.max_ticks)
+        return game.score - score, bool(done)
+
+    def observe(self, out):
+        observe(self.game, out)
+
+class SharedBuffers:
+    # The arrays exchanged with the workers, laid out in one shared memory
+    # block. The episode_* arrays hold the result of the episode that ended
+    # on the last step, for the environments that are done.
+    FIELDS = [
+        ("observations", np.float32, (OBSERVATION_SIZE,)),
+        ("actions", np.uint8, ()),
+        ("rewards", np.float32, ()),
+        ("dones", np.bool_, ()),
+        ("seeds", np.int64, ()),  # Seed of the running episode
+        ("episode_score", np.int64, ()),
+        ("episode_wave", np.int64, ()),
+        ("episode_ticks", np.int64, ()),
+    ]
+
+    def __init__(self, num_envs, name=None):
+        layout = []
+        size = 0
+        for field, dtype, shape in self.FIELDS:
+            shape = (num_envs,) + shape
+            layout.append((field, dtype, shape, size))
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            size += (nbytes + 7) // 8 * 8  # Keep every array 8 byte aligned
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=max(1, size))
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        for field, dtype, shape, offset in layout:
+            setattr(self, field, np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset))
+
+    def close(self, unlink=False):
+        # The arrays must go before the memory they point into
+        for field, _, _ in self.FIELDS:
+            setattr(self, field, None)
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+class EnvironmentGroup:
+    # The environments of one worker, a slice of the shared buffers
+    def __init__(self, buffers, first, count, seed, seed_stride, options):
+        self.buffers = buffers
+        self.first = first
+        self.environments = [Environment(seed + first + i, seed_stride, **options) for i in range(count)]
+
+    def finish(self, index, environment):
+        buffers = self.buffers
+        game = environment.game
+        buffers.episode_score[index] = game.score
+        buffers.episode_wave[index] = game.current_wave
+        buffers.episode_ticks[index] = environment.ticks
+
+    def reset(self):
+        buffers = self.buffers
+        for index, environment in enumerate(self.environments, self.first):
+            environment.reset()
+            environment.observe(buffers.observations[index])
+            buffers.seeds[index] = environment.seed
+            buffers.rewards[index] = 0
+            buffers.dones[index] = False
+
+    def step(self):
+        # Finished episodes start over right away; the observation returned
+        # for them is the first of the new episode
+        buffers = self.buffers
+        for index, environment in enumerate(self.environments, self.first):
+            reward, done = environment.step(buffers.actions[index])
+            buffers.rewards[index] = reward
+            buffers.dones[index] = done
+            if done:
+                self.finish(index, environment)
+                environment.reset()
+                buffers.seeds[index] = environment.seed
+            environment.observe(buffers.observations[index])
+
+def run_worker(connection, name, num_envs, first, count, seed, options):
+    # Worker process loop: waits for a command, runs it on its environments
+    # and answers with None, or the traceback when it failed
+    buffers = SharedBuffers(num_envs, name)
+    group = EnvironmentGroup(buffers, first, count, seed, num_envs, options)
+    try:
+        while True:
+            try:
+                command = connection.recv()
+            except EOFError:
+                break
+            if command == "close":
+                break
+            try:
+                getattr(group, command)()
+                connection.send(None)
+            except Exception:
+                connection.send(traceback.format_exc())
+    finally:
+        group = None
+        buffers.close()
+
+class VectorEnv:
+    # num_envs games stepped in lockstep by worker processes (in this
+    # process when workers is 0). reset() and step() return views of the
+    # shared buffers, which the next call overwrites: copy what you keep.
+    # Environment i plays seeds seed + i, seed + i + num_envs, ...
+    def __init__(self, num_envs, workers=None, seed=0, **options):
+        # options go to Environment: action_repeat, max_ticks, swarm, tick_rate
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, num_envs)
+        self.num_envs = num_envs
+        self.buffers = SharedBuffers(num_envs)
+        self.connections = []
+        self.processes = []
+        self.group = None
+        if workers == 0:
+            self.group = EnvironmentGroup(self.buffers, 0, num_envs, seed, num_envs, options)
+        else:
+            context = multiprocessing.get_context()
+            for indices in np.array_split(np.arange(num_envs), workers):
+                connection, worker_connection = context.Pipe()
+                process = context.Process(target=run_worker, daemon=True,
+                                          args=(worker_connection, self.buffers.name, num_envs,
+                                                int(indices[0]), len(indices), seed, options))
+                process.start()
+                worker_connection.close()
+                self.connections.append(connection)
+                self.processes.append(process)
+        self.closed = False
+
+    def run(self, command):
+        if self.group is not None:
+            getattr(self.group, command)()
+            return
+        # Start every worker before waiting on any of them
+        for connection in self.connections:
+            connection.send(command)
+        errors = [connection.recv() for connection in self.connections]
+        for error in errors:
+            if error is not None:
+                raise RuntimeError(f"Environment worker failed:\n{error}")
+
+    def reset(self):
+        # Starts a new episode everywhere, returns the observations
+        self.run("reset")
+        return self.buffers.observations
+
+    def step(self, actions):
+        # actions: one mask per environment. Returns the observations, the
+        # score gained during the step and whether the episode ended.
+        self.buffers.actions[:] = actions
+        self.run("step")
+        return self.buffers.observations, self.buffers.rewards, self.buffers.dones
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for connection in self.connections:
+            try:
+                connection.send("close")
+            except OSError:
+                pass  # The worker is already gone
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.group = None
+        self.buffers.close(unlink=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the throughput of the vectorized environments")
+    parser.add_argument("--envs", type=int, default=64,
+                        help="number of environments (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes, 0 to step in this process (default: one per core)")
+    parser.add_argument("--steps", type=int, default=500,
+                        help="batched steps to time (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the first environment (default: %(default)s)")
+    parser.add_argument("--action-repeat", type=int, default=1,
+                        help="simulation ticks per step (default: %(default)s)")
+    parser.add_argument("--max-ticks", type=int, default=0,
+                        help="cut episodes off after this many ticks, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--swarm", type=int, default=0,
+                        help="swarm size of the final wave, 0 for the classic squadron (default: %(default)s)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    rng = np.random.default_rng(options.seed)
+    with VectorEnv(options.envs, options.workers, options.seed, action_repeat=options.action_repeat,
+                   max_ticks=options.max_ticks, swarm=options.swarm) as env:
+        env.reset()
+        episodes = 0
+        begin = time.perf_counter()
+        for _ in range(options.steps):
+            _, _, dones = env.step(rng.integers(0, ACTION_COUNT, options.envs))
+            episodes += int(dones.sum())
+        elapsed = time.perf_counter() - begin
+        workers = len(env.processes)
+    steps = options.envs * options.steps
+    print(f"{options.envs} environments, {workers} workers: {steps / elapsed:.0f} steps/s "
+          f"({steps * options.action_repeat / elapsed:.0f} ticks/s), {episodes} episodes finished")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())